@@ -8,11 +8,14 @@ env = app.node.try_get_context("environment")
 region_aws = app.node.try_get_context("region_aws")
 is_dev_raw = app.node.try_get_context("is_development")
 is_dev = str(is_dev_raw).lower() == "true"
+create_read_replica = str(app.node.try_get_context("create_read_replica")).lower() == "true"
+authorizer_cache_ttl_seconds = int(app.node.try_get_context("authorizer_cache_ttl_seconds") or 30)
+jwt_audience = app.node.try_get_context("jwt_audience") or ""
 
 
 if not env:
     raise Exception("Missing context variable: env. Use 'cdk deploy -c env=dev'")
 
-MainStack(app, f"MainStack-{env}", env, is_dev)
+MainStack(app, f"MainStack-{env}", env, is_dev, create_read_replica, authorizer_cache_ttl_seconds, jwt_audience)
 
 app.synth()
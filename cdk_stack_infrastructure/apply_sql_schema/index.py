@@ -39,6 +39,7 @@ def handler(event, context):
 
     # Get secret
     try:
+        # Runs once per deployment, so there is nothing to gain from caching the client or secret
         client = boto3.client("secretsmanager")
         secret_value = client.get_secret_value(SecretId=secret_name)
         secret = json.loads(secret_value["SecretString"])
@@ -128,6 +129,10 @@ def handler(event, context):
             customer_id INTEGER REFERENCES myschema1.customers(customer_id)
             -- Removed duplicate FOREIGN KEY constraint
         );
+
+        -- Orders of a customer by date, used by GET /customers?include=orders
+        CREATE INDEX IF NOT EXISTS orders_customer_id_order_date_idx
+            ON myschema1.orders (customer_id, order_date);
         """
 
         logger.info("Executing schema SQL...")
@@ -1,10 +1,22 @@
+import base64
 import boto3
+import functools
+import gzip
+import hashlib
+import io
 import os
 import json
 import logging
+import math
 import pg8000
-from decimal import Decimal
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
 import datetime
+from lambda_common import InvocationMetrics, SecretCache
 
 # Environment variables
 SECRET_NAME = os.getenv("SECRET_NAME")
@@ -12,48 +24,924 @@ RDS_SECRET_NAME = os.getenv("RDS_SECRET_NAME")
 REGION = str(os.getenv("REGION", "eu-west-1"))
 DB_NAME = str(os.getenv("DB_NAME", "database_rds"))
 DB_HOST = os.getenv("DB_HOST")
+DB_READER_HOST = os.getenv("DB_READER_HOST")
 DB_PORT = int(os.getenv("DB_PORT", 5432))
 DB_SCHEMA= "myschema1"
+DB_MAX_IDLE_SECONDS = int(os.getenv("DB_MAX_IDLE_SECONDS", 300))
+DB_HEALTH_CHECK_INTERVAL = int(os.getenv("DB_HEALTH_CHECK_INTERVAL", 30))
+DB_READ_YOUR_WRITES_SECONDS = int(os.getenv("DB_READ_YOUR_WRITES_SECONDS", 5))
+DB_CONNECT_TIMEOUT_SECONDS = int(os.getenv("DB_CONNECT_TIMEOUT_SECONDS", 5))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 5000))
+DB_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("DB_CIRCUIT_FAILURE_THRESHOLD", 5))
+DB_CIRCUIT_RESET_SECONDS = int(os.getenv("DB_CIRCUIT_RESET_SECONDS", 30))
+PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv("PREPARED_STATEMENT_CACHE_SIZE", 64))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", 1024))
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL_SECONDS", 30))
+BATCH_MAX_IDS = int(os.getenv("BATCH_MAX_IDS", 50))
+BULK_UPDATE_MAX_RECORDS = int(os.getenv("BULK_UPDATE_MAX_RECORDS", 1000))
+LIST_DEFAULT_LIMIT = int(os.getenv("LIST_DEFAULT_LIMIT", 100))
+LIST_MAX_LIMIT = int(os.getenv("LIST_MAX_LIMIT", 1000))
+EXPORT_BUCKET = os.getenv("EXPORT_BUCKET")
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", 1000))
+EXPORT_PART_SIZE = max(int(os.getenv("EXPORT_PART_SIZE", 8 * 1024 * 1024)), 5 * 1024 * 1024)
+EXPORT_URL_TTL_SECONDS = int(os.getenv("EXPORT_URL_TTL_SECONDS", 3600))
+# Exports run on this function, invoked asynchronously, so API Gateway's timeout doesn't apply
+EXPORT_FUNCTION_NAME = os.getenv("EXPORT_FUNCTION_NAME")
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", 1024))
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", 6))
+# Content codings of compressed responses, in order of preference
+CONTENT_CODINGS = ("gzip", "deflate")
+TRUST_AUTHORIZER_CONTEXT = os.getenv("TRUST_AUTHORIZER_CONTEXT", "true").lower() == "true"
+RATE_LIMIT_TABLE = os.getenv("RATE_LIMIT_TABLE")
+RATE_LIMIT_CAPACITY = int(os.getenv("RATE_LIMIT_CAPACITY", 40))
+RATE_LIMIT_REFILL_PER_SECOND = float(os.getenv("RATE_LIMIT_REFILL_PER_SECOND", 20))
+# Per route overrides, e.g. {"GET /orders": {"capacity": 10, "refill_per_second": 5}}
+RATE_LIMITS = json.loads(os.getenv("RATE_LIMITS") or "{}")
+# Tokens a container takes from a shared bucket at once, and how long it may hand them out
+RATE_LIMIT_LEASE_SIZE = int(os.getenv("RATE_LIMIT_LEASE_SIZE", 10))
+RATE_LIMIT_LEASE_SECONDS = float(os.getenv("RATE_LIMIT_LEASE_SECONDS", 1))
+RATE_LIMIT_STORE_RETRY_SECONDS = int(os.getenv("RATE_LIMIT_STORE_RETRY_SECONDS", 10))
+# ID filters are only used when the insert Lambda publishes the IDs it loads to this table
+ID_FILTER_UPDATES_TABLE = os.getenv("ID_FILTER_UPDATES_TABLE")
+ID_FILTER_FALSE_POSITIVE_RATE = float(os.getenv("ID_FILTER_FALSE_POSITIVE_RATE", 0.01))
+ID_FILTER_MIN_CAPACITY = int(os.getenv("ID_FILTER_MIN_CAPACITY", 10000))
+ID_FILTER_MAX_ROWS = int(os.getenv("ID_FILTER_MAX_ROWS", 500000))
+ID_FILTER_FETCH_SIZE = int(os.getenv("ID_FILTER_FETCH_SIZE", 10000))
+# How long the filter is bypassed after its updates or a build couldn't be read
+ID_FILTER_REFRESH_SECONDS = int(os.getenv("ID_FILTER_REFRESH_SECONDS", 5))
+ID_FILTER_REBUILD_SECONDS = int(os.getenv("ID_FILTER_REBUILD_SECONDS", 3600))
+SHARED_CACHE_TABLE = os.getenv("SHARED_CACHE_TABLE")
+SHARED_CACHE_TTL_SECONDS = int(os.getenv("SHARED_CACHE_TTL_SECONDS", 300))
+SHARED_CACHE_TOMBSTONE_SECONDS = int(os.getenv("SHARED_CACHE_TOMBSTONE_SECONDS", 10))
+# Part of every shared cache key; bump it when the cached record format changes
+SHARED_CACHE_KEY_VERSION = os.getenv("SHARED_CACHE_KEY_VERSION", "2")
+
+CUSTOMER_COLUMNS = ["customer_id", "first_name", "last_name", "email", "phone", "address"]
+ORDER_COLUMNS = ["order_id", "order_date", "total_amount", "customer_id"]
+# How PostgreSQL renders columns that have no JSON type of their own; numeric columns stay JSON
+# numbers with their exact scale
+JSON_COLUMN_FORMATS = {"order_date": "to_char({column}, 'YYYY-MM-DD')"}
+EXPORT_TABLES = {"customers": CUSTOMER_COLUMNS, "orders": ORDER_COLUMNS}
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-client = boto3.client("secretsmanager", region_name=REGION)
 
-def get_db_credentials(NAME_SECRET):
+metrics = InvocationMetrics(os.getenv("AWS_LAMBDA_FUNCTION_NAME", "lambda_rest_api"))
+
+
+@functools.lru_cache(maxsize=None)
+def get_client(service_name):
+    """Creates a boto3 client on first use and reuses it for the lifetime of the container."""
+    return boto3.client(service_name, region_name=REGION)
+
+
+secrets_cache = SecretCache(functools.partial(get_client, "secretsmanager"), metrics=metrics)
+
+
+def get_db_credentials(NAME_SECRET, force_refresh=False, cache=secrets_cache):
     try:
-        response = client.get_secret_value(SecretId=NAME_SECRET)
-        secret = json.loads(response["SecretString"])
-        logger.info("Database secret retrieved successfully.")
-        return secret
+        if force_refresh:
+            return cache.refresh(NAME_SECRET)
+        return cache.get(NAME_SECRET)
     except Exception as e:
         logger.error(f"Error retrieving secret: {e}")
         raise
 
 
+def is_authentication_error(error):
+    """True when PostgreSQL rejected the credentials (e.g. the password was rotated)."""
+    details = error.args[0] if error.args else None
+    return isinstance(details, dict) and details.get("C") in ("28P01", "28000")
 
-def query_db(query, params):
-    """Connects to PostgreSQL and executes a query."""
-    db_details = get_db_credentials(RDS_SECRET_NAME)
 
-    try:
-        conn = pg8000.connect(
-            user="postgres",
-            password=db_details["password"],
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME
+def is_plan_invalidated_error(error):
+    """True when a cached plan no longer matches the tables, e.g. after a column was added."""
+    details = error.args[0] if error.args else None
+    return (
+        isinstance(details, dict)
+        and details.get("C") == "0A000"
+        and "cached plan must not change result type" in details.get("M", "")
+    )
+
+
+class DatabaseUnavailableError(Exception):
+    """The database is failing or overloaded; clients should retry after ``retry_after`` seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_overload_error(error):
+    """True for failures caused by an unreachable or saturated database, not by the request."""
+    if isinstance(error, (pg8000.InterfaceError, OSError)):
+        return True
+    details = error.args[0] if error.args else None
+    # query_canceled (statement_timeout), too_many_connections, cannot_connect_now
+    return isinstance(details, dict) and details.get("C") in ("57014", "53300", "57P03")
+
+
+class CircuitBreaker:
+    """Stops sending requests to a failing database so they fail fast instead of piling up."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name,
+        failure_threshold=DB_CIRCUIT_FAILURE_THRESHOLD,
+        reset_seconds=DB_CIRCUIT_RESET_SECONDS,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def allow(self):
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+            logger.info(f"Circuit {self.name} half-open, probing the database")
+            self.state = self.HALF_OPEN
+        return self.state != self.OPEN
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info(f"Circuit {self.name} closed")
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"Circuit {self.name} open after {self.failures} failures")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def release_probe(self):
+        """Ends a probe that got no answer from the database; a half-open circuit opens again."""
+        if self.state == self.HALF_OPEN:
+            logger.warning(f"Circuit {self.name} probe ended without an answer, opening again")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def retry_after(self):
+        """Seconds until the circuit lets a probe through, at least 1."""
+        if self.state != self.OPEN:
+            return 1
+        return max(1, math.ceil(self.reset_seconds - (time.monotonic() - self.opened_at)))
+
+
+class ConnectionManager:
+    """Keeps one health-checked PostgreSQL connection and its prepared statements open."""
+
+    def __init__(
+        self, host, port, database, user="postgres", secrets=secrets_cache, metrics=metrics
+    ):
+        self.host = host
+        self.port = port
+        self.database = database
+        self.user = user
+        self.secrets = secrets
+        self.metrics = metrics
+        self.breaker = CircuitBreaker(host)
+        self._conn = None
+        self._statements = OrderedDict()
+        self._last_used = 0.0
+        self.connects = 0
+        self.reuses = 0
+        self.prepares = 0
+
+    def _open(self, password):
+        with self.metrics.phase("Connect"):
+            conn = pg8000.connect(
+                user=self.user,
+                password=password,
+                host=self.host,
+                port=self.port,
+                database=self.database,
+                # pg8000 applies the timeout to every socket read, leave room for statement_timeout
+                timeout=DB_CONNECT_TIMEOUT_SECONDS + DB_STATEMENT_TIMEOUT_MS / 1000,
+            )
+            # Reads run without BEGIN/ROLLBACK around them, writes use ``transaction()``
+            conn.autocommit = True
+            if DB_STATEMENT_TIMEOUT_MS:
+                # Session setting, so every statement on this connection is bounded
+                conn.run(f"SET statement_timeout = {DB_STATEMENT_TIMEOUT_MS}")
+            return conn
+
+    def _connect(self):
+        try:
+            conn = self._open(get_db_credentials(RDS_SECRET_NAME, cache=self.secrets)["password"])
+        except pg8000.DatabaseError as e:
+            if not is_authentication_error(e):
+                raise
+            logger.warning("Database authentication failed, reloading credentials")
+            credentials = get_db_credentials(
+                RDS_SECRET_NAME, force_refresh=True, cache=self.secrets
+            )
+            conn = self._open(credentials["password"])
+        self.connects += 1
+        logger.info(f"Opened new database connection to {self.host} (connects={self.connects})")
+        return conn
+
+    def _is_alive(self):
+        idle_for = time.monotonic() - self._last_used
+        if idle_for > DB_MAX_IDLE_SECONDS:
+            logger.info(f"Connection idle for {idle_for:.0f}s, reconnecting")
+            return False
+        if idle_for < DB_HEALTH_CHECK_INTERVAL:
+            return True
+
+        try:
+            # Autocommit, so the probe is a single round trip with no transaction to end
+            self._conn.run("SELECT 1")
+            return True
+        except Exception as e:
+            logger.warning(f"Connection health check failed: {e}")
+            return False
+
+    def get_connection(self):
+        if self._conn is not None and self._is_alive():
+            self.reuses += 1
+        else:
+            self.invalidate()
+            self._conn = self._connect()
+        self._last_used = time.monotonic()
+        return self._conn
+
+    def invalidate(self):
+        """Drops the current connection; the next request opens a fresh one."""
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+        self._conn = None
+        # Prepared statements live in the server session and die with the connection
+        self._statements.clear()
+
+    def prepare(self, key, sql):
+        """Returns the prepared statement for key, preparing sql on first use."""
+        statement = self._statements.get(key)
+        if statement is not None:
+            self._statements.move_to_end(key)
+            return statement
+
+        statement = self._conn.prepare(sql)
+        self._statements[key] = statement
+        self.prepares += 1
+        while len(self._statements) > PREPARED_STATEMENT_CACHE_SIZE:
+            _, evicted = self._statements.popitem(last=False)
+            evicted.close()
+        return statement
+
+    def discard_statement(self, key):
+        """Deallocates the prepared statement for key; it is prepared again on next use."""
+        statement = self._statements.pop(key, None)
+        if statement is not None:
+            statement.close()
+
+    def _unavailable(self, error):
+        self.breaker.record_failure()
+        return DatabaseUnavailableError(
+            f"Database {self.host} unavailable: {error}", self.breaker.retry_after()
         )
-        cursor = conn.cursor()
-        cursor.execute(query, params)
-        result = cursor.fetchall()
-        cursor.close()
-        conn.close()
 
-        return [tuple(row) for row in result]
-    except Exception as e:
-        logger.error(f"Database query error: {e}")
-        return None
+    @contextmanager
+    def connection(self):
+        if not self.breaker.allow():
+            raise DatabaseUnavailableError(
+                f"Circuit for {self.host} is open", self.breaker.retry_after()
+            )
+        try:
+            conn = self.get_connection()
+        except Exception as e:
+            if is_overload_error(e):
+                raise self._unavailable(e) from e
+            self.breaker.release_probe()
+            raise
+
+        try:
+            yield conn
+        except (pg8000.InterfaceError, OSError) as e:
+            # Socket-level failure, the connection can't be reused
+            self.invalidate()
+            raise self._unavailable(e) from e
+        except Exception as e:
+            try:
+                conn.rollback()
+            except Exception:
+                self.invalidate()
+            if is_overload_error(e):
+                raise self._unavailable(e) from e
+            if isinstance(e, pg8000.DatabaseError):
+                # The database answered, the error was caused by the request
+                self.breaker.record_success()
+            else:
+                self.breaker.release_probe()
+            raise
+        except BaseException:
+            self.breaker.release_probe()
+            raise
+        else:
+            self.breaker.record_success()
+        finally:
+            self._last_used = time.monotonic()
+            logger.info(
+                f"Connection stats: connects={self.connects}, reuses={self.reuses}, "
+                f"prepared statements={len(self._statements)} (prepared {self.prepares} in total)"
+            )
+
+    @contextmanager
+    def transaction(self):
+        """Yields the connection in a transaction, rolled back unless the block commits."""
+        with self.connection() as conn:
+            conn.autocommit = False
+            try:
+                yield conn
+                conn.rollback()
+            finally:
+                conn.autocommit = True
+
+
+class ReadRouter:
+    """Sends reads to the reader, or the primary for callers that just wrote via this container."""
+
+    def __init__(self, primary, reader=None, pin_seconds=DB_READ_YOUR_WRITES_SECONDS):
+        self.primary = primary
+        self.reader = reader
+        self.pin_seconds = pin_seconds
+        # Only this container knows about the write, a GET served by another container can still
+        # read replica data from before it
+        self._last_writes = {}
+        self._current = primary
+
+    @staticmethod
+    def _writer_key(token):
+        # Only a digest of the token is kept in memory
+        return hashlib.sha256((token or "").encode()).hexdigest()
+
+    def route(self, method, token):
+        """Selects the connection for the reads of the current request."""
+        self._current = self.primary
+        if self.reader is not None and method == "GET":
+            written_at = self._last_writes.get(self._writer_key(token))
+            if written_at is None or time.monotonic() - written_at >= self.pin_seconds:
+                self._current = self.reader
+        endpoint = "reader" if self._current is self.reader else "primary"
+        metrics.set_property("ReadEndpoint", endpoint)
+        return self._current
+
+    def record_write(self, token):
+        if self.reader is None or self.pin_seconds <= 0:
+            return
+        now = time.monotonic()
+        self._last_writes = {
+            key: written_at
+            for key, written_at in self._last_writes.items()
+            if now - written_at < self.pin_seconds
+        }
+        self._last_writes[self._writer_key(token)] = now
+
+    def connections(self):
+        return self._current
+
+
+# Module level so the connections survive between warm invocations
+db_connections = ConnectionManager(DB_HOST, DB_PORT, DB_NAME)
+reader_connections = ConnectionManager(DB_READER_HOST, DB_PORT, DB_NAME) if DB_READER_HOST else None
+db_router = ReadRouter(db_connections, reader_connections)
+
+
+def query_db(key, query, **params):
+    """Executes a prepared read query on the connection chosen by ``db_router``."""
+    connections = db_router.connections()
+    with connections.connection() as conn, metrics.phase("Query"):
+        try:
+            # Autocommit: one round trip, no transaction is left open
+            rows = connections.prepare(key, query).run(**params)
+        except pg8000.DatabaseError as e:
+            logger.error(f"Database query error: {e}")
+            if is_plan_invalidated_error(e):
+                # The schema changed under the cached plan, prepare the statement again next time
+                connections.discard_statement(key)
+            raise
+
+    metrics.count("Rows", len(rows))
+    return [tuple(row) for row in rows]
+
+
+class LRUCache:
+    """Bounded least-recently-used cache with a per-entry TTL for looked up rows."""
+
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() >= entry[1]:
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+# Module level so hot rows stay cached between warm invocations
+result_cache = LRUCache(RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_TTL_SECONDS)
+
+
+class InMemorySharedCache:
+    """Stand-in for the shared cache, kept in the container's memory. Used locally and in tests."""
+
+    def __init__(
+        self,
+        ttl_seconds=SHARED_CACHE_TTL_SECONDS,
+        tombstone_seconds=SHARED_CACHE_TOMBSTONE_SECONDS,
+        clock=time.time,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.tombstone_seconds = tombstone_seconds
+        self.clock = clock
+        self._items = {}
+
+    def get_many(self, keys):
+        now = self.clock()
+        items = {key: self._items.get(key) for key in keys}
+        return {key: item["value"] for key, item in items.items()
+                if item and "value" in item and item["expires_at"] > now}
+
+    def set(self, key, value):
+        now = self.clock()
+        item = self._items.get(key)
+        if item and item.get("tombstone_until", 0) >= now:
+            return
+        self._items[key] = {"value": value, "expires_at": now + self.ttl_seconds}
+
+    def invalidate_many(self, keys):
+        tombstone_until = self.clock() + self.tombstone_seconds
+        for key in keys:
+            self._items[key] = {"tombstone_until": tombstone_until, "expires_at": tombstone_until}
+
+
+class DynamoDBSharedCache:
+    """Records cached for all containers in a DynamoDB table, as their JSON text."""
+
+    MAX_ATTEMPTS = 3
+    # BatchGetItem and BatchWriteItem limits
+    GET_BATCH_SIZE = 100
+    WRITE_BATCH_SIZE = 25
+
+    def __init__(self, table_name, ttl_seconds=SHARED_CACHE_TTL_SECONDS,
+                 tombstone_seconds=SHARED_CACHE_TOMBSTONE_SECONDS, clock=time.time):
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+        self.tombstone_seconds = tombstone_seconds
+        self.clock = clock
+
+    def get_many(self, keys):
+        found = {}
+        keys = list(dict.fromkeys(keys))
+        now = self.clock()
+        try:
+            with metrics.phase("SharedCache"):
+                for start in range(0, len(keys), self.GET_BATCH_SIZE):
+                    batch = keys[start:start + self.GET_BATCH_SIZE]
+                    request = {self.table_name: {"Keys": [{"pk": {"S": key}} for key in batch]}}
+                    for _ in range(self.MAX_ATTEMPTS):
+                        response = get_client("dynamodb").batch_get_item(RequestItems=request)
+                        for item in response.get("Responses", {}).get(self.table_name, []):
+                            if "value" in item and float(item["expires_at"]["N"]) > now:
+                                found[item["pk"]["S"]] = RawJSON(item["value"]["S"])
+                        request = response.get("UnprocessedKeys")
+                        if not request:
+                            break
+        except Exception as e:
+            logger.warning(f"Shared cache unavailable, reading from the database: {e}")
+        return found
+
+    def set(self, key, value):
+        now = self.clock()
+        dynamodb = get_client("dynamodb")
+        try:
+            with metrics.phase("SharedCache"):
+                dynamodb.put_item(
+                    TableName=self.table_name,
+                    Item={
+                        "pk": {"S": key},
+                        "value": {"S": value},
+                        "expires_at": {"N": str(int(now + self.ttl_seconds))},
+                    },
+                    # A row read before a recent update must not put the old version back
+                    ConditionExpression=(
+                        "attribute_not_exists(tombstone_until) OR tombstone_until < :now"
+                    ),
+                    ExpressionAttributeValues={":now": {"N": repr(now)}},
+                )
+        except dynamodb.exceptions.ConditionalCheckFailedException:
+            # The record was just updated, the next read caches the new version
+            pass
+        except Exception as e:
+            logger.warning(f"Could not write {key} to the shared cache: {e}")
+
+    def invalidate_many(self, keys):
+        tombstone_until = self.clock() + self.tombstone_seconds
+        requests = [
+            {"PutRequest": {"Item": {
+                "pk": {"S": key},
+                "tombstone_until": {"N": repr(tombstone_until)},
+                "expires_at": {"N": str(int(tombstone_until) + 1)},
+            }}}
+            for key in dict.fromkeys(keys)
+        ]
+        try:
+            with metrics.phase("SharedCache"):
+                for start in range(0, len(requests), self.WRITE_BATCH_SIZE):
+                    request = {self.table_name: requests[start:start + self.WRITE_BATCH_SIZE]}
+                    for _ in range(self.MAX_ATTEMPTS):
+                        response = get_client("dynamodb").batch_write_item(RequestItems=request)
+                        request = response.get("UnprocessedItems")
+                        if not request:
+                            break
+                    else:
+                        unprocessed = len(request[self.table_name])
+                        raise RuntimeError(f"{unprocessed} invalidations unprocessed")
+        except Exception as e:
+            logger.error(f"Shared cache invalidation failed, cached records expire within "
+                         f"{self.ttl_seconds} seconds: {e}")
+
+
+shared_cache = DynamoDBSharedCache(SHARED_CACHE_TABLE) if SHARED_CACHE_TABLE else None
+
+
+def shared_cache_key(table, record_id):
+    return f"v{SHARED_CACHE_KEY_VERSION}#{table}#{record_id}"
+
+
+def shared_lookup(table, record_ids, loader):
+    """Loads records from the shared cache, falling back to the batch loader for the rest."""
+    if shared_cache is None:
+        return loader(record_ids)
+
+    keys = {shared_cache_key(table, record_id): record_id for record_id in record_ids}
+    records = {keys[key]: record for key, record in shared_cache.get_many(list(keys)).items()}
+    metrics.count("SharedCacheHits", len(records))
+    metrics.count("SharedCacheMisses", len(record_ids) - len(records))
+
+    missing_ids = [record_id for record_id in record_ids if record_id not in records]
+    if missing_ids:
+        for record_id, record in loader(missing_ids).items():
+            if record:
+                shared_cache.set(shared_cache_key(table, record_id), record)
+                records[record_id] = record
+    return records
+
+
+def invalidate_records(table, record_ids):
+    """Drops updated records from this container's result cache and from the shared cache."""
+    for record_id in record_ids:
+        result_cache.invalidate((table, str(record_id)))
+    if shared_cache is not None and record_ids:
+        shared_cache.invalidate_many(
+            [shared_cache_key(table, record_id) for record_id in record_ids]
+        )
+
+
+class BloomFilter:
+    """Set membership with false positives but no false negatives, in a fixed size bit array."""
+
+    def __init__(self, capacity, false_positive_rate):
+        self.capacity = capacity
+        self.size = max(64, math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(str(item).encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        step = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * step) % self.size for i in range(self.hash_count)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item)
+        )
+
+
+class IdFilter:
+    """Bloom filter of the IDs of one table, so lookups of missing IDs skip the database."""
+
+    # Updates are read again for this long after the newest one applied, so an update written
+    # late or by a container with a skewed clock isn't skipped
+    CLOCK_SKEW_MS = 60000
+
+    def __init__(self, table, id_column, updates_table, clock=time.time):
+        self.table = table
+        self.id_column = id_column
+        self.updates_table = updates_table
+        self.clock = clock
+        self.filter = None
+        self.built_at = None
+        self.applied_until_ms = None
+        self._applied_updates = {}
+        self._lock = threading.Lock()
+        self._builder = None
+        self._build_retry_at = 0
+        self._retry_at = 0
+        self.hits = 0
+        self.passes = 0
+        self.false_positives = 0
+
+    def check(self, record_id):
+        """False when the ID doesn't exist, True when it may, None when the filter can't tell."""
+        return self.check_many([record_id])[record_id]
+
+    def check_many(self, record_ids):
+        """Verdicts of ``check`` for a batch of IDs, confirming all misses with one refresh."""
+        if not self._ready():
+            return {record_id: None for record_id in record_ids}
+        # Misses may have been published since the last refresh, one consistent read of the
+        # updates confirms all of them
+        if any(record_id not in self.filter for record_id in record_ids):
+            if not self._refresh(consistent_read=True):
+                return {record_id: None for record_id in record_ids}
+        verdicts = {record_id: record_id in self.filter for record_id in record_ids}
+        hits = sum(1 for verdict in verdicts.values() if not verdict)
+        self.passes += len(verdicts) - hits
+        self.hits += hits
+        if hits:
+            metrics.count("IdFilterHits", hits)
+        return verdicts
+
+    def record_false_positive(self):
+        """Called when an ID the filter let through wasn't found."""
+        self.false_positives += 1
+        metrics.count("IdFilterFalsePositives", 1)
+
+    def stats(self):
+        checks = self.hits + self.passes
+        return {
+            "ids": self.filter.count if self.filter else 0,
+            "bytes": len(self.filter.bits) if self.filter else 0,
+            "hits": self.hits,
+            "passes": self.passes,
+            "false_positives": self.false_positives,
+            "hit_rate": round(self.hits / checks, 4) if checks else 0.0,
+            "false_positive_rate": (
+                round(self.false_positives / self.passes, 4) if self.passes else 0.0
+            ),
+        }
+
+    def _ready(self):
+        now = time.monotonic()
+        if (self.filter is None or now - self.built_at >= ID_FILTER_REBUILD_SECONDS
+                or self.filter.count > self.filter.capacity) and now >= self._build_retry_at:
+            self._start_build()
+        return self.filter is not None and now >= self._retry_at
+
+    def _start_build(self):
+        """Builds the filter in a background thread; lookups keep using the current one."""
+        if self._builder is not None and self._builder.is_alive():
+            return
+        self._builder = threading.Thread(
+            target=self._build, name=f"id-filter-{self.table}", daemon=True
+        )
+        self._builder.start()
+
+    def _build(self):
+        try:
+            # One build at a time on the filters' own connection, the handler's isn't thread-safe
+            with id_filter_build_lock:
+                try:
+                    self._scan_ids()
+                finally:
+                    id_filter_connections.invalidate()
+        except Exception as e:
+            logger.warning(f"ID filter of {self.table} could not be built: {e}")
+            self._build_retry_at = time.monotonic() + ID_FILTER_REFRESH_SECONDS
+
+    def _scan_ids(self):
+        started = time.monotonic()
+        started_at_ms = int(self.clock() * 1000)
+        # Cursors only live inside a transaction
+        with id_filter_connections.transaction() as conn:
+            cursor = conn.cursor()
+            # The planner's row estimate sizes the filter without counting the table
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                (f"{DB_SCHEMA}.{self.table}",),
+            )
+            estimated_rows = max(cursor.fetchone()[0], 0)
+            if estimated_rows > ID_FILTER_MAX_ROWS:
+                with self._lock:
+                    self.filter = None
+                self._build_retry_at = time.monotonic() + ID_FILTER_REBUILD_SECONDS
+                logger.info(f"ID filter of {self.table} disabled: about {estimated_rows} rows")
+                return
+
+            # Room to grow until the next rebuild
+            current_count = self.filter.count if self.filter else 0
+            capacity = max(ID_FILTER_MIN_CAPACITY, 2 * estimated_rows, 2 * current_count)
+            id_filter = BloomFilter(capacity, ID_FILTER_FALSE_POSITIVE_RATE)
+            cursor.execute(f"""
+                DECLARE id_filter_cursor NO SCROLL CURSOR FOR
+                SELECT {self.id_column} FROM {DB_SCHEMA}.{self.table}
+            """)
+            while True:
+                cursor.execute(f"FETCH FORWARD {ID_FILTER_FETCH_SIZE} FROM id_filter_cursor")
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                for row in rows:
+                    id_filter.add(row[0])
+            cursor.execute("CLOSE id_filter_cursor")
+            cursor.close()
+
+        # Swapped in without updates, the next check applies the ones published since the scan began
+        with self._lock:
+            self.filter = id_filter
+            self.built_at = time.monotonic()
+            self.applied_until_ms = started_at_ms
+            self._applied_updates = {}
+        logger.info(
+            f"ID filter of {self.table} built in {time.monotonic() - started:.1f}s: "
+            f"{id_filter.count} IDs, capacity {capacity}, {len(id_filter.bits)} bytes, "
+            f"{id_filter.hash_count} hashes"
+        )
+
+    def _refresh(self, consistent_read=False):
+        """Applies the published updates; False when they can't be read."""
+        try:
+            with self._lock, metrics.phase("IdFilterRefresh"):
+                self._apply_updates(consistent_read)
+            return True
+        except Exception as e:
+            # Misses can't be trusted without the latest updates, use the database for a while
+            logger.warning(f"ID filter of {self.table} unavailable: {e}")
+            self._retry_at = time.monotonic() + ID_FILTER_REFRESH_SECONDS
+            return False
+
+    def _apply_updates(self, consistent_read):
+        """Adds the IDs of updates not applied yet; update keys start with epoch milliseconds."""
+        after = self.applied_until_ms - self.CLOCK_SKEW_MS
+        query_args = {
+            "TableName": self.updates_table,
+            "KeyConditionExpression": "table_name = :table AND update_key > :after",
+            "ExpressionAttributeValues": {
+                ":table": {"S": self.table},
+                ":after": {"S": f"{after:013d}"},
+            },
+            "ConsistentRead": consistent_read,
+        }
+        added = 0
+        while True:
+            response = get_client("dynamodb").query(**query_args)
+            for item in response.get("Items", []):
+                update_key = item["update_key"]["S"]
+                if update_key in self._applied_updates:
+                    continue
+                for record_id in item["ids"]["NS"]:
+                    self.filter.add(int(record_id))
+                added += len(item["ids"]["NS"])
+                self._applied_updates[update_key] = int(update_key[:13])
+            if "LastEvaluatedKey" not in response:
+                break
+            query_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+        self.applied_until_ms = max([self.applied_until_ms, *self._applied_updates.values()])
+        self._applied_updates = {
+            key: published_ms for key, published_ms in self._applied_updates.items()
+            if published_ms > self.applied_until_ms - self.CLOCK_SKEW_MS
+        }
+        if added:
+            logger.info(f"ID filter of {self.table}: added {added} published IDs")
+
+
+@functools.lru_cache(maxsize=None)
+def id_filter_secrets_client():
+    """Secrets Manager client of the ID filter builds, from a boto3 session of their own."""
+    return boto3.session.Session().client("secretsmanager", region_name=REGION)
+
+
+# ID filters are built on a connection of their own, by one background thread at a time. The
+# builds record into metrics that are never emitted, so their phases aren't charged to the request
+# in flight, and don't share boto3's default session, which isn't thread-safe
+id_filter_metrics = InvocationMetrics("id_filter_build", sink=lambda line: None)
+id_filter_connections = ConnectionManager(
+    DB_HOST,
+    DB_PORT,
+    DB_NAME,
+    secrets=SecretCache(id_filter_secrets_client, metrics=id_filter_metrics),
+    metrics=id_filter_metrics,
+)
+id_filter_build_lock = threading.Lock()
+
+id_filters = {
+    table: IdFilter(table, columns[0], ID_FILTER_UPDATES_TABLE)
+    for table, columns in (("customers", CUSTOMER_COLUMNS), ("orders", ORDER_COLUMNS))
+} if ID_FILTER_UPDATES_TABLE else {}
+
+
+def cached_lookup(table, record_id, loader):
+    """Read-through lookup: returns the cached row or loads it and caches it if found."""
+    key = (table, str(record_id))
+    record = result_cache.get(key)
+    if record is None:
+        id_filter = id_filters.get(table)
+        verdict = id_filter.check(record_id) if id_filter else None
+        if verdict is not False:
+            found = shared_lookup(table, [record_id], lambda ids: {record_id: loader(record_id)})
+            record = found.get(record_id)
+            if record:
+                result_cache.set(key, record)
+            elif verdict:
+                id_filter.record_false_positive()
+        if id_filter:
+            logger.info(f"ID filter stats: {id_filter.stats()}")
+    logger.info(f"Result cache stats: {result_cache.stats()}")
+    return record
+
+
+def cached_batch_lookup(table, record_ids, loader):
+    """Batch variant of cached_lookup: only IDs missing from the cache are passed to the loader."""
+    records = {}
+    missing_ids = []
+    for record_id in record_ids:
+        record = result_cache.get((table, str(record_id)))
+        if record is None:
+            missing_ids.append(record_id)
+        else:
+            records[record_id] = record
+
+    id_filter = id_filters.get(table)
+    verdicts = id_filter.check_many(missing_ids) if id_filter and missing_ids else {}
+    missing_ids = [record_id for record_id in missing_ids if verdicts.get(record_id) is not False]
+
+    if missing_ids:
+        for record_id, record in shared_lookup(table, missing_ids, loader).items():
+            result_cache.set((table, str(record_id)), record)
+            records[record_id] = record
+
+    if id_filter:
+        for record_id in missing_ids:
+            if verdicts[record_id] and record_id not in records:
+                id_filter.record_false_positive()
+        logger.info(f"ID filter stats: {id_filter.stats()}")
+    logger.info(f"Result cache stats: {result_cache.stats()}")
+    return records
+
+
+def parse_id_list(raw_ids):
+    """Parses a comma separated list of IDs (e.g. "1,2,3") capped at BATCH_MAX_IDS."""
+    try:
+        record_ids = [int(part) for part in raw_ids.split(",") if part.strip()]
+    except ValueError:
+        raise ValueError(f"Invalid ID list: {raw_ids}")
+
+    if not record_ids:
+        raise ValueError("No IDs provided")
+    if len(record_ids) > BATCH_MAX_IDS:
+        raise ValueError(f"Too many IDs requested, the maximum is {BATCH_MAX_IDS}")
+
+    # Drop duplicates but keep the requested order
+    return list(dict.fromkeys(record_ids))
 
 
 def validate_update_fields(update_fields):
@@ -72,95 +960,675 @@ def validate_update_fields(update_fields):
         if not isinstance(value, valid_fields[field]):
             raise ValueError(f"Invalid type for {field}. Expected {valid_fields[field]}")
 
+class PreconditionFailedError(Exception):
+    """Raised when an If-Match precondition of a conditional update doesn't hold."""
+
+
+def get_header(headers, name):
+    """Case-insensitive header lookup (clients and API Gateway don't agree on header casing)."""
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def compute_etag(payload):
+    """Strong ETag derived from the serialized representation of a record or page."""
+    body = payload if isinstance(payload, str) else json.dumps(payload)
+    return '"' + hashlib.sha256(body.encode()).hexdigest()[:32] + '"'
+
+
+def coded_etag(etag, encoding):
+    """ETag of a representation sent in a content coding, distinct from the identity one."""
+    return f'{etag[:-1]}-{encoding}"' if encoding else etag
+
+
+def etag_matches(header_value, etag, strong=False):
+    """Checks an If-None-Match / If-Match header value against etag."""
+    if not header_value:
+        return False
+    accepted = {etag}
+    if strong:
+        accepted.update(coded_etag(etag, coding) for coding in CONTENT_CODINGS)
+    for candidate in header_value.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            if strong:
+                continue
+            candidate = candidate[2:]
+        if candidate in accepted:
+            return True
+    return False
+
+
+def negotiate_encoding(accept_encoding):
+    """Picks the content coding with the highest q-value in an Accept-Encoding header."""
+    qvalues = {}
+    for token in (accept_encoding or "").lower().split(","):
+        coding, *parameters = [part.strip() for part in token.split(";")]
+        if not coding:
+            continue
+        qvalue = 1.0
+        for parameter in parameters:
+            name, _, value = parameter.replace(" ", "").partition("=")
+            if name == "q":
+                try:
+                    qvalue = float(value)
+                except ValueError:
+                    qvalue = 0.0
+        qvalues[coding] = qvalue
+
+    # A coding named explicitly overrides "*", so "gzip;q=0, *" still excludes gzip
+    ranked = [
+        (qvalues.get(coding, qvalues.get("*", 0.0)), -rank, coding)
+        for rank, coding in enumerate(CONTENT_CODINGS)
+    ]
+    qvalue, _, coding = max(ranked)
+    return coding if qvalue > 0 else None
+
+
+def response_encoding(body, request_headers):
+    """Content coding compress_response sends body in, None for identity."""
+    if not body or len(body) < COMPRESSION_MIN_BYTES:
+        return None
+    return negotiate_encoding(get_header(request_headers, "Accept-Encoding"))
+
+
+class RawJSON(str):
+    """JSON text rendered by PostgreSQL, passed on to the response without parsing it."""
+
+
+def render_json(payload):
+    """Serializes payload like json.dumps, embedding RawJSON values as they are."""
+    if isinstance(payload, RawJSON):
+        return payload
+    if isinstance(payload, dict):
+        items = (f"{json.dumps(str(k))}: {render_json(v)}" for k, v in payload.items())
+        return "{" + ", ".join(items) + "}"
+    if isinstance(payload, (list, tuple)):
+        return "[" + ", ".join(render_json(value) for value in payload) + "]"
+    return json.dumps(payload)
+
+
+def extend_json_object(raw_object, fields):
+    """Adds fields to the end of a JSON object rendered by PostgreSQL."""
+    extra_fields = "".join(f", {json.dumps(k)}: {render_json(v)}" for k, v in fields.items())
+    return RawJSON(raw_object.rstrip()[:-1] + extra_fields + "}")
+
+
+def json_object_sql(columns, alias=None):
+    """SQL expression rendering the columns of a row as a JSON object, in the given order."""
+    fields = []
+    for column in columns:
+        reference = f"{alias}.{column}" if alias else column
+        column_format = JSON_COLUMN_FORMATS.get(column, "{column}")
+        fields.append(f"'{column}', " + column_format.format(column=reference))
+    return f"json_build_object({', '.join(fields)})"
+
+
+def json_response(status_code, payload, headers=None):
+    with metrics.phase("Serialize"):
+        response = {"statusCode": status_code, "body": render_json(payload)}
+    if headers:
+        response["headers"] = headers
+    return response
+
+
+def compress_response(response, request_headers):
+    """Compresses bodies of at least COMPRESSION_MIN_BYTES if the client accepts it."""
+    body = response.get("body")
+    if not body or response.get("isBase64Encoded") or len(body) < COMPRESSION_MIN_BYTES:
+        return response
+
+    encoding = response_encoding(body, request_headers)
+    if encoding is None:
+        # The identity body still depends on Accept-Encoding for caches
+        headers = {**(response.get("headers") or {}), "Vary": "Accept-Encoding"}
+        return {**response, "headers": headers}
+
+    raw = body.encode()
+    with metrics.phase("Compress"):
+        if encoding == "gzip":
+            compressed = gzip.compress(raw, compresslevel=COMPRESSION_LEVEL)
+        else:
+            compressed = zlib.compress(raw, COMPRESSION_LEVEL)
+
+    logger.info(f"Compressed response with {encoding}: {len(raw)} -> {len(compressed)} bytes")
+    headers = dict(response.get("headers") or {})
+    headers.update({
+        "Content-Type": "application/json",
+        "Content-Encoding": encoding,
+        "Vary": "Accept-Encoding",
+    })
+    return {
+        **response,
+        "headers": headers,
+        "body": base64.b64encode(compressed).decode(),
+        "isBase64Encoded": True,
+    }
+
+
+def encode_cursor(table, last_id):
+    """Opaque pagination cursor pointing just after last_id."""
+    raw_cursor = json.dumps({"t": table, "id": last_id}).encode()
+    return base64.urlsafe_b64encode(raw_cursor).decode().rstrip("=")
+
+
+def decode_cursor(table, cursor):
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if position["t"] != table:
+            raise ValueError(f"Cursor belongs to {position['t']}")
+        return int(position["id"])
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+def parse_limit(raw_limit):
+    try:
+        limit = int(raw_limit)
+    except ValueError:
+        raise ValueError(f"Invalid limit: {raw_limit}")
+    if not 1 <= limit <= LIST_MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {LIST_MAX_LIMIT}")
+    return limit
+
+
+def list_records(table, columns, after_id, limit):
+    """Returns one page of a table and its item count, using keyset pagination."""
+    key_column = columns[0]
+    where_clause = f"WHERE {key_column} > :after_id" if after_id is not None else ""
+    params = {"after_id": after_id} if after_id is not None else {}
+
+    # One extra row is fetched to tell whether another page exists, it is left out of the items
+    query = f"""
+        SELECT
+            CAST(COALESCE(
+                json_agg({json_object_sql(columns, "page")} ORDER BY page.{key_column})
+                    FILTER (WHERE page.position <= :page_size),
+                '[]'
+            ) AS text),
+            count(*),
+            max(page.{key_column}) FILTER (WHERE page.position <= :page_size)
+        FROM (
+            SELECT {", ".join(columns)}, row_number() OVER (ORDER BY {key_column}) AS position
+            FROM {DB_SCHEMA}.{table}
+            {where_clause}
+            ORDER BY {key_column}
+            LIMIT :limit
+        ) page
+    """
+    result = query_db(
+        ("list", table, after_id is not None), query, limit=limit + 1, page_size=limit, **params
+    )
+
+    items, fetched, last_id = result[0]
+    next_cursor = encode_cursor(table, last_id) if fetched > limit else None
+    return {"items": RawJSON(items), "next_cursor": next_cursor}, min(fetched, limit)
+
+
+def list_response(table, columns, params):
+    limit = params.get("limit", LIST_DEFAULT_LIMIT)
+    after_id = decode_cursor(table, params["after"]) if params.get("after") else None
+    page, item_count = list_records(table, columns, after_id, limit)
+    logger.info(f"List {table}: returned {item_count} rows after {after_id}")
+    return json_response(200, page)
+
+
+class MultipartExport:
+    """Writes an export object to S3 part by part so at most one part is held in memory."""
+
+    def __init__(self, bucket, key):
+        self.s3_client = get_client("s3")
+        self.bucket = bucket
+        self.key = key
+        self.buffer = io.BytesIO()
+        self.upload_id = None
+        self.parts = []
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.buffer.write(data)
+        self.bytes_written += len(data)
+        if self.buffer.tell() >= EXPORT_PART_SIZE:
+            self._flush_part()
+
+    def _flush_part(self):
+        if self.upload_id is None:
+            upload = self.s3_client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, ContentType="application/x-ndjson"
+            )
+            self.upload_id = upload["UploadId"]
+        part_number = len(self.parts) + 1
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=self.buffer.getvalue(),
+        )
+        self.parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+        self.buffer = io.BytesIO()
+
+    def complete(self):
+        if self.upload_id is None:
+            # Small exports fit in a single request
+            self.s3_client.put_object(
+                Bucket=self.bucket,
+                Key=self.key,
+                Body=self.buffer.getvalue(),
+                ContentType="application/x-ndjson",
+            )
+            return
+        if self.buffer.tell():
+            self._flush_part()
+        self.s3_client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={"Parts": self.parts},
+        )
+
+    def abort(self):
+        if self.upload_id is not None:
+            self.s3_client.abort_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id
+            )
+
+
+def export_records(table, columns, key):
+    """Exports a whole table as newline delimited JSON to ``key`` in EXPORT_BUCKET."""
+    export = MultipartExport(EXPORT_BUCKET, key)
+    row_count = 0
+
+    try:
+        with db_router.connections().transaction() as conn, metrics.phase("Export"):
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                DECLARE export_cursor NO SCROLL CURSOR FOR
+                SELECT CAST({json_object_sql(columns)} AS text)
+                FROM {DB_SCHEMA}.{table}
+                ORDER BY {columns[0]}
+            """)
+            while True:
+                cursor.execute(f"FETCH FORWARD {EXPORT_FETCH_SIZE} FROM export_cursor")
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                # Rows arrive as JSON text rendered by PostgreSQL
+                export.write("".join(row[0] + "\n" for row in rows).encode())
+                row_count += len(rows)
+            cursor.execute("CLOSE export_cursor")
+            cursor.close()
+        export.complete()
+    except Exception:
+        export.abort()
+        raise
+
+    logger.info(
+        f"Exported {row_count} rows ({export.bytes_written} bytes) of {table} "
+        f"to s3://{EXPORT_BUCKET}/{key}"
+    )
+    metrics.count("Rows", row_count)
+    metrics.count("ExportBytes", export.bytes_written, unit="Bytes")
+    return {"rows": row_count, "bytes": export.bytes_written}
+
+
+def export_url(key):
+    return get_client("s3").generate_presigned_url(
+        "get_object", Params={"Bucket": EXPORT_BUCKET, "Key": key}, ExpiresIn=EXPORT_URL_TTL_SECONDS
+    )
+
+
+def write_export_status(key, status):
+    """Stores the status document clients poll; it is overwritten once the export finishes."""
+    get_client("s3").put_object(
+        Bucket=EXPORT_BUCKET,
+        Key=key,
+        Body=json.dumps(status).encode(),
+        ContentType="application/json",
+        CacheControl="no-cache",
+    )
+
+
+def start_export(table):
+    """Hands the export to EXPORT_FUNCTION_NAME and answers 202 with a pre-signed status URL."""
+    export_id = f"{datetime.datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex}"
+    data_key = f"exports/{table}/{export_id}.ndjson"
+    status_key = f"exports/{table}/{export_id}.json"
+
+    status = {"status": "running", "table": table, "started_at": int(time.time())}
+    write_export_status(status_key, status)
+    get_client("lambda").invoke(
+        FunctionName=EXPORT_FUNCTION_NAME,
+        InvocationType="Event",
+        Payload=json.dumps({"table": table, "key": data_key, "status_key": status_key}).encode(),
+    )
+    logger.info(f"Started export {export_id} of {table}")
+
+    status_url = export_url(status_key)
+    payload = {
+        "export_id": export_id,
+        "status": "running",
+        "status_url": status_url,
+        "url": export_url(data_key),
+        "expires_in": EXPORT_URL_TTL_SECONDS,
+    }
+    return json_response(202, payload, headers={"Location": status_url})
+
+
+def list_or_export_response(table, columns, params):
+    if params.get("export") == "ndjson":
+        if not EXPORT_BUCKET or not EXPORT_FUNCTION_NAME:
+            return json_response(501, {"error": "Exports are not configured"})
+        return start_export(table)
+    return list_response(table, columns, params)
+
+
+# Customer JSON as rendered by PostgreSQL, shared by lookups and updates so their ETags match
+CUSTOMER_JSON = f"CAST({json_object_sql(CUSTOMER_COLUMNS)} AS text)"
+
+
 def get_customer_data(customer_id):
-    """Fetch customer data from PostgreSQL database."""
+    """Fetch customer data from PostgreSQL database, as JSON text."""
     query = f"""
-        SELECT customer_id, first_name, last_name, email, phone, address
+        SELECT {CUSTOMER_JSON}
         FROM {DB_SCHEMA}.customers
-        WHERE customer_id = %s
+        WHERE customer_id = :customer_id
     """
-    result = query_db(query, (customer_id,))
-    result = result[0]
-    columns = ["customer_id", "first_name", "last_name", "email", "phone", "address"]
+    result = query_db("get_customer", query, customer_id=customer_id)
+
+    if not result:
+        logger.info(f"Customer with customer_id = {customer_id} not found")
+        return None
+
+    result = RawJSON(result[0][0])
 
-    logger.info(f"Customer: raw result type: {type(result)}, content: {result}")
+    logger.info(f"Customer: {result}")
 
-    return dict(zip(columns, result))
+    return result
 
 
-def update_customer_data(customer_id, update_fields):
+def get_customers_data(customer_ids):
+    """Fetch several customers in one query, returned as JSON text keyed by customer_id."""
+    query = f"""
+        SELECT customer_id, {CUSTOMER_JSON}
+        FROM {DB_SCHEMA}.customers
+        WHERE customer_id = ANY(:customer_ids)
+    """
+    result = query_db("get_customers", query, customer_ids=list(customer_ids))
+
+    return {row[0]: RawJSON(row[1]) for row in result}
+
+
+def update_customer_data(customer_id, update_fields, if_match=None):
     """Update customer data with proper transaction handling"""
     logger.info(f"Update update_fields: {update_fields}")
     allowed_fields = {"first_name", "last_name", "email", "phone", "address"}
     update_fields = {k: v for k, v in update_fields.items() if k in allowed_fields}
 
-    db_details = get_db_credentials(RDS_SECRET_NAME)
-    conn = None
     try:
-        conn = pg8000.connect(
-            user="postgres",
-            password=db_details["password"],
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME
-        )
-        cursor = conn.cursor()
+        with db_connections.transaction() as conn:
+            if if_match:
+                current = db_connections.prepare("lock_customer", f"""
+                    SELECT {CUSTOMER_JSON}
+                    FROM {DB_SCHEMA}.customers
+                    WHERE customer_id = :customer_id
+                    FOR UPDATE
+                """).run(customer_id=customer_id)
+                if not current:
+                    return None
+                if not etag_matches(if_match, compute_etag(current[0][0]), strong=True):
+                    raise PreconditionFailedError(f"Customer {customer_id} was modified")
 
-        set_clause = ", ".join(f"{key} = %s" for key in update_fields.keys())
-        values = list(update_fields.values()) + [customer_id]
+            # One statement per set of updated columns, the columns are whitelisted above
+            fields = tuple(sorted(update_fields))
+            set_clause = ", ".join(f"{field} = :{field}" for field in fields)
 
-        query = f"""
-            UPDATE {DB_SCHEMA}.customers
-            SET {set_clause}
-            WHERE customer_id = %s
-            RETURNING customer_id
-        """
+            query = f"""
+                UPDATE {DB_SCHEMA}.customers
+                SET {set_clause}
+                WHERE customer_id = :customer_id
+                RETURNING {CUSTOMER_JSON}
+            """
 
-        cursor.execute(query, values)
-        result = cursor.fetchone()
-        conn.commit()  # Explicit commit
+            rows = db_connections.prepare(("update_customer", fields), query).run(
+                customer_id=customer_id, **update_fields
+            )
+            result = rows[0] if rows else None
+            conn.commit()  # Explicit commit
 
-        return bool(result)
+        invalidate_records("customers", [customer_id])
+        return RawJSON(result[0]) if result else None
 
+    except (PreconditionFailedError, DatabaseUnavailableError):
+        raise
     except Exception as e:
-        if conn:
-            conn.rollback()  # Critical for data consistency
+        # Rollback is handled by the connection manager
         logger.error(f"Update failed: {str(e)}", exc_info=True)
         raise
-    finally:
-        if conn:
-            conn.close()
+
+
+def parse_bulk_update(records):
+    """Validates a bulk update body: a list of partial customer records, each with a customer_id."""
+    if not records:
+        raise ValueError("No records provided")
+    if len(records) > BULK_UPDATE_MAX_RECORDS:
+        raise ValueError(f"Too many records, the maximum is {BULK_UPDATE_MAX_RECORDS}")
+
+    updates = {}
+    for record in records:
+        if not isinstance(record, dict):
+            raise ValueError("Each record must be a JSON object")
+        customer_id = record.get("customer_id")
+        if not isinstance(customer_id, int) or isinstance(customer_id, bool):
+            raise ValueError(f"Invalid customer_id: {customer_id}")
+        if customer_id in updates:
+            raise ValueError(f"Duplicate customer_id: {customer_id}")
+
+        update_fields = {k: v for k, v in record.items() if k != "customer_id"}
+        validate_update_fields(update_fields)
+        if not update_fields:
+            raise ValueError(f"No fields to update for customer_id {customer_id}")
+        updates[customer_id] = update_fields
+    return updates
+
+
+def bulk_update_customers(updates):
+    """Applies many partial customer updates with one set-based UPDATE."""
+    update_columns = CUSTOMER_COLUMNS[1:]
+    column_placeholders = ", ".join("%s::varchar" for _ in update_columns)
+    row_placeholder = f"(%s::integer, {column_placeholders}, %s::text[])"
+
+    values = []
+    for customer_id, update_fields in updates.items():
+        values.append(customer_id)
+        values.extend(update_fields.get(column) for column in update_columns)
+        values.append(sorted(update_fields))
+
+    set_clause = ", ".join(
+        f"{column} = CASE WHEN '{column}' = ANY(v.fields) THEN v.{column} ELSE c.{column} END"
+        for column in update_columns
+    )
+    query = f"""
+        UPDATE {DB_SCHEMA}.customers AS c
+        SET {set_clause}
+        FROM (VALUES {", ".join([row_placeholder] * len(updates))})
+            AS v(customer_id, {", ".join(update_columns)}, fields)
+        WHERE c.customer_id = v.customer_id
+        RETURNING c.customer_id
+    """
+
+    # A single statement, atomic without an explicit transaction
+    with db_connections.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, values)
+        updated_ids = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+
+    invalidate_records("customers", updated_ids)
+    logger.info(f"Bulk update: {len(updated_ids)} of {len(updates)} customers updated")
+    return updated_ids
+
+
+def bulk_update_response(records):
+    updates = parse_bulk_update(records)
+    updated_ids = set(bulk_update_customers(updates))
+    return json_response(200, {
+        "updated": [customer_id for customer_id in updates if customer_id in updated_ids],
+        "not_found": [customer_id for customer_id in updates if customer_id not in updated_ids],
+    })
+
+
+# Order JSON as rendered by PostgreSQL: order_date as YYYY-MM-DD, total_amount at its exact scale
+ORDER_JSON = f"CAST({json_object_sql(ORDER_COLUMNS)} AS text)"
 
 
 def get_order_data(order_id):
-    """Fetch order details from PostgreSQL database."""
+    """Fetch order details from PostgreSQL database, as JSON text."""
     query = f"""
-        SELECT order_id, order_date, total_amount, customer_id
+        SELECT {ORDER_JSON}
         FROM {DB_SCHEMA}.orders 
-        WHERE order_id = %s
+        WHERE order_id = :order_id
     """
-    result = query_db(query, (order_id,))
+    result = query_db("get_order", query, order_id=order_id)
 
     if not result:
         logger.info(f"Order with order_id = {order_id} not found")
         return None
 
-    columns = ["order_id", "order_date", "total_amount", "customer_id"]
-    row = result[0]
-    order_dict = dict(zip(columns, row))
-
-    # Convert non-JSON types
-    converted_dict = {}
-    for key, value in order_dict.items():
-        if isinstance(value, Decimal):
-            converted_dict[key] = float(value)
-        elif isinstance(value, datetime.date):
-            converted_dict[key] = value.isoformat()
+    order = RawJSON(result[0][0])
+
+    logger.info(f"Order: {order}")
+    return order
+
+
+def get_orders_data(order_ids):
+    """Fetch several orders in one query, returned as JSON text keyed by order_id."""
+    query = f"""
+        SELECT order_id, {ORDER_JSON}
+        FROM {DB_SCHEMA}.orders
+        WHERE order_id = ANY(:order_ids)
+    """
+    result = query_db("get_orders", query, order_ids=list(order_ids))
+
+    return {row[0]: RawJSON(row[1]) for row in result}
+
+
+def parse_include(raw_include):
+    if raw_include != "orders":
+        raise ValueError(f"Invalid include: {raw_include}, only orders is supported")
+    return raw_include
+
+
+def encode_orders_cursor(customer_id, order_date, order_id):
+    """Opaque cursor pointing just after the given order in a customer's order list."""
+    position = {"t": "customer_orders", "c": customer_id, "d": order_date, "id": order_id}
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip("=")
+
+
+def decode_orders_cursor(customer_id, cursor):
+    """Returns (order_date, order_id) of the last order of the previous page."""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if position["t"] != "customer_orders" or position["c"] != customer_id:
+            raise ValueError("Cursor belongs to another list")
+        return position["d"], int(position["id"])
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+def get_customer_with_orders(customer_id, after, limit):
+    """Fetch a customer with one page of its orders, newest first, in a single query."""
+    # Seeks past the (order_date, order_id) of the last order seen; orders without a date sort
+    # first, like in the index
+    after_clause = """
+                  AND (
+                      CAST(:after_date AS date) IS NULL
+                          AND (o.order_date IS NOT NULL OR o.order_id < :after_id)
+                      OR o.order_date < CAST(:after_date AS date)
+                      OR o.order_date = CAST(:after_date AS date) AND o.order_id < :after_id
+                  )""" if after else ""
+    params = {"after_date": after[0], "after_id": after[1]} if after else {}
+
+    customer_fields = ", ".join(f"'{column}', c.{column}" for column in CUSTOMER_COLUMNS)
+    # One extra order is fetched to tell whether another page exists, it is left out of the array
+    query = f"""
+        SELECT
+            CAST(
+                json_build_object({customer_fields}, 'orders', COALESCE(page.orders, '[]')) AS text
+            ),
+            page.order_count,
+            page.last_order_date,
+            page.last_order_id
+        FROM {DB_SCHEMA}.customers c
+        LEFT JOIN LATERAL (
+            SELECT
+                json_agg(
+                    {json_object_sql(ORDER_COLUMNS, "recent")}
+                    ORDER BY recent.order_date DESC, recent.order_id DESC
+                ) FILTER (WHERE recent.position <= :page_size) AS orders,
+                count(*) AS order_count,
+                max(to_char(recent.order_date, 'YYYY-MM-DD'))
+                    FILTER (WHERE recent.position = :page_size) AS last_order_date,
+                max(recent.order_id) FILTER (WHERE recent.position = :page_size) AS last_order_id
+            FROM (
+                SELECT o.order_id, o.order_date, o.total_amount, o.customer_id,
+                       row_number() OVER (ORDER BY o.order_date DESC, o.order_id DESC) AS position
+                FROM {DB_SCHEMA}.orders o
+                WHERE o.customer_id = c.customer_id{after_clause}
+                ORDER BY o.order_date DESC, o.order_id DESC
+                LIMIT :limit
+            ) recent
+        ) page ON true
+        WHERE c.customer_id = :customer_id
+    """
+    result = query_db(
+        ("customer_orders", after is not None), query,
+        customer_id=customer_id, limit=limit + 1, page_size=limit, **params
+    )
+    if not result:
+        logger.info(f"Customer with customer_id = {customer_id} not found")
+        return None
+
+    customer, order_count, last_order_date, last_order_id = result[0]
+    next_cursor = (
+        encode_orders_cursor(customer_id, last_order_date, last_order_id)
+        if order_count > limit
+        else None
+    )
+    logger.info(f"Customer {customer_id}: returned {min(order_count, limit)} orders")
+    return extend_json_object(customer, {"next_cursor": next_cursor})
+
+
+def customer_with_orders_response(customer_ids, params):
+    if len(customer_ids) != 1:
+        raise ValueError("include=orders needs exactly one customer_id")
+
+    customer_id = customer_ids[0]
+    after = decode_orders_cursor(customer_id, params["after"]) if params.get("after") else None
+    customer = get_customer_with_orders(customer_id, after, params.get("limit", LIST_DEFAULT_LIMIT))
+    if customer:
+        return json_response(200, customer)
+    return json_response(404, {"error": "Customer not found"})
+
+
+def batch_response(table, id_field, record_ids, loader, not_found_message):
+    """Builds a 200 response with one item per requested ID; missing IDs are reported per item."""
+    records = cached_batch_lookup(table, record_ids, loader)
+
+    items = []
+    for record_id in record_ids:
+        if record_id in records:
+            items.append({id_field: record_id, "status": 200, "data": records[record_id]})
         else:
-            converted_dict[key] = value
+            items.append({id_field: record_id, "status": 404, "error": not_found_message})
 
-    logger.info(f"Order: converted data: {converted_dict}")
-    return converted_dict
+    logger.info(f"Batch {table}: requested {len(record_ids)}, found {len(records)}")
+    return json_response(200, {"items": items})
 
 
 def validate_token(token):
@@ -170,74 +1638,438 @@ def validate_token(token):
         return False
 
     try:
-        stored_password = get_db_credentials(SECRET_NAME)["password"]
-        return token == stored_password
+        if token == get_db_credentials(SECRET_NAME)["password"]:
+            return True
+        # The token may have been rotated since it was cached
+        return token == get_db_credentials(SECRET_NAME, force_refresh=True)["password"]
     except Exception as e:
         logger.error(f"Error validating token: {e}")
         return False
 
 
-def lambda_handler(event, context):
-    try:
-        logger.info(f"Received event: {json.dumps(event)}")
+class InMemoryRateLimitStore:
+    """Token buckets kept in the container's memory."""
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._buckets = {}
+
+    def take(self, key, capacity, refill_per_second):
+        """Takes one token; returns (allowed, remaining tokens, seconds until the next token)."""
+        now = self.clock()
+        tokens, updated_at = self._buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * refill_per_second)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now)
+        return allowed, int(tokens), 0 if allowed else (1 - tokens) / refill_per_second
 
-        http_method = event.get("httpMethod")
-        params = event.get("queryStringParameters") or {}
-        headers = event.get("headers") or {}
 
-        token = headers.get("Authorization")
-        if not validate_token(token):
-            return {"statusCode": 401, "body": json.dumps({"error": "Unauthorized"})}
+class DynamoDBRateLimitStore:
+    """Token buckets shared by all containers in a DynamoDB table."""
 
-        if http_method == "GET":
-            if "customer_id" in params:
-                customer_data = get_customer_data(params["customer_id"])
-                if customer_data:
-                    return {"statusCode": 200, "body": json.dumps(customer_data)}
-                return {"statusCode": 404, "body": json.dumps({"error": "Customer not found"})}
+    MAX_ATTEMPTS = 3
 
-            if "order_id" in params:
-                order_data = get_order_data(params["order_id"])
-                if order_data:
-                    return {"statusCode": 200, "body": json.dumps(order_data)}
-                return {"statusCode": 404, "body": json.dumps({"error": "Order not found"})}
+    def __init__(
+        self,
+        table_name,
+        clock=time.time,
+        lease_size=RATE_LIMIT_LEASE_SIZE,
+        lease_seconds=RATE_LIMIT_LEASE_SECONDS,
+    ):
+        self.table_name = table_name
+        self.clock = clock
+        self.lease_size = max(1, lease_size)
+        self.lease_seconds = lease_seconds
+        self.fallback = InMemoryRateLimitStore(clock)
+        self._leases = {}
+        self._unavailable_until = 0
 
-            return {"statusCode": 400, "body": json.dumps({"error": "Missing query parameters"})}
+    def take(self, key, capacity, refill_per_second):
+        now = self.clock()
+        # DynamoDB failed recently, the limits only apply per container meanwhile
+        if now < self._unavailable_until:
+            return self.fallback.take(key, capacity, refill_per_second)
 
+        tokens, leased_at, shared_tokens = self._leases.get(key, (0, now, 0))
+        if tokens >= 1 and now - leased_at < self.lease_seconds:
+            self._leases[key] = (tokens - 1, leased_at, shared_tokens)
+            return True, tokens - 1 + shared_tokens, 0
 
-        elif http_method == "PUT":
+        try:
+            return self._lease(key, capacity, refill_per_second)
+        except Exception as e:
+            logger.warning(f"Rate limit store unavailable, using per container limits: {e}")
+            metrics.count("RateLimitStoreErrors", 1)
+            self._unavailable_until = now + RATE_LIMIT_STORE_RETRY_SECONDS
+            return self.fallback.take(key, capacity, refill_per_second)
 
+    def _lease(self, key, capacity, refill_per_second):
+        """Takes up to ``lease_size`` tokens from the shared bucket, keeping all but one locally."""
+        dynamodb = get_client("dynamodb")
+        for _ in range(self.MAX_ATTEMPTS):
+            now = self.clock()
+            item = dynamodb.get_item(
+                TableName=self.table_name, Key={"pk": {"S": key}}, ConsistentRead=True
+            ).get("Item")
+            if item:
+                previous_update = item["updated_at"]["N"]
+                refilled = (now - float(previous_update)) * refill_per_second
+                tokens = float(item["tokens"]["N"]) + refilled
+                condition = {
+                    "ConditionExpression": "updated_at = :previous_update",
+                    "ExpressionAttributeValues": {":previous_update": {"N": previous_update}},
+                }
+            else:
+                tokens = capacity
+                condition = {"ConditionExpression": "attribute_not_exists(pk)"}
+
+            tokens = min(capacity, tokens)
+            leased = min(self.lease_size, math.floor(tokens))
+            tokens -= leased
             try:
+                dynamodb.put_item(
+                    TableName=self.table_name,
+                    Item={
+                        "pk": {"S": key},
+                        "tokens": {"N": repr(tokens)},
+                        "updated_at": {"N": repr(now)},
+                        "expires_at": {"N": str(int(now + capacity / refill_per_second) + 60)},
+                    },
+                    **condition,
+                )
+            except dynamodb.exceptions.ConditionalCheckFailedException:
+                # Another container took tokens at the same time, re-read the bucket
+                continue
 
-                body = json.loads(event["body"])
+            # Unused tokens of expired leases are dropped
+            self._leases = {
+                other: lease
+                for other, lease in self._leases.items()
+                if now - lease[1] < self.lease_seconds
+            }
+            if not leased:
+                return False, 0, (1 - tokens) / refill_per_second
+            # The shared tokens are remembered as they were when leasing, for X-RateLimit-Remaining
+            self._leases[key] = (leased - 1, now, int(tokens))
+            return True, int(tokens) + leased - 1, 0
 
-                customer_id = body.get("customer_id")
+        logger.warning(f"Rate limit bucket {key} is contended, allowing request")
+        return True, 0, 0
 
-                update_fields = {k: v for k, v in body.items() if k != "customer_id"}
 
-                validate_update_fields(update_fields)
-                updated = update_customer_data(customer_id, update_fields)
+if RATE_LIMIT_TABLE:
+    rate_limit_store = DynamoDBRateLimitStore(RATE_LIMIT_TABLE)
+else:
+    rate_limit_store = InMemoryRateLimitStore()
 
-                if updated:
-                    return {
-                        "statusCode": 200,
-                        "body": json.dumps({
-                            "message": "Customer updated",
-                            "customer_id": customer_id
-                        })
-                    }
 
-                return {"statusCode": 404, "body": json.dumps({"error": "Customer not found"})}
+def rate_limit_for(route_name):
+    """Returns (capacity, refill per second) for a route, falling back to the global defaults."""
+    limit = RATE_LIMITS.get(route_name, {})
+    return (
+        int(limit.get("capacity", RATE_LIMIT_CAPACITY)),
+        float(limit.get("refill_per_second", RATE_LIMIT_REFILL_PER_SECOND)),
+    )
 
-            except json.JSONDecodeError:
-                return {"statusCode": 400, "body": json.dumps({"error": "Invalid JSON"})}
 
-            except ValueError as ve:
-                return {"statusCode": 400, "body": json.dumps({"error": str(ve)})}
+def caller_identity(request):
+    """Identifies the caller without its raw token reaching the rate limit store."""
+    if request.authorized_by_gateway() and request.authorizer.get("caller"):
+        return request.authorizer["caller"]
+    return hashlib.sha256((request.header("Authorization") or "").encode()).hexdigest()[:32]
 
-        else:
-            return {"statusCode": 405, "body": json.dumps({"error": f"Method {http_method} not allowed"})}
 
+class Request:
+    """API Gateway proxy event as seen by the middleware and the endpoints."""
+
+    def __init__(self, event, method, resource):
+        self.event = event
+        self.method = method
+        self.resource = resource
+        self.route_name = f"{method} {resource}"
+        self.headers = event.get("headers") or {}
+        self.raw_params = event.get("queryStringParameters") or {}
+        self.params = {}
+        self.authorizer = (event.get("requestContext") or {}).get("authorizer") or {}
+
+    def header(self, name):
+        return get_header(self.headers, name)
+
+    def authorized_by_gateway(self):
+        """True when API Gateway's TOKEN authorizer allowed this request."""
+        if not (TRUST_AUTHORIZER_CONTEXT and self.authorizer.get("principalId")):
+            return False
+        # A cached Allow can outlive the token it was issued for
+        expires_at = self.authorizer.get("expires_at")
+        return not expires_at or float(expires_at) > time.time()
+
+    def json_body(self):
+        raw_body = self.event.get("body") or ""
+        if self.event.get("isBase64Encoded"):
+            # Request bodies arrive base64 encoded because of the API's binary media types
+            raw_body = base64.b64decode(raw_body).decode()
+        return json.loads(raw_body)
+
+
+class Route:
+    """Endpoint for one method and resource path, with parsers for its query parameters."""
+
+    def __init__(self, method, resource, endpoint, params=None):
+        self.method = method
+        self.resource = resource
+        self.endpoint = endpoint
+        self.params = params or {}
+
+    def __call__(self, request):
+        # Undeclared query parameters are ignored; a parser raising ValueError becomes a 400
+        request.params = {
+            name: parser(request.raw_params[name])
+            for name, parser in self.params.items()
+            if request.raw_params.get(name) is not None
+        }
+        return self.endpoint(request)
+
+
+def get_customers_endpoint(request):
+    if "customer_id" not in request.params:
+        return list_or_export_response("customers", CUSTOMER_COLUMNS, request.params)
+
+    customer_ids = request.params["customer_id"]
+    if "include" in request.params:
+        return customer_with_orders_response(customer_ids, request.params)
+    if "," in request.raw_params["customer_id"]:
+        return batch_response(
+            "customers", "customer_id", customer_ids, get_customers_data, "Customer not found"
+        )
+
+    customer_data = cached_lookup("customers", customer_ids[0], get_customer_data)
+    if customer_data:
+        return json_response(200, customer_data)
+    return json_response(404, {"error": "Customer not found"})
+
+
+def get_orders_endpoint(request):
+    if "order_id" not in request.params:
+        return list_or_export_response("orders", ORDER_COLUMNS, request.params)
+
+    order_ids = request.params["order_id"]
+    if "," in request.raw_params["order_id"]:
+        return batch_response("orders", "order_id", order_ids, get_orders_data, "Order not found")
+
+    order_data = cached_lookup("orders", order_ids[0], get_order_data)
+    if order_data:
+        return json_response(200, order_data)
+    return json_response(404, {"error": "Order not found"})
+
+
+def put_customers_endpoint(request):
+    body = request.json_body()
+    if isinstance(body, list):
+        return bulk_update_response(body)
+
+    customer_id = body.get("customer_id")
+    update_fields = {k: v for k, v in body.items() if k != "customer_id"}
+
+    validate_update_fields(update_fields)
+    updated = update_customer_data(customer_id, update_fields, request.header("If-Match"))
+
+    if updated:
+        return json_response(
+            200,
+            {"message": "Customer updated", "customer_id": customer_id},
+            {"ETag": compute_etag(updated)},
+        )
+    return json_response(404, {"error": "Customer not found"})
+
+
+def route_not_found(request):
+    allowed = sorted(method for method, resource in ROUTES if resource == request.resource)
+    if allowed:
+        return json_response(
+            405, {"error": f"Method {request.method} not allowed"}, {"Allow": ", ".join(allowed)}
+        )
+    return json_response(404, {"error": f"Route {request.route_name} not found"})
+
+
+def metrics_middleware(request, next_handler):
+    """Adds the route and response details to the invocation's EMF line."""
+    response = next_handler(request)
+    # Unmatched paths are grouped so arbitrary URLs can't create new metric dimensions
+    route_name = request.route_name if (request.method, request.resource) in ROUTES else "unmatched"
+    status_code = response.get("statusCode")
+    metrics.set_dimension("Route", route_name)
+    metrics.set_dimension("StatusClass", f"{status_code // 100}xx")
+    metrics.set_property("StatusCode", status_code)
+    # Requests per route and status class, e.g. the 5xx rate of GET /customers
+    metrics.count("Requests", 1)
+    metrics.count("ResponseBytes", len(response.get("body") or ""), unit="Bytes")
+    return response
+
+
+def error_middleware(request, next_handler):
+    """Maps exceptions raised by the endpoints to HTTP responses."""
+    try:
+        return next_handler(request)
+    except PreconditionFailedError as pe:
+        return json_response(412, {"error": str(pe)})
+    except DatabaseUnavailableError as de:
+        logger.warning(str(de))
+        metrics.count("DatabaseUnavailable", 1)
+        return json_response(
+            503, {"error": "Database temporarily unavailable"}, {"Retry-After": str(de.retry_after)}
+        )
+    except json.JSONDecodeError:
+        return json_response(400, {"error": "Invalid JSON"})
+    except ValueError as ve:
+        return json_response(400, {"error": str(ve)})
     except Exception as e:
         logger.error(f"Error in Lambda handler: {e}")
-        return {"statusCode": 500, "body": json.dumps({"error": "Internal server error, check the logs"})}
+        return json_response(500, {"error": "Internal server error, check the logs"})
+
+
+def compression_middleware(request, next_handler):
+    return compress_response(next_handler(request), request.headers)
+
+
+def auth_middleware(request, next_handler):
+    if request.authorized_by_gateway():
+        metrics.set_property("AuthSource", "authorizer")
+        return next_handler(request)
+
+    metrics.set_property("AuthSource", "token")
+    if not validate_token(request.header("Authorization")):
+        return json_response(401, {"error": "Unauthorized"})
+    return next_handler(request)
+
+
+def rate_limit_middleware(request, next_handler):
+    """Token bucket per caller and route; answers 429 once the caller's bucket is empty."""
+    capacity, refill_per_second = rate_limit_for(request.route_name)
+    if capacity <= 0:
+        return next_handler(request)
+
+    key = f"{caller_identity(request)}#{request.route_name}"
+    allowed, remaining, retry_after = rate_limit_store.take(key, capacity, refill_per_second)
+    headers = {"X-RateLimit-Limit": str(capacity), "X-RateLimit-Remaining": str(remaining)}
+    if not allowed:
+        metrics.count("RateLimited", 1)
+        headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+        return json_response(429, {"error": "Too many requests"}, headers)
+
+    response = next_handler(request)
+    return {**response, "headers": {**(response.get("headers") or {}), **headers}}
+
+
+def db_routing_middleware(request, next_handler):
+    """Sends the request's reads to the reader or the primary and remembers successful writes."""
+    token = request.header("Authorization")
+    db_router.route(request.method, token)
+    response = next_handler(request)
+    if request.method != "GET" and 200 <= response.get("statusCode", 500) < 300:
+        db_router.record_write(token)
+    return response
+
+
+def conditional_get_middleware(request, next_handler):
+    """Adds an ETag to successful GETs and answers 304 when If-None-Match matches."""
+    response = next_handler(request)
+    if request.method != "GET" or response.get("statusCode") != 200 or not response.get("body"):
+        return response
+
+    body = response["body"]
+    etag = coded_etag(compute_etag(body), response_encoding(body, request.headers))
+    headers = {**(response.get("headers") or {}), "ETag": etag}
+    if len(body) >= COMPRESSION_MIN_BYTES:
+        headers["Vary"] = "Accept-Encoding"
+    if etag_matches(request.header("If-None-Match"), etag):
+        return {"statusCode": 304, "headers": headers, "body": ""}
+    return {**response, "headers": headers}
+
+
+def build_pipeline(endpoint, middleware):
+    """Wraps endpoint in the middleware, the first entry being the outermost layer."""
+    handler = endpoint
+    for layer in reversed(middleware):
+        handler = functools.partial(layer, next_handler=handler)
+    return handler
+
+
+LIST_PARAMS = {"limit": parse_limit, "after": str, "export": str}
+
+ROUTES = {
+    (route.method, route.resource): route
+    for route in [
+        Route(
+            "GET",
+            "/customers",
+            get_customers_endpoint,
+            params={"customer_id": parse_id_list, "include": parse_include, **LIST_PARAMS},
+        ),
+        Route(
+            "GET",
+            "/orders",
+            get_orders_endpoint,
+            params={"order_id": parse_id_list, **LIST_PARAMS},
+        ),
+        Route("PUT", "/customers", put_customers_endpoint),
+    ]
+}
+
+MIDDLEWARE = [
+    metrics_middleware,
+    error_middleware,
+    compression_middleware,
+    auth_middleware,
+    rate_limit_middleware,
+    db_routing_middleware,
+    conditional_get_middleware,
+]
+
+# Pipelines are assembled once per container, dispatch is a single dict lookup
+PIPELINES = {key: build_pipeline(route, MIDDLEWARE) for key, route in ROUTES.items()}
+NOT_FOUND_PIPELINE = build_pipeline(route_not_found, MIDDLEWARE)
+
+
+def resolve_resource(event):
+    resource = event.get("resource") or event.get("path")
+    if resource:
+        return resource.rstrip("/") or "/"
+
+    # Direct invocations (e.g. from the console) don't carry a resource path
+    params = event.get("queryStringParameters") or {}
+    if "order_id" in params:
+        return "/orders"
+    if "customer_id" in params or event.get("httpMethod") == "PUT":
+        return "/customers"
+    return None
+
+
+@metrics.instrument
+def lambda_handler(event, context):
+    logger.info(f"Received event: {json.dumps(event)}")
+
+    method = event.get("httpMethod")
+    resource = resolve_resource(event)
+    pipeline = PIPELINES.get((method, resource), NOT_FOUND_PIPELINE)
+    return pipeline(Request(event, method, resource))
+
+
+@metrics.instrument
+def export_handler(event, context):
+    """Entry point of the export function, invoked asynchronously by ``start_export``."""
+    table, key, status_key = event["table"], event["key"], event["status_key"]
+    status = {"table": table}
+    try:
+        # Exports read from the replica when there is one
+        db_router.route("GET", None)
+        status.update(export_records(table, EXPORT_TABLES[table], key))
+        status.update(status="complete", url=export_url(key), expires_in=EXPORT_URL_TTL_SECONDS)
+    except Exception:
+        # Recorded rather than raised, so Lambda doesn't retry a half written export
+        logger.exception(f"Export of {table} to s3://{EXPORT_BUCKET}/{key} failed")
+        metrics.count("ExportFailures", 1)
+        status.update(status="failed", error="Export failed")
+    status["finished_at"] = int(time.time())
+    write_export_status(status_key, status)
@@ -2,8 +2,10 @@ import aws_cdk as cdk
 from aws_cdk import (
     Stack,
     aws_apigateway as apigateway,
+    aws_dynamodb as dynamodb,
     aws_lambda as _lambda,
     aws_iam as iam,
+    aws_s3 as s3,
     aws_secretsmanager as secretsmanager,
     CfnOutput,
     Duration,
@@ -25,6 +27,11 @@ class ApiGatewayStack(Stack):
         rds_endpoint_address: str,
         rds_secret_arn: str,
         env: str,
+        rds_reader_endpoint_address: str = None,
+        authorizer_cache_ttl_seconds: int = 30,
+        jwt_audience: str = "",
+        id_filter_updates_table_name: str = None,
+        id_filter_updates_table_arn: str = None,
         **kwargs,
     ) -> None:
         super().__init__(scope, id, **kwargs)
@@ -54,6 +61,70 @@ class ApiGatewayStack(Stack):
             removal_policy=RemovalPolicy.DESTROY,
         )
 
+        # HMAC keys of signed tokens (JWT) by key id. Only the first key is generated; keys added
+        # for rotation are kept on redeploys
+        jwt_keys_secret = secretsmanager.Secret(
+            self,
+            f"JwtKeysSecret-{self.env}",
+            secret_name=get_resource_name("api-jwt-signing-keys", self.env),
+            description="Rest Api signing keys of signed access tokens",
+            generate_secret_string=secretsmanager.SecretStringGenerator(
+                secret_string_template=json.dumps({}),
+                generate_string_key="k1",
+                exclude_punctuation=True,
+                password_length=64,
+            ),
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+
+        # Bucket for large table exports, read by clients through pre-signed URLs
+        export_bucket = s3.Bucket(
+            self,
+            f"S3ExportBucket-{self.env}",
+            bucket_name=get_resource_name("s3-api-exports", self.env),
+            removal_policy=RemovalPolicy.DESTROY,
+            auto_delete_objects=True,
+            lifecycle_rules=[s3.LifecycleRule(expiration=Duration.days(1))],
+        )
+
+        # Token buckets of the REST API rate limiter, shared by all Lambda containers
+        rate_limit_table = dynamodb.Table(
+            self,
+            f"RateLimitTable-{self.env}",
+            table_name=get_resource_name("api-rate-limits", self.env),
+            partition_key=dynamodb.Attribute(name="pk", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+
+        # Records cached for all REST API containers
+        read_cache_table = dynamodb.Table(
+            self,
+            f"ReadCacheTable-{self.env}",
+            table_name=get_resource_name("api-read-cache", self.env),
+            partition_key=dynamodb.Attribute(name="pk", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+
+        # Hashed API tokens issued to clients, read by the token authorizer
+        token_table = dynamodb.Table(
+            self,
+            f"TokenTable-{self.env}",
+            table_name=get_resource_name("api-tokens", self.env),
+            partition_key=dynamodb.Attribute(name="fingerprint", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+        # Tokens by day of their last change, queried by the authorizer's incremental refresh
+        token_table.add_global_secondary_index(
+            index_name="updated_day-index",
+            partition_key=dynamodb.Attribute(name="updated_day", type=dynamodb.AttributeType.STRING),
+            sort_key=dynamodb.Attribute(name="updated_at", type=dynamodb.AttributeType.NUMBER),
+        )
+
         # Define Lambda Layers
         pg8000_layer = _lambda.LayerVersion(
             self,
@@ -77,12 +148,26 @@ class ApiGatewayStack(Stack):
             layer_version_name="python_logging_layer",
         )
 
+        # Code shared by all Lambda functions (metrics, Secrets Manager cache)
+        common_layer = _lambda.LayerVersion(
+            self,
+            "CommonLayer",
+            code=_lambda.Code.from_asset("../lambda_layers/common"),
+            compatible_runtimes=[
+                _lambda.Runtime.PYTHON_3_8,
+                _lambda.Runtime.PYTHON_3_9,
+            ],
+            layer_version_name="python_common_layer",
+        )
+
         # Create API Gateway Rest API
         rest_api = apigateway.RestApi(
             self,
             f"RestApi-{self.env}",
             rest_api_name=get_resource_name("Rest-Api", self.env),
             endpoint_types=[apigateway.EndpointType.REGIONAL],
+            # Lets the Lambda return gzip/deflate compressed (base64 encoded) bodies
+            binary_media_types=["*/*"],
             cloud_watch_role=True,
             deploy_options=apigateway.StageOptions(
                 stage_name="prod",
@@ -128,6 +213,34 @@ class ApiGatewayStack(Stack):
                 iam.PolicyStatement(
                     effect=iam.Effect.ALLOW, actions=["rds-db:connect"], resources=["*"]
                 ),
+                # Table exports
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=[
+                        "s3:PutObject",
+                        "s3:GetObject",
+                        "s3:AbortMultipartUpload",
+                    ],
+                    resources=[f"{export_bucket.bucket_arn}/*"],
+                ),
+                # Rate limiter token buckets
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=["dynamodb:GetItem", "dynamodb:PutItem"],
+                    resources=[rate_limit_table.table_arn],
+                ),
+                # Shared read cache
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=["dynamodb:BatchGetItem", "dynamodb:PutItem", "dynamodb:BatchWriteItem"],
+                    resources=[read_cache_table.table_arn],
+                ),
+                # Issued API tokens, loaded by the token authorizer
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=["dynamodb:Scan", "dynamodb:Query"],
+                    resources=[token_table.table_arn, f"{token_table.table_arn}/index/*"],
+                ),
                 # RDS Describe and Data API Permissions
                 iam.PolicyStatement(
                     effect=iam.Effect.ALLOW,
@@ -143,9 +256,48 @@ class ApiGatewayStack(Stack):
             ],
         )
 
+        if id_filter_updates_table_arn:
+            # IDs loaded by the insert Lambda, added to the ID filters
+            lambda_policy.add_statements(
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=["dynamodb:Query"],
+                    resources=[id_filter_updates_table_arn],
+                )
+            )
+
         # Attach the policy to the role
         lambda_policy.attach_to_role(_lambda_role)
 
+        rest_api_environment = {
+            "SECRET_NAME": api_password_secret.secret_name,
+            "RDS_SECRET_NAME": rds_secret_name,
+            "DB_HOST": rds_endpoint_address,
+            "EXPORT_BUCKET": export_bucket.bucket_name,
+            "RATE_LIMIT_TABLE": rate_limit_table.table_name,
+            "SHARED_CACHE_TABLE": read_cache_table.table_name,
+        }
+        if id_filter_updates_table_name:
+            rest_api_environment["ID_FILTER_UPDATES_TABLE"] = id_filter_updates_table_name
+        if rds_reader_endpoint_address:
+            # GET requests read from the replica, PUTs keep using DB_HOST
+            rest_api_environment["DB_READER_HOST"] = rds_reader_endpoint_address
+
+        # Runs table exports, invoked asynchronously by the REST API Lambda
+        _lambda_export = _lambda.Function(
+            self,
+            f"LambdaRestApiExport-{self.env}",
+            function_name=get_resource_name("lambda_rest_api_export", self.env),
+            runtime=_lambda.Runtime.PYTHON_3_9,
+            handler="lambda_handler.export_handler",
+            code=_lambda.Code.from_asset("lambda_rest_api"),
+            role=_lambda_role,
+            timeout=Duration.minutes(15),
+            environment=dict(rest_api_environment),
+            layers=[pg8000_layer, logging_layer, common_layer],
+        )
+        rest_api_environment["EXPORT_FUNCTION_NAME"] = _lambda_export.function_name
+
         _lambda_rest_api = _lambda.Function(
             self,
             f"LambdaRestApi-{self.env}",
@@ -154,12 +306,10 @@ class ApiGatewayStack(Stack):
             handler="lambda_handler.lambda_handler",
             code=_lambda.Code.from_asset("lambda_rest_api"),
             role=_lambda_role,
-            environment={
-                "SECRET_NAME": api_password_secret.secret_name,
-                "RDS_SECRET_NAME": rds_secret_name,
-                "DB_HOST": rds_endpoint_address,
-            },
-            layers=[pg8000_layer, logging_layer],
+            # API Gateway gives up on the integration after 29 seconds
+            timeout=Duration.seconds(29),
+            environment=rest_api_environment,
+            layers=[pg8000_layer, logging_layer, common_layer],
         )
 
         _lambda_token_authorizer = _lambda.Function(
@@ -170,19 +320,28 @@ class ApiGatewayStack(Stack):
             handler="lambda_handler.lambda_handler",
             code=_lambda.Code.from_asset("lambda_grant_token_access"),
             role=_lambda_role,
-            environment={"SECRET_NAME": api_password_secret.secret_name},
+            layers=[common_layer],
+            environment={
+                "SECRET_NAME": api_password_secret.secret_name,
+                "TOKEN_TABLE": token_table.table_name,
+                # Enables signed tokens (JWT) when set
+                "JWT_AUDIENCE": jwt_audience,
+                "JWT_KEYS_SECRET": jwt_keys_secret.secret_name,
+            },
         )
 
         # Grant lambda permission to read from Secrets Manager
         api_password_secret.grant_read(_lambda_token_authorizer)
+        jwt_keys_secret.grant_read(_lambda_token_authorizer)
 
-        # Custom authorizer for API Gateway
+        # Custom authorizer for API Gateway. Its policies cover the whole stage, so a cached
+        # result is valid for every route; 0 disables caching
         authorizer = apigateway.TokenAuthorizer(
             self,
             f"CustomAuthorizer-{self.env}",
             handler=_lambda_token_authorizer,
             identity_source="method.request.header.Authorization",
-            results_cache_ttl=Duration.seconds(0),
+            results_cache_ttl=Duration.seconds(authorizer_cache_ttl_seconds),
         )
 
         # Create resources and methods dynamically
@@ -193,8 +352,15 @@ class ApiGatewayStack(Stack):
                 # Define the request parameters based on the endpoint
                 request_params = {"method.request.header.Authorization": True}
 
+                # Optional pagination and export parameters of the list endpoints
+                if method == "GET":
+                    request_params["method.request.querystring.limit"] = False
+                    request_params["method.request.querystring.after"] = False
+                    request_params["method.request.querystring.export"] = False
+
                 if endpoint_key == "customers":
                     request_params["method.request.querystring.customer_id"] = False
+                    request_params["method.request.querystring.include"] = False
                 elif endpoint_key == "orders":
                     request_params["method.request.querystring.order_id"] = False
 
@@ -8,7 +8,17 @@ from datetime import datetime
 
 
 class MainStack(Stack):
-    def __init__(self, scope: Construct, id: str, env: str, is_development: bool, **kwargs) -> None:
+    def __init__(
+        self,
+        scope: Construct,
+        id: str,
+        env: str,
+        is_development: bool,
+        create_read_replica: bool = False,
+        authorizer_cache_ttl_seconds: int = 30,
+        jwt_audience: str = "",
+        **kwargs
+    ) -> None:
         super().__init__(scope, id, **kwargs)
 
         self.env = env
@@ -29,14 +39,16 @@ class MainStack(Stack):
             vpc=vpc,
             rds_security_group=rds_security_group,
             env=env,
-            is_development=self.is_development
+            is_development=self.is_development,
+            create_read_replica=create_read_replica,
         )
         rds_endpoint_address = rds_postgres.rds_endpoint_address
+        rds_reader_endpoint_address = rds_postgres.rds_reader_endpoint_address
         rds_secret_name = rds_postgres.rds_password_secret
         rds_instance_id = rds_postgres.rds_instance_id
         secret_arn = rds_postgres.secret_arn
 
-        LambdaRdsStack(
+        lambda_rds_stack = LambdaRdsStack(
             self,
             f"LambdaRdsStack-{env}",
             rds_instance_id=rds_instance_id,
@@ -52,5 +64,10 @@ class MainStack(Stack):
             rds_secret_name=rds_secret_name,
             rds_endpoint_address=rds_endpoint_address,
             rds_secret_arn=secret_arn,
-            env=env
+            env=env,
+            rds_reader_endpoint_address=rds_reader_endpoint_address,
+            authorizer_cache_ttl_seconds=authorizer_cache_ttl_seconds,
+            jwt_audience=jwt_audience,
+            id_filter_updates_table_name=lambda_rds_stack.id_filter_updates_table.table_name,
+            id_filter_updates_table_arn=lambda_rds_stack.id_filter_updates_table.table_arn,
         )
@@ -25,6 +25,7 @@ class RdsPostgresStack(Stack):
         rds_security_group: ec2.ISecurityGroup,
         env: str,
         is_development: bool = True,
+        create_read_replica: bool = False,
         **kwargs,
     ):
         super().__init__(scope, id, **kwargs)
@@ -92,6 +93,33 @@ class RdsPostgresStack(Stack):
             ),
         )
         self.rds_endpoint_address = postgres_rds.db_instance_endpoint_address
+        self.rds_reader_endpoint_address = None
+
+        if create_read_replica:
+            # Serves the REST API reads so ingestion writes on the primary don't slow them down
+            postgres_replica = rds.DatabaseInstanceReadReplica(
+                self,
+                f"PostgresRdsReadReplica-{self.env}",
+                instance_identifier=get_resource_name("rds-database-replica", self.env),
+                source_database_instance=postgres_rds,
+                instance_type=ec2.InstanceType.of(
+                    ec2.InstanceClass.T3, ec2.InstanceSize.MICRO
+                ),
+                storage_encrypted=True,
+                vpc=vpc,
+                security_groups=[rds_security_group],
+                vpc_subnets=ec2.SubnetSelection(subnet_type=ec2.SubnetType.PUBLIC),
+                removal_policy=(
+                    RemovalPolicy.SNAPSHOT if not is_development else RemovalPolicy.DESTROY
+                ),
+                deletion_protection=not is_development,
+                publicly_accessible=True,
+                auto_minor_version_upgrade=False,
+                parameter_group=rds.ParameterGroup.from_parameter_group_name(
+                    self, "ReplicaParameterGroup", parameter_group_name="default.postgres16"
+                ),
+            )
+            self.rds_reader_endpoint_address = postgres_replica.db_instance_endpoint_address
         self.rds_password_secret = rds_password_secret.secret_name
         self.rds_instance_id = postgres_rds.instance_arn
         self.secret_arn = rds_password_secret.secret_arn
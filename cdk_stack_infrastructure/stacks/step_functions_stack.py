@@ -4,6 +4,7 @@ from aws_cdk import (
     aws_lambda as _lambda,
     aws_iam as iam,
     aws_s3 as s3,
+    aws_dynamodb as dynamodb,
     aws_stepfunctions as sfn,
     aws_stepfunctions_tasks as tasks,
     aws_events as events,
@@ -47,6 +48,18 @@ class LambdaRdsStack(Stack):
             auto_delete_objects=True,
         )
 
+        # IDs loaded into RDS, read by the REST API to keep its ID filters up to date
+        self.id_filter_updates_table = dynamodb.Table(
+            self,
+            f"IdFilterUpdatesTable-{self.env}",
+            table_name=get_resource_name("id-filter-updates", self.env),
+            partition_key=dynamodb.Attribute(name="table_name", type=dynamodb.AttributeType.STRING),
+            sort_key=dynamodb.Attribute(name="update_key", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+
         # IAM Role for Lambda
         lambda_role = iam.Role(
             self,
@@ -99,6 +112,12 @@ class LambdaRdsStack(Stack):
                     ],
                     resources=[secret_arn],
                 ),
+                # Loaded IDs for the REST API's ID filters
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=["dynamodb:PutItem"],
+                    resources=[self.id_filter_updates_table.table_arn],
+                ),
             ],
         )
 
@@ -127,6 +146,18 @@ class LambdaRdsStack(Stack):
             layer_version_name="python_logging_layer",
         )
 
+        # Code shared by all Lambda functions (metrics, Secrets Manager cache)
+        common_layer = _lambda.LayerVersion(
+            self,
+            f"CommonLayer-{self.env}",
+            code=_lambda.Code.from_asset("../lambda_layers/common"),
+            compatible_runtimes=[
+                _lambda.Runtime.PYTHON_3_8,
+                _lambda.Runtime.PYTHON_3_9,
+            ],
+            layer_version_name="python_common_layer",
+        )
+
         # Lambda Function to insert into RDS
         lambda_insert_data_into_rds = _lambda.Function(
             self,
@@ -137,13 +168,14 @@ class LambdaRdsStack(Stack):
             code=_lambda.Code.from_asset("lambda_insert_data_into_rds"),
             role=lambda_role,
             timeout=Duration.seconds(300),
-            layers=[pg8000_layer, logging_layer],
+            layers=[pg8000_layer, logging_layer, common_layer],
             environment={
                 "S3_BACKUP_DATA": s3_backup_data.bucket_name,
                 "S3_EVENT_DATA": s3_event_data.bucket_name,
                 "RDS_HOST": rds_endpoint_address,  # pass as param/env
                 "SSM_NAME": rds_secret_name,
                 "RDS_DB": "database_rds",
+                "ID_FILTER_UPDATES_TABLE": self.id_filter_updates_table.table_name,
             },
         )
 
@@ -195,7 +227,7 @@ class LambdaRdsStack(Stack):
             handler="lambda_handler.lambda_handler",
             runtime=_lambda.Runtime.PYTHON_3_9,
             timeout=Duration.seconds(300),
-            layers=[logging_layer],
+            layers=[logging_layer, common_layer],
             environment={
                 "S3_BACKUP_DATA": s3_backup_data.bucket_name,
                 "S3_EVENT_DATA": s3_event_data.bucket_name,
@@ -0,0 +1,5 @@
+"""Code shared by the Lambda functions, deployed to all of them as the python_common_layer layer."""
+from lambda_common.metrics import InvocationMetrics
+from lambda_common.secret_cache import SecretCache
+
+__all__ = ["InvocationMetrics", "SecretCache"]
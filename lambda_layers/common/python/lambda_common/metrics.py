@@ -0,0 +1,92 @@
+"""Per-invocation metrics of the Lambda functions, emitted in CloudWatch Embedded Metric Format."""
+import functools
+import json
+import os
+import time
+from contextlib import contextmanager
+
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "IaacStacks")
+
+
+class InvocationMetrics:
+    """Per-invocation timings and counters, emitted as one CloudWatch EMF log line."""
+
+    def __init__(self, function_name, namespace=METRICS_NAMESPACE, sink=print):
+        self.function_name = function_name
+        self.namespace = namespace
+        # EMF needs the raw JSON on stdout, without the prefix the Lambda logger adds
+        self.sink = sink
+        self.cold_start = True
+        self.reset()
+
+    def instrument(self, handler):
+        """Decorates a Lambda handler so that every invocation emits exactly one EMF line."""
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            self.reset()
+            try:
+                return handler(event, context)
+            finally:
+                self.flush()
+        return wrapper
+
+    def reset(self):
+        self.dimensions = {"FunctionName": self.function_name}
+        self.phases = {}
+        self.counters = {}
+        self.properties = {}
+        self.started_at = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        """Times the block; repeated phases within one invocation are summed."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + (time.perf_counter() - started) * 1000
+
+    def count(self, name, value, unit="Count"):
+        total, _ = self.counters.get(name, (0, unit))
+        self.counters[name] = (total + value, unit)
+
+    def set_dimension(self, name, value):
+        self.dimensions[name] = str(value)
+
+    def set_property(self, name, value):
+        self.properties[name] = value
+
+    def flush(self):
+        """Emits the EMF line for the current invocation and starts a new one."""
+        values = {
+            "DurationMs": (time.perf_counter() - self.started_at) * 1000,
+            "ColdStart": int(self.cold_start),
+        }
+        units = {"DurationMs": "Milliseconds", "ColdStart": "Count"}
+        for name, elapsed_ms in self.phases.items():
+            values[f"{name}Ms"] = elapsed_ms
+            units[f"{name}Ms"] = "Milliseconds"
+        for name, (total, unit) in self.counters.items():
+            values[name] = total
+            units[name] = unit
+
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": self.namespace,
+                    "Dimensions": [list(self.dimensions)],
+                    "Metrics": [{"Name": name, "Unit": unit} for name, unit in units.items()],
+                }],
+            },
+            **self.properties,
+            **self.dimensions,
+            **{
+                name: round(value, 3) if isinstance(value, float) else value
+                for name, value in values.items()
+            },
+        }
+        self.sink(json.dumps(record, default=str))
+        self.cold_start = False
+        self.reset()
+        return record
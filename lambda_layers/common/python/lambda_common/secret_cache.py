@@ -0,0 +1,57 @@
+"""In-process cache of Secrets Manager values shared by the Lambda functions."""
+import json
+import logging
+import os
+import time
+from contextlib import nullcontext
+
+logger = logging.getLogger(__name__)
+
+SECRET_CACHE_TTL_SECONDS = int(os.environ.get("SECRET_CACHE_TTL_SECONDS", 300))
+SECRET_REFRESH_COOLDOWN_SECONDS = int(os.environ.get("SECRET_REFRESH_COOLDOWN_SECONDS", 30))
+
+
+class SecretCache:
+    """In-process cache of Secrets Manager values, keyed by secret name and version stage."""
+
+    def __init__(self, client_factory, ttl_seconds=SECRET_CACHE_TTL_SECONDS,
+                 refresh_cooldown_seconds=SECRET_REFRESH_COOLDOWN_SECONDS, metrics=None):
+        self.client_factory = client_factory
+        self.ttl_seconds = ttl_seconds
+        self.refresh_cooldown_seconds = refresh_cooldown_seconds
+        self.metrics = metrics
+        self._entries = {}
+
+    def get(self, secret_id, version_stage="AWSCURRENT"):
+        entry = self._entries.get((secret_id, version_stage))
+        if entry and time.monotonic() - entry["fetched_at"] < self.ttl_seconds:
+            return entry["value"]
+        return self._load(secret_id, version_stage)
+
+    def refresh(self, secret_id, version_stage="AWSCURRENT"):
+        """Reloads the secret unless it was fetched within the refresh cooldown."""
+        entry = self._entries.get((secret_id, version_stage))
+        if entry and time.monotonic() - entry["fetched_at"] < self.refresh_cooldown_seconds:
+            return entry["value"]
+        return self._load(secret_id, version_stage)
+
+    def version_id(self, secret_id, version_stage="AWSCURRENT"):
+        """VersionId of the cached value, None if the secret wasn't loaded yet."""
+        entry = self._entries.get((secret_id, version_stage))
+        return entry["version_id"] if entry else None
+
+    def _load(self, secret_id, version_stage):
+        with self.metrics.phase("SecretFetch") if self.metrics else nullcontext():
+            response = self.client_factory().get_secret_value(
+                SecretId=secret_id, VersionStage=version_stage
+            )
+        previous = self._entries.get((secret_id, version_stage))
+        if previous and previous["version_id"] != response.get("VersionId"):
+            logger.info(f"Secret {secret_id} changed version to {response.get('VersionId')}")
+        value = json.loads(response["SecretString"])
+        self._entries[(secret_id, version_stage)] = {
+            "value": value,
+            "version_id": response.get("VersionId"),
+            "fetched_at": time.monotonic(),
+        }
+        return value
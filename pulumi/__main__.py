@@ -8,6 +8,11 @@ from components.api_gateway import ApiGatewayStack
 config = pulumi.Config("my-infra")
 ENV = config.require("env")
 is_dev = config.get_bool("is_development") or False
+create_read_replica = config.get_bool("create_read_replica") or False
+authorizer_cache_ttl_seconds = config.get_int("authorizer_cache_ttl_seconds")
+if authorizer_cache_ttl_seconds is None:
+    authorizer_cache_ttl_seconds = 30
+jwt_audience = config.get("jwt_audience") or ""
 
 vpc_stack = VpcStack(
     name="vpc-stack",
@@ -21,6 +26,7 @@ rds_stack = RdsStack(
     subnet_ids=[subnet.id for subnet in vpc_stack.public_subnets],
     rds_security_group_id=vpc_stack.rds_security_group.id,
     is_development=is_dev,
+    create_read_replica=create_read_replica,
 )
 
 step_fn_stack = StepFunctionsStack(
@@ -38,6 +44,11 @@ ApiGatewayStack(
     rds_secret_name=rds_stack.rds_secret_name,
     rds_endpoint_address=rds_stack.rds_endpoint,
     rds_secret_arn=rds_stack.secret_arn,
+    rds_reader_endpoint_address=rds_stack.rds_reader_endpoint,
+    authorizer_cache_ttl_seconds=authorizer_cache_ttl_seconds,
+    jwt_audience=jwt_audience,
     pg8000_layer_arn=step_fn_stack.pg8000_layer,
     logging_layer_arn=step_fn_stack.logging_layer,
+    common_layer_arn=step_fn_stack.common_layer,
+    id_filter_updates_table=step_fn_stack.id_filter_updates_table,
 )
@@ -22,6 +22,11 @@ class ApiGatewayStack(pulumi.ComponentResource):
         rds_secret_arn: str,
         pg8000_layer_arn: str,
         logging_layer_arn: str,
+        common_layer_arn: str,
+        id_filter_updates_table: aws.dynamodb.Table,
+        rds_reader_endpoint_address: str = None,
+        authorizer_cache_ttl_seconds: int = 30,
+        jwt_audience: str = "",
         opts: pulumi.ResourceOptions = None,
     ):
         super().__init__("custom:ApiGatewayStack", name, None, opts)
@@ -30,7 +35,7 @@ class ApiGatewayStack(pulumi.ComponentResource):
 
         account_id = aws.get_caller_identity().account_id
         region = aws.config.region
-        layers = [pg8000_layer_arn, logging_layer_arn]
+        layers = [pg8000_layer_arn, logging_layer_arn, common_layer_arn]
 
         api_password = RandomPassword(
             get_resource_name("api-token", env),
@@ -57,6 +62,89 @@ class ApiGatewayStack(pulumi.ComponentResource):
             opts=pulumi.ResourceOptions(parent=api_password_secret),
         )
 
+        # HMAC keys of signed tokens (JWT) by key id. Only the first key is generated; keys added
+        # for rotation are kept on updates
+        jwt_signing_key = RandomPassword(
+            get_resource_name("api-jwt-signing-key", env),
+            length=64,
+            special=False,
+            opts=pulumi.ResourceOptions(parent=self),
+        )
+
+        jwt_keys_secret = aws.secretsmanager.Secret(
+            get_resource_name("api-jwt-signing-keys", env),
+            name=f"api-jwt-signing-keys-{env}",
+            description="API Gateway signing keys of signed access tokens",
+            tags={"Name": get_resource_name("api-jwt-signing-keys", env)},
+            opts=pulumi.ResourceOptions(parent=self),
+        )
+
+        aws.secretsmanager.SecretVersion(
+            resource_name=get_resource_name("api-jwt-signing-keys-version", env),
+            secret_id=jwt_keys_secret.id,
+            secret_string=jwt_signing_key.result.apply(lambda key: json.dumps({"k1": key})),
+            opts=pulumi.ResourceOptions(parent=jwt_keys_secret, ignore_changes=["secret_string"]),
+        )
+
+        # Bucket for large table exports, read by clients through pre-signed URLs
+        export_bucket = aws.s3.Bucket(
+            get_resource_name("s3-api-exports", env),
+            bucket=get_resource_name("s3-api-exports", env),
+            force_destroy=True,
+            lifecycle_rules=[
+                aws.s3.BucketLifecycleRuleArgs(
+                    enabled=True,
+                    expiration=aws.s3.BucketLifecycleRuleExpirationArgs(days=1),
+                )
+            ],
+            opts=pulumi.ResourceOptions(parent=self),
+        )
+
+        # Token buckets of the REST API rate limiter, shared by all Lambda containers
+        rate_limit_table = aws.dynamodb.Table(
+            get_resource_name("api-rate-limits", env),
+            name=get_resource_name("api-rate-limits", env),
+            hash_key="pk",
+            attributes=[aws.dynamodb.TableAttributeArgs(name="pk", type="S")],
+            billing_mode="PAY_PER_REQUEST",
+            ttl=aws.dynamodb.TableTtlArgs(attribute_name="expires_at", enabled=True),
+            opts=pulumi.ResourceOptions(parent=self),
+        )
+
+        # Records cached for all REST API containers
+        read_cache_table = aws.dynamodb.Table(
+            get_resource_name("api-read-cache", env),
+            name=get_resource_name("api-read-cache", env),
+            hash_key="pk",
+            attributes=[aws.dynamodb.TableAttributeArgs(name="pk", type="S")],
+            billing_mode="PAY_PER_REQUEST",
+            ttl=aws.dynamodb.TableTtlArgs(attribute_name="expires_at", enabled=True),
+            opts=pulumi.ResourceOptions(parent=self),
+        )
+
+        # Hashed API tokens issued to clients, read by the token authorizer
+        token_table = aws.dynamodb.Table(
+            get_resource_name("api-tokens", env),
+            name=get_resource_name("api-tokens", env),
+            hash_key="fingerprint",
+            attributes=[
+                aws.dynamodb.TableAttributeArgs(name="fingerprint", type="S"),
+                aws.dynamodb.TableAttributeArgs(name="updated_day", type="S"),
+                aws.dynamodb.TableAttributeArgs(name="updated_at", type="N"),
+            ],
+            # Tokens by day of their last change, queried by the authorizer's incremental refresh
+            global_secondary_indexes=[
+                aws.dynamodb.TableGlobalSecondaryIndexArgs(
+                    name="updated_day-index",
+                    hash_key="updated_day",
+                    range_key="updated_at",
+                    projection_type="ALL",
+                )
+            ],
+            billing_mode="PAY_PER_REQUEST",
+            opts=pulumi.ResourceOptions(parent=self),
+        )
+
         # Create Lambda Execution Role with necessary permissions
         lambda_role = aws.iam.Role(
             resource_name=get_resource_name("lambda_rest_api", env),
@@ -81,7 +169,16 @@ class ApiGatewayStack(pulumi.ComponentResource):
         )
 
         lambda_iam_policy = pulumi.Output.all(
-            region, account_id, api_password_secret.arn, rds_secret_arn
+            region,
+            account_id,
+            api_password_secret.arn,
+            rds_secret_arn,
+            export_bucket.arn,
+            rate_limit_table.arn,
+            token_table.arn,
+            jwt_keys_secret.arn,
+            id_filter_updates_table.arn,
+            read_cache_table.arn,
         ).apply(
             lambda args: json.dumps(
                 {
@@ -105,6 +202,7 @@ class ApiGatewayStack(pulumi.ComponentResource):
                             "Resource": [
                                 args[2],  # api_password_secret.arn
                                 args[3],  # rds_secret_arn
+                                args[7],  # jwt_keys_secret.arn
                             ],
                         },
                         {
@@ -121,6 +219,35 @@ class ApiGatewayStack(pulumi.ComponentResource):
                             "Action": ["lambda:InvokeFunction"],
                             "Resource": ["*"],
                         },
+                        {
+                            "Effect": "Allow",
+                            "Action": [
+                                "s3:PutObject",
+                                "s3:GetObject",
+                                "s3:AbortMultipartUpload",
+                            ],
+                            "Resource": [f"{args[4]}/*"],  # export_bucket.arn
+                        },
+                        {
+                            "Effect": "Allow",
+                            "Action": ["dynamodb:GetItem", "dynamodb:PutItem"],
+                            "Resource": [args[5]],  # rate_limit_table.arn
+                        },
+                        {
+                            "Effect": "Allow",
+                            "Action": ["dynamodb:Scan", "dynamodb:Query"],
+                            "Resource": [args[6], f"{args[6]}/index/*"],  # token_table.arn
+                        },
+                        {
+                            "Effect": "Allow",
+                            "Action": ["dynamodb:Query"],
+                            "Resource": [args[8]],  # id_filter_updates_table.arn
+                        },
+                        {
+                            "Effect": "Allow",
+                            "Action": ["dynamodb:BatchGetItem", "dynamodb:PutItem", "dynamodb:BatchWriteItem"],
+                            "Resource": [args[9]],  # read_cache_table.arn
+                        },
                     ],
                 }
             )
@@ -144,36 +271,67 @@ class ApiGatewayStack(pulumi.ComponentResource):
             code_path: str,
             env_vars: Dict[str, pulumi.Input[str]],
             layers=None,
+            timeout: int = 3,
+            handler: str = "lambda_handler.lambda_handler",
         ):
             return aws.lambda_.Function(
                 resource_name=get_resource_name(name, env),
                 name=f"{name}-{env}",
                 role=lambda_role.arn,
                 runtime="python3.9",
-                handler="lambda_handler.lambda_handler",
+                handler=handler,
                 code=pulumi.AssetArchive({"./": pulumi.FileArchive(code_path)}),
                 environment=aws.lambda_.FunctionEnvironmentArgs(variables=env_vars),
                 layers=layers or [],
+                timeout=timeout,
                 opts=pulumi.ResourceOptions(parent=self),
             )
 
+        rest_api_environment = {
+            "SECRET_NAME": api_password_secret.name,
+            "RDS_SECRET_NAME": rds_secret_name,
+            "DB_HOST": rds_endpoint_address,
+            "EXPORT_BUCKET": export_bucket.bucket,
+            "RATE_LIMIT_TABLE": rate_limit_table.name,
+            "ID_FILTER_UPDATES_TABLE": id_filter_updates_table.name,
+            "SHARED_CACHE_TABLE": read_cache_table.name,
+        }
+        if rds_reader_endpoint_address is not None:
+            # GET requests read from the replica, PUTs keep using DB_HOST
+            rest_api_environment["DB_READER_HOST"] = rds_reader_endpoint_address
+
+        # Runs table exports, invoked asynchronously by the REST API Lambda
+        lambda_export = create_lambda_function(
+            "lambda_rest_api_export",
+            "lambda_rest_api",
+            dict(rest_api_environment),
+            layers,
+            timeout=900,
+            handler="lambda_handler.export_handler",
+        )
+        rest_api_environment["EXPORT_FUNCTION_NAME"] = lambda_export.name
+
         # Create main Lambda function for REST API
         lambda_rest_api = create_lambda_function(
             "lambda_rest_api",
             "lambda_rest_api",
-            {
-                "SECRET_NAME": api_password_secret.name,
-                "RDS_SECRET_NAME": rds_secret_name,
-                "DB_HOST": rds_endpoint_address,
-            },
+            rest_api_environment,
             layers,
+            # API Gateway gives up on the integration after 29 seconds
+            timeout=29,
         )
 
         lambda_token_authorizer = create_lambda_function(
             "lambda-token-authorizer",
             "lambda_grant_token_access",
-            {"SECRET_NAME": api_password_secret.name},
-            layers=None,
+            {
+                "SECRET_NAME": api_password_secret.name,
+                "TOKEN_TABLE": token_table.name,
+                # Enables signed tokens (JWT) when set
+                "JWT_AUDIENCE": jwt_audience,
+                "JWT_KEYS_SECRET": jwt_keys_secret.name,
+            },
+            layers=[common_layer_arn],
         )
 
         # Create API Gateway REST API
@@ -181,6 +339,8 @@ class ApiGatewayStack(pulumi.ComponentResource):
             resource_name=get_resource_name("Rest-Api", env),
             name=get_resource_name("Rest-Api", env),
             endpoint_configuration={"types": "REGIONAL"},
+            # Lets the Lambda return gzip/deflate compressed (base64 encoded) bodies
+            binary_media_types=["*/*"],
             opts=pulumi.ResourceOptions(parent=self),
         )
 
@@ -198,6 +358,7 @@ class ApiGatewayStack(pulumi.ComponentResource):
             lambda arn: f"arn:aws:apigateway:{region}:lambda:path/2015-03-31/functions/{arn}/invocations"
         )
 
+        # Its policies cover the whole stage, so a cached result is valid for every route; 0 disables caching
         authorizer = aws.apigateway.Authorizer(
             get_resource_name("custom-authorizer", env),
             name=get_resource_name("custom-authorizer", env),
@@ -206,7 +367,7 @@ class ApiGatewayStack(pulumi.ComponentResource):
             identity_source="method.request.header.Authorization",
             type="TOKEN",
             opts=pulumi.ResourceOptions(parent=rest_api),
-            authorizer_result_ttl_in_seconds=0,
+            authorizer_result_ttl_in_seconds=authorizer_cache_ttl_seconds,
         )
         uri_lambda_rest_api = pulumi.Output.concat(
             "arn:aws:apigateway:",
@@ -245,7 +406,10 @@ class ApiGatewayStack(pulumi.ComponentResource):
                     request_parameters={
                         "method.request.header.Authorization": True,
                         **(
-                            {"method.request.querystring.customer_id": False}
+                            {
+                                "method.request.querystring.customer_id": False,
+                                "method.request.querystring.include": False,
+                            }
                             if key == "customers"
                             else {}
                         ),
@@ -254,6 +418,16 @@ class ApiGatewayStack(pulumi.ComponentResource):
                             if key == "orders"
                             else {}
                         ),
+                        # Optional pagination and export parameters of the list endpoints
+                        **(
+                            {
+                                "method.request.querystring.limit": False,
+                                "method.request.querystring.after": False,
+                                "method.request.querystring.export": False,
+                            }
+                            if method == "GET"
+                            else {}
+                        ),
                     },
                 )
                 methods[method_name] = api_method
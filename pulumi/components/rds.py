@@ -18,6 +18,7 @@ class RdsStack(pulumi.ComponentResource):
         subnet_ids: pulumi.Input[list],
         rds_security_group_id: pulumi.Input[str],
         is_development: bool = True,
+        create_read_replica: bool = False,
         opts: pulumi.ResourceOptions = None,
     ):
         super().__init__("custom:RdsStack", name, None, opts)
@@ -105,6 +106,26 @@ class RdsStack(pulumi.ComponentResource):
             ),  # Ensures DB exists and is ready
         )
 
+        self.rds_reader_endpoint = None
+        if create_read_replica:
+            # Serves the REST API reads so ingestion writes on the primary don't slow them down
+            db_replica = aws.rds.Instance(
+                resource_name=get_resource_name("rds-instance-replica", env),
+                identifier=f"rds-instance-replica-{env}",
+                replicate_source_db=db_instance.identifier,
+                instance_class="db.t3.micro",
+                vpc_security_group_ids=[rds_security_group_id],
+                auto_minor_version_upgrade=False,
+                parameter_group_name="default.postgres16",
+                publicly_accessible=True,
+                skip_final_snapshot=True,
+                deletion_protection=not is_development,
+                storage_encrypted=True,
+                tags={**tags, "Name": get_resource_name("rds-instance-replica", env)},
+                opts=pulumi.ResourceOptions(parent=self),
+            )
+            self.rds_reader_endpoint = db_replica.address
+
         self.rds_instance_arn = db_instance.arn
         self.rds_endpoint = db_instance.address
         self.rds_secret_name = rds_secret.name
@@ -53,6 +53,22 @@ class StepFunctionsStack(pulumi.ComponentResource):
             opts=ResourceOptions(parent=s3_backup_data),
         )
 
+        # IDs loaded into RDS, read by the REST API to keep its ID filters up to date
+        self.id_filter_updates_table = aws.dynamodb.Table(
+            get_resource_name("id-filter-updates", env),
+            name=get_resource_name("id-filter-updates", env),
+            hash_key="table_name",
+            range_key="update_key",
+            attributes=[
+                aws.dynamodb.TableAttributeArgs(name="table_name", type="S"),
+                aws.dynamodb.TableAttributeArgs(name="update_key", type="S"),
+            ],
+            billing_mode="PAY_PER_REQUEST",
+            ttl=aws.dynamodb.TableTtlArgs(attribute_name="expires_at", enabled=True),
+            tags=tags,
+            opts=ResourceOptions(parent=self),
+        )
+
         # Lambda role for inserting data into rds
         lambda_role = aws.iam.Role(
             get_resource_name("lambda-insert-role", env),
@@ -75,7 +91,7 @@ class StepFunctionsStack(pulumi.ComponentResource):
             get_resource_name("lambda-insert-policy", env),
             role=lambda_role.id,
             policy=pulumi.Output.all(
-                s3_event_data.bucket, rds_instance_arn, rds_secret_arn
+                s3_event_data.bucket, rds_instance_arn, rds_secret_arn, self.id_filter_updates_table.arn
             ).apply(
                 lambda arn: json.dumps(
                     {
@@ -115,6 +131,11 @@ class StepFunctionsStack(pulumi.ComponentResource):
                                 "Resource": f"{arn[2]}",
                                 "Effect": "Allow",
                             },
+                            {
+                                "Action": ["dynamodb:PutItem"],
+                                "Resource": f"{arn[3]}",
+                                "Effect": "Allow",
+                            },
                         ],
                     }
                 )
@@ -141,6 +162,15 @@ class StepFunctionsStack(pulumi.ComponentResource):
             opts=ResourceOptions(parent=self),
         )
 
+        # Code shared by all Lambda functions (metrics, Secrets Manager cache)
+        self.common_layer = aws.lambda_.LayerVersion(
+            get_resource_name("common-layer", env),
+            layer_name="python_common_layer",
+            compatible_runtimes=["python3.9"],
+            code=pulumi.FileArchive("../lambda_layers/common"),
+            opts=ResourceOptions(parent=self),
+        )
+
         # Lambda Function to Insert into RDS
         lambda_insert = aws.lambda_.Function(
             resource_name=get_resource_name("lambda_insert_data_into_rds", env),
@@ -150,7 +180,7 @@ class StepFunctionsStack(pulumi.ComponentResource):
             role=lambda_role.arn,
             timeout=300,
             memory_size=256,
-            layers=[self.pg8000_layer.arn, self.logging_layer.arn],
+            layers=[self.pg8000_layer.arn, self.logging_layer.arn, self.common_layer.arn],
             code=pulumi.AssetArchive(
                 {".": pulumi.FileArchive("./lambda_insert_data_into_rds")}
             ),
@@ -161,6 +191,7 @@ class StepFunctionsStack(pulumi.ComponentResource):
                     "RDS_HOST": rds_endpoint_address,
                     "SSM_NAME": rds_secret_name,
                     "RDS_DB": "database_rds",
+                    "ID_FILTER_UPDATES_TABLE": self.id_filter_updates_table.name,
                 }
             },
             opts=ResourceOptions(parent=self),
@@ -234,7 +265,7 @@ class StepFunctionsStack(pulumi.ComponentResource):
             role=lambda_backup_role.arn,
             timeout=300,
             memory_size=256,
-            layers=[self.logging_layer.arn],
+            layers=[self.logging_layer.arn, self.common_layer.arn],
             code=pulumi.AssetArchive(
                 {".": pulumi.FileArchive("./lambda_store_backup")}
             ),
@@ -424,5 +455,7 @@ class StepFunctionsStack(pulumi.ComponentResource):
                 "step_function_arn": state_machine.arn,
                 "pg8000_layer_arn": self.pg8000_layer.arn,
                 "logging_layer_arn": self.logging_layer.arn,
+                "common_layer_arn": self.common_layer.arn,
+                "id_filter_updates_table": self.id_filter_updates_table.name,
             }
         )
@@ -1,6 +1,8 @@
 import os
 import boto3
+import functools
 import logging
+from lambda_common import InvocationMetrics
 
 S3_EVENT_DATA = os.environ.get("S3_EVENT_DATA")
 S3_BACKUP_DATA = os.environ.get("S3_BACKUP_DATA")
@@ -9,12 +11,22 @@ logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
+metrics = InvocationMetrics(os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "lambda_store_backup"))
+
+
+@functools.lru_cache(maxsize=None)
+def get_client(service_name):
+    """Creates a boto3 client on first use and reuses it for the lifetime of the container."""
+    return boto3.client(service_name)
+
+
+@metrics.instrument
 def lambda_handler(event, context):
     if not all([S3_EVENT_DATA, S3_BACKUP_DATA]):
         raise ValueError("One or more required environment variables are missing.")
 
     logger.info("Starting to process files...")
-    s3_client = boto3.client('s3')
+    s3_client = get_client('s3')
 
     logger.info(f"Event looks following: {event}")
     if 'body' in event:
@@ -45,13 +57,16 @@ def lambda_handler(event, context):
 def move_file(s3_client, source_bucket, source_key, destination_bucket, destination_key):
     try:
         # Copy the file
-        s3_client.copy_object(
-            Bucket=destination_bucket,
-            CopySource={'Bucket': source_bucket, 'Key': source_key},
-            Key=destination_key
-        )
+        with metrics.phase("S3Copy"):
+            s3_client.copy_object(
+                Bucket=destination_bucket,
+                CopySource={'Bucket': source_bucket, 'Key': source_key},
+                Key=destination_key
+            )
         # Delete the original file
-        s3_client.delete_object(Bucket=source_bucket, Key=source_key)
+        with metrics.phase("S3Delete"):
+            s3_client.delete_object(Bucket=source_bucket, Key=source_key)
+        metrics.count("Files", 1)
         logger.info(
             f"Successfully moved file from {source_bucket}/{source_key} to {destination_bucket}/{destination_key}.")
     except Exception as e:
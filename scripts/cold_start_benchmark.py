@@ -0,0 +1,148 @@
+"""Cold start benchmark for the Lambda handlers.
+
+Every handler module is imported in a fresh interpreter started with ``python -X importtime``, the
+same work Lambda does in the init phase of a cold start. The script reports the median init time of
+each handler against a budget, together with the slowest imports from the import-time profile, and
+exits with status 1 when a handler is over budget.
+
+The pg8000 layer zip of the chosen tree is extracted and put on the path like Lambda does with
+/opt/python, together with the shared lambda_layers/common layer; boto3 has to be installed locally
+as it is part of the Lambda runtime. Run it with the functions' Python version: layer modules
+without bytecode for that version are compiled from source on every cold start, and that shows up
+in the profile.
+
+Usage:
+    python scripts/cold_start_benchmark.py --tree cdk_stack_infrastructure --budget-ms 300 --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import zipfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMMON_LAYER_DIR = os.path.join(REPO_ROOT, "lambda_layers", "common", "python")
+
+HANDLERS = {
+    "cdk_stack_infrastructure": {
+        "lambda_rest_api": "lambda_rest_api/lambda_handler.py",
+        "lambda_insert_data_into_rds": "lambda_insert_data_into_rds/lambda_handler.py",
+        "lambda_store_backup": "lambda_store_backup/lambda_handler.py",
+        "lambda_grant_token_access": "lambda_grant_token_access/lambda_handler.py",
+    },
+    "pulumi": {
+        "lambda_rest_api": "lambda_rest_api/lambda_handler.py",
+        "lambda_insert_data_into_rds": "lambda_insert_data_into_rds/lambda_handler.py",
+        "lambda_store_backup": "lambda_store_backup/lambda_handler.py",
+        "lambda_grant_token_access": "lambda_grant_token_access/lambda_handler.py",
+    },
+    "terraform": {
+        "lambda_rest_api": "lambda_rest_api/src/lambda_handler.py",
+        "lambda_insert_data_into_rds": "lambda/src/lambda_handler.py",
+        "lambda_store_backup": "lambda_store_backup/src/lambda_handler.py",
+        "lambda_grant_token_access": "lambda_grant_token_access/src/lambda_handler.py",
+    },
+}
+
+LAYER_ZIPS = {
+    "cdk_stack_infrastructure": "dependencies/pg8000.zip",
+    "pulumi": "dependencies/pg8000.zip",
+    "terraform": "lambda/dependencies/pg8000.zip",
+}
+
+# Runs in the child interpreter: times the handler module import only, not the interpreter startup
+CHILD_SCRIPT = """
+import importlib.util, json, sys, time
+started = time.perf_counter()
+spec = importlib.util.spec_from_file_location("lambda_handler", sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+print(json.dumps({"init_ms": (time.perf_counter() - started) * 1000}))
+"""
+
+
+def parse_importtime(stderr):
+    """Returns (module, cumulative_ms) for the top level imports of an ``-X importtime`` profile."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if name.startswith("  "):
+            # Nested import, already included in its parent's cumulative time
+            continue
+        imports.append((name.strip(), int(cumulative) / 1000))
+    return imports
+
+
+def measure(handler_path, layer_dir):
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join(
+            filter(None, [layer_dir, COMMON_LAYER_DIR, os.environ.get("PYTHONPATH")])
+        ),
+        "AWS_DEFAULT_REGION": os.environ.get("AWS_DEFAULT_REGION", "eu-west-1"),
+        # /opt is read-only in Lambda, so bytecode compiled during a cold start is not kept
+        "PYTHONDONTWRITEBYTECODE": "1",
+    }
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD_SCRIPT, handler_path],
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {handler_path} failed:\n{result.stderr[-2000:]}")
+    init_ms = json.loads(result.stdout.strip().splitlines()[-1])["init_ms"]
+    return init_ms, parse_importtime(result.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cold init time of Lambda handlers.")
+    parser.add_argument("--tree", choices=sorted(HANDLERS), default="cdk_stack_infrastructure")
+    parser.add_argument(
+        "--budget-ms", type=float, default=300.0, help="Maximum median init time per handler"
+    )
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per handler")
+    parser.add_argument("--top", type=int, default=5, help="Slowest imports listed per handler")
+    args = parser.parse_args()
+
+    tree_dir = os.path.join(REPO_ROOT, args.tree)
+    over_budget = []
+
+    with tempfile.TemporaryDirectory() as layer_root:
+        with zipfile.ZipFile(os.path.join(tree_dir, LAYER_ZIPS[args.tree])) as layer:
+            layer.extractall(layer_root)
+        layer_dir = os.path.join(layer_root, "python")
+
+        print(f"{'handler':<30} {'median ms':>10} {'max ms':>10} {'budget ms':>10}  status")
+        for name, relative_path in HANDLERS[args.tree].items():
+            samples = []
+            for _ in range(args.runs):
+                init_ms, imports = measure(os.path.join(tree_dir, relative_path), layer_dir)
+                samples.append(init_ms)
+
+            median_ms = statistics.median(samples)
+            status = "ok" if median_ms <= args.budget_ms else "OVER BUDGET"
+            if median_ms > args.budget_ms:
+                over_budget.append(name)
+            print(
+                f"{name:<30} {median_ms:>10.1f} {max(samples):>10.1f} "
+                f"{args.budget_ms:>10.1f}  {status}"
+            )
+
+            # The profile of the last run; the first ones warm the OS file cache
+            slowest = sorted(imports, key=lambda item: item[1], reverse=True)[:args.top]
+            for module, cumulative_ms in slowest:
+                print(f"    {module:<40} {cumulative_ms:>8.1f} ms")
+
+    if over_budget:
+        print(f"Over the {args.budget_ms:.0f} ms budget: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Issues and revokes API tokens in the token table read by the token authorizer.
+
+Only a salted PBKDF2-SHA256 hash of a token is stored, keyed by its fingerprint (a prefix of its
+SHA-256); the token itself is printed once and can't be recovered afterwards. The authorizer picks
+new and revoked tokens up within its refresh interval, no deployment is needed.
+
+Usage:
+    python scripts/issue_api_token.py --table api-tokens-dev --principal reporting --scope read \
+        --expires-days 90
+    python scripts/issue_api_token.py --table api-tokens-dev --revoke 3f0c1a9b2d4e5f60
+"""
+import argparse
+import datetime
+import hashlib
+import secrets
+import time
+
+import boto3
+
+# Kept in line with hash_token of the token authorizer
+DEFAULT_ITERATIONS = 50000
+
+
+def hash_token(token, salt, iterations):
+    return hashlib.pbkdf2_hmac("sha256", token.encode(), bytes.fromhex(salt), iterations).hex()
+
+
+def updated_day(timestamp):
+    """Partition key of the updated_day-index, which the authorizer queries for changed tokens."""
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).date().isoformat()
+
+
+def issue(dynamodb, table, principal, scope, expires_days, iterations):
+    token = secrets.token_urlsafe(32)
+    fingerprint = hashlib.sha256(token.encode()).hexdigest()[:16]
+    salt = secrets.token_hex(16)
+    now = int(time.time())
+    item = {
+        "fingerprint": {"S": fingerprint},
+        "salt": {"S": salt},
+        "hash": {"S": hash_token(token, salt, iterations)},
+        "iterations": {"N": str(iterations)},
+        "principal": {"S": principal},
+        "scope": {"S": scope},
+        "updated_at": {"N": str(now)},
+        "updated_day": {"S": updated_day(now)},
+    }
+    if expires_days:
+        item["expires_at"] = {"N": str(now + expires_days * 86400)}
+    dynamodb.put_item(
+        TableName=table, Item=item, ConditionExpression="attribute_not_exists(fingerprint)"
+    )
+    print(f"principal:   {principal}")
+    print(f"fingerprint: {fingerprint}")
+    print(f"token:       {token}")
+
+
+def revoke(dynamodb, table, fingerprint):
+    # Revoked items stay in the table so that incremental reloads of the authorizer see the change
+    now = int(time.time())
+    dynamodb.update_item(
+        TableName=table,
+        Key={"fingerprint": {"S": fingerprint}},
+        UpdateExpression="SET revoked = :revoked, updated_at = :now, updated_day = :day",
+        ConditionExpression="attribute_exists(fingerprint)",
+        ExpressionAttributeValues={
+            ":revoked": {"BOOL": True},
+            ":now": {"N": str(now)},
+            ":day": {"S": updated_day(now)},
+        },
+    )
+    print(f"Revoked {fingerprint}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Issue or revoke an API token.")
+    parser.add_argument("--table", required=True, help="Name of the api-tokens DynamoDB table")
+    parser.add_argument("--principal", help="Client the token is issued to")
+    parser.add_argument(
+        "--scope", default="", help="Space separated scopes: read, write; empty grants all methods"
+    )
+    parser.add_argument(
+        "--expires-days", type=int, default=0, help="Days until the token expires; 0 never expires"
+    )
+    parser.add_argument(
+        "--iterations", type=int, default=DEFAULT_ITERATIONS, help="PBKDF2 iterations"
+    )
+    parser.add_argument(
+        "--revoke", metavar="FINGERPRINT", help="Revoke the token with this fingerprint"
+    )
+    args = parser.parse_args()
+
+    dynamodb = boto3.client("dynamodb")
+    if args.revoke:
+        revoke(dynamodb, args.table, args.revoke)
+    elif args.principal:
+        issue(dynamodb, args.table, args.principal, args.scope, args.expires_days, args.iterations)
+    else:
+        parser.error("either --principal or --revoke is required")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,11 @@ resource "aws_lambda_function" "lambda_data_preprocessing" {
   function_name = "lambda_insert_data_into_rds-${local.name_alias}"
 
   filename         = "${path.module}/lambda/.output/lambda_handler.zip"
-  layers           = [aws_lambda_layer_version.python_pg8000_layer.arn, aws_lambda_layer_version.python_logging_layer.arn]
+  layers = [
+    aws_lambda_layer_version.python_pg8000_layer.arn,
+    aws_lambda_layer_version.python_logging_layer.arn,
+    aws_lambda_layer_version.python_common_layer.arn,
+  ]
   source_code_hash = data.archive_file.zip_the_python_code.output_base64sha256
 
   role    = aws_iam_role.lambda_role.arn
@@ -12,11 +16,12 @@ resource "aws_lambda_function" "lambda_data_preprocessing" {
 
   environment {
     variables = {
-      S3_BACKUP_DATA = aws_s3_bucket.s3_backup_data.bucket
-      S3_EVENT_DATA  = aws_s3_bucket.s3_event_data.bucket
-      RDS_HOST       = aws_db_instance.rds.address
-      SSM_NAME       = aws_secretsmanager_secret.rds_password_secret.name
-      RDS_DB         = var.rds_database_name
+      S3_BACKUP_DATA          = aws_s3_bucket.s3_backup_data.bucket
+      S3_EVENT_DATA           = aws_s3_bucket.s3_event_data.bucket
+      RDS_HOST                = aws_db_instance.rds.address
+      SSM_NAME                = aws_secretsmanager_secret.rds_password_secret.name
+      RDS_DB                  = var.rds_database_name
+      ID_FILTER_UPDATES_TABLE = aws_dynamodb_table.id_filter_updates.name
     }
   }
 
@@ -25,6 +30,29 @@ resource "aws_lambda_function" "lambda_data_preprocessing" {
   ]
 }
 
+# IDs loaded into RDS, read by the REST API to keep its ID filters up to date
+resource "aws_dynamodb_table" "id_filter_updates" {
+  name         = "id-filter-updates-${local.name_alias}"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "table_name"
+  range_key    = "update_key"
+
+  attribute {
+    name = "table_name"
+    type = "S"
+  }
+
+  attribute {
+    name = "update_key"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+}
+
 data "archive_file" "zip_the_python_code" {
   type        = "zip"
   source_dir  = "${path.module}/lambda/src"
@@ -45,6 +73,21 @@ resource "aws_lambda_layer_version" "python_logging_layer" {
   compatible_runtimes = ["python3.8", "python3.9"]
 }
 
+# Code shared by all Lambda functions (metrics, Secrets Manager cache)
+data "archive_file" "zip_the_common_layer" {
+  type        = "zip"
+  source_dir  = "${path.module}/../lambda_layers/common"
+  output_path = "${path.module}/lambda/.output/common_layer.zip"
+}
+
+resource "aws_lambda_layer_version" "python_common_layer" {
+  filename         = data.archive_file.zip_the_common_layer.output_path
+  layer_name       = "python_common_layer"
+  source_code_hash = data.archive_file.zip_the_common_layer.output_base64sha256
+
+  compatible_runtimes = ["python3.8", "python3.9", "python3.11"]
+}
+
 resource "aws_iam_role" "lambda_role" {
   name = "lambda_insert_data_into_rds-role-${local.name_alias}"
 
@@ -108,6 +151,13 @@ resource "aws_iam_policy" "lambda_essential_policies" {
           "secretsmanager:DescribeSecret"
         ],
         Resource = aws_secretsmanager_secret.rds_password_secret.arn
+      },
+      {
+        Effect = "Allow",
+        Action = [
+          "dynamodb:PutItem"
+        ],
+        Resource = aws_dynamodb_table.id_filter_updates.arn
       }
     ]
   })
@@ -1,8 +1,12 @@
 import os
 import boto3
+import functools
 import pg8000
 import json
 import logging
+import time
+import uuid
+from lambda_common import InvocationMetrics, SecretCache
 
 S3_EVENT_DATA = os.environ.get("S3_EVENT_DATA")
 RDS_HOST = os.environ.get("RDS_HOST")
@@ -10,22 +14,39 @@ RDS_DB = os.environ.get("RDS_DB")
 RDS_USER = "postgres"
 RDS_PORT = 5432
 SSM_NAME = os.environ.get("SSM_NAME")
+ID_FILTER_UPDATES_TABLE = os.environ.get("ID_FILTER_UPDATES_TABLE")
+ID_FILTER_UPDATE_TTL_SECONDS = int(os.environ.get("ID_FILTER_UPDATE_TTL_SECONDS", 86400))
+# Keeps an item well below the 400 KB DynamoDB item limit
+ID_FILTER_IDS_PER_ITEM = 5000
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
+metrics = InvocationMetrics(
+    os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "lambda_insert_data_into_rds")
+)
+
+
+@functools.lru_cache(maxsize=None)
+def get_client(service_name):
+    """Creates a boto3 client on first use and reuses it for the lifetime of the container."""
+    return boto3.client(service_name)
+
+
+secrets_cache = SecretCache(functools.partial(get_client, "secretsmanager"), metrics=metrics)
+
+
+@metrics.instrument
 def lambda_handler(event, context):
     if not all([S3_EVENT_DATA, RDS_HOST, RDS_DB, SSM_NAME]):
         raise ValueError("One or more required environment variables are missing.")
 
-    secrets_client = boto3.client("secretsmanager")
-    secret = get_db_password(secrets_client)
+    secret = get_db_password()
 
     logger.info(f"Starting to process event data...{event}")
 
-    # Initialize S3 client
-    s3_client = boto3.client('s3')
+    s3_client = get_client('s3')
 
     # Handle both S3 and EventBridge formats
     if 'Records' in event:  # S3 format
@@ -38,9 +59,13 @@ def lambda_handler(event, context):
     logger.info(f"Processing file: {file_key}")
 
     try:
-        response = s3_client.get_object(Bucket=S3_EVENT_DATA, Key=file_key)
-        content = response['Body'].read().decode('utf-8')
-        data = json.loads(content)
+        with metrics.phase("S3Download"):
+            response = s3_client.get_object(Bucket=S3_EVENT_DATA, Key=file_key)
+            content = response['Body'].read().decode('utf-8')
+        metrics.count("Bytes", len(content), unit="Bytes")
+
+        with metrics.phase("Parse"):
+            data = json.loads(content)
 
         if not data or not isinstance(data, list) or not all(isinstance(row, dict) for row in data):
             logger.error("Invalid input: 'data' must be a list of dictionaries with uniform keys.")
@@ -97,10 +122,12 @@ def lambda_handler(event, context):
     }
 
 
-def get_db_password(secrets_client):
+def get_db_password(force_refresh=False):
     try:
-        response = secrets_client.get_secret_value(SecretId=SSM_NAME)
-        secret = json.loads(response['SecretString'])
+        if force_refresh:
+            secret = secrets_cache.refresh(SSM_NAME)
+        else:
+            secret = secrets_cache.get(SSM_NAME)
         logger.info("Database secret retrieved successfully.")
         return secret['password']
     except Exception as e:
@@ -108,6 +135,32 @@ def get_db_password(secrets_client):
         raise
 
 
+def is_authentication_error(error):
+    """True when PostgreSQL rejected the credentials (e.g. the password was rotated)."""
+    details = error.args[0] if error.args else None
+    return isinstance(details, dict) and details.get("C") in ("28P01", "28000")
+
+
+def connect_to_rds(db_host, db_port, db_user, db_password, db_name):
+    """Opens a connection, reloading the password once if it was rotated since it was cached."""
+    try:
+        with metrics.phase("Connect"):
+            return pg8000.connect(
+                host=db_host, port=db_port, user=db_user, password=db_password, database=db_name
+            )
+    except pg8000.DatabaseError as e:
+        if not is_authentication_error(e):
+            raise
+        logger.warning("Database authentication failed, reloading credentials")
+        return pg8000.connect(
+            host=db_host,
+            port=db_port,
+            user=db_user,
+            password=get_db_password(force_refresh=True),
+            database=db_name
+        )
+
+
 def store_data_in_rds(db_host, db_port, db_user, db_password, db_name, data, table_name, columns, conflict_column):
     placeholders = ', '.join(['%s'] * len(columns))
     column_names = ', '.join(columns)
@@ -120,19 +173,39 @@ def store_data_in_rds(db_host, db_port, db_user, db_password, db_name, data, tab
     """
 
     try:
-        with pg8000.connect(
-            host=db_host,
-            port=db_port,
-            user=db_user,
-            password=db_password,
-            database=db_name
-        ) as connection:
-            with connection.cursor() as cursor:
+        with connect_to_rds(db_host, db_port, db_user, db_password, db_name) as connection:
+            with connection.cursor() as cursor, metrics.phase("Insert"):
                 rows = [tuple(row[col] for col in columns) for row in data]
                 cursor.executemany(insert_query, rows)
+            # Published before the commit, so the REST API's ID filters know every row once it
+            # is visible; a failure rolls the batch back and the load can be retried
+            publish_loaded_ids(table_name, [row[conflict_column] for row in data])
+            with metrics.phase("Insert"):
                 connection.commit()
-                logger.info(f"Successfully stored {len(rows)} records in {table_name} table.")
+            metrics.count("Rows", len(rows))
+            logger.info(f"Successfully stored {len(rows)} records in {table_name} table.")
         return True
     except Exception as e:
         logger.error(f"Error storing data in {table_name} table: {e}")
-        return False
\ No newline at end of file
+        return False
+
+
+def publish_loaded_ids(table_name, record_ids):
+    """Publishes the IDs of a loaded batch to ID_FILTER_UPDATES_TABLE."""
+    if not ID_FILTER_UPDATES_TABLE:
+        return
+    unique_ids = sorted({str(int(record_id)) for record_id in record_ids})
+    dynamodb = get_client("dynamodb")
+    with metrics.phase("PublishIds"):
+        for start in range(0, len(unique_ids), ID_FILTER_IDS_PER_ITEM):
+            now = time.time()
+            dynamodb.put_item(
+                TableName=ID_FILTER_UPDATES_TABLE,
+                Item={
+                    "table_name": {"S": table_name},
+                    "update_key": {"S": f"{int(now * 1000):013d}-{uuid.uuid4().hex}"},
+                    "ids": {"NS": unique_ids[start:start + ID_FILTER_IDS_PER_ITEM]},
+                    "expires_at": {"N": str(int(now + ID_FILTER_UPDATE_TTL_SECONDS))},
+                },
+            )
+    logger.info(f"Published {len(unique_ids)} loaded IDs of {table_name} for the ID filters.")
\ No newline at end of file
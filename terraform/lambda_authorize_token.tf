@@ -1,7 +1,7 @@
 resource "aws_lambda_function" "lambda_token_authorizer" {
   function_name    = "lambda-token-authorizer-${local.name_alias}"
   filename         = "${path.module}/lambda_grant_token_access/.output/lambda_handler.zip"
-  layers           = [aws_lambda_layer_version.python_logging_layer.arn]
+  layers           = [aws_lambda_layer_version.python_logging_layer.arn, aws_lambda_layer_version.python_common_layer.arn]
   source_code_hash = data.archive_file.zip_the_lambda_token_access.output_base64sha256
 
   role    = aws_iam_role.lambda_authorize_token_role.arn
@@ -12,6 +12,9 @@ resource "aws_lambda_function" "lambda_token_authorizer" {
     variables = {
       API_GATEWAY_TOKEN = aws_secretsmanager_secret.api_password_secret.name
       REGION            = var.region_aws
+      TOKEN_TABLE       = aws_dynamodb_table.api_tokens.name
+      JWT_AUDIENCE      = var.jwt_audience
+      JWT_KEYS_SECRET   = aws_secretsmanager_secret.jwt_keys_secret.name
     }
   }
   depends_on = [
@@ -26,6 +29,37 @@ data "archive_file" "zip_the_lambda_token_access" {
 }
 
 
+# Hashed API tokens issued to clients, read by the token authorizer
+resource "aws_dynamodb_table" "api_tokens" {
+  name         = "api-tokens-${local.name_alias}"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "fingerprint"
+
+  attribute {
+    name = "fingerprint"
+    type = "S"
+  }
+
+  attribute {
+    name = "updated_day"
+    type = "S"
+  }
+
+  attribute {
+    name = "updated_at"
+    type = "N"
+  }
+
+  # Tokens by day of their last change, queried by the authorizer's incremental refresh
+  global_secondary_index {
+    name            = "updated_day-index"
+    hash_key        = "updated_day"
+    range_key       = "updated_at"
+    projection_type = "ALL"
+  }
+}
+
+
 ## IAM role and attachment
 resource "aws_iam_role" "lambda_authorize_token_role" {
   name = "lambda_authorize_token-${local.name_alias}"
@@ -69,7 +103,19 @@ resource "aws_iam_policy" "lambda_authorize_token_policies" {
         ],
         Resource = [
           aws_secretsmanager_secret.api_password_secret.arn,
-          aws_secretsmanager_secret.rds_password_secret.arn
+          aws_secretsmanager_secret.rds_password_secret.arn,
+          aws_secretsmanager_secret.jwt_keys_secret.arn
+        ]
+      },
+      {
+        Effect = "Allow",
+        Action = [
+          "dynamodb:Scan",
+          "dynamodb:Query"
+        ],
+        Resource = [
+          aws_dynamodb_table.api_tokens.arn,
+          "${aws_dynamodb_table.api_tokens.arn}/index/*"
         ]
       },
     ]
@@ -1,27 +1,207 @@
 import os
+import base64
+import datetime
 import json
 import logging
+import time
 import boto3
+import functools
+import hashlib
+import hmac
+from lambda_common import InvocationMetrics, SecretCache
 
 # Environment variables
 API_GATEWAY_TOKEN = os.environ.get('API_GATEWAY_TOKEN')
 REGION = os.environ.get('REGION')
+SECRET_REFRESH_COOLDOWN_SECONDS = int(os.environ.get("SECRET_REFRESH_COOLDOWN_SECONDS", 30))
+TOKEN_TABLE = os.environ.get("TOKEN_TABLE")
+TOKEN_INDEX_REFRESH_SECONDS = int(os.environ.get("TOKEN_INDEX_REFRESH_SECONDS", 60))
+TOKEN_INDEX_FULL_RELOAD_SECONDS = int(os.environ.get("TOKEN_INDEX_FULL_RELOAD_SECONDS", 3600))
+# Overlap of incremental refreshes, covers clock skew of the issuers and index propagation delay
+TOKEN_INDEX_UPDATE_LAG_SECONDS = int(os.environ.get("TOKEN_INDEX_UPDATE_LAG_SECONDS", 60))
+TOKEN_INDEX_NEGATIVE_TTL_SECONDS = int(os.environ.get("TOKEN_INDEX_NEGATIVE_TTL_SECONDS", 300))
+# Global secondary index of the token table: partition updated_day (YYYY-MM-DD, UTC), sort
+# updated_at
+TOKEN_UPDATES_INDEX = os.environ.get("TOKEN_UPDATES_INDEX", "updated_day-index")
+TOKEN_VERIFICATION_CACHE_SIZE = int(os.environ.get("TOKEN_VERIFICATION_CACHE_SIZE", 4096))
+# Signed token (JWT) mode is enabled by setting the audience the tokens must be issued for
+JWT_AUDIENCE = os.environ.get("JWT_AUDIENCE")
+JWT_KEYS_SECRET = os.environ.get("JWT_KEYS_SECRET")
+JWT_ISSUER = os.environ.get("JWT_ISSUER")
+JWT_LEEWAY_SECONDS = int(os.environ.get("JWT_LEEWAY_SECONDS", 30))
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-client = boto3.client("secretsmanager", region_name=REGION)
 
+metrics = InvocationMetrics(os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "lambda_grant_token_access"))
 
+@functools.lru_cache(maxsize=None)
+def get_client(service_name):
+    """Creates a boto3 client on first use and reuses it for the lifetime of the container."""
+    return boto3.client(service_name, region_name=REGION)
+
+
+secrets_cache = SecretCache(functools.partial(get_client, "secretsmanager"), metrics=metrics)
+
+# Methods a token scope may invoke; tokens without a scope may invoke every method
+SCOPE_METHODS = {"read": "GET", "write": "PUT"}
+
+
+def token_fingerprint(token_digest):
+    """Lookup key of a token in the index: a prefix of its SHA-256, not enough to verify it."""
+    return token_digest[:16]
+
+
+def hash_token(token, salt, iterations):
+    return hashlib.pbkdf2_hmac("sha256", token.encode(), bytes.fromhex(salt), iterations).hex()
+
+
+def updated_days(since, until):
+    """UTC days from ``since`` to ``until`` (epoch seconds), partitions of TOKEN_UPDATES_INDEX."""
+    day = datetime.datetime.fromtimestamp(since, datetime.timezone.utc).date()
+    last = datetime.datetime.fromtimestamp(until, datetime.timezone.utc).date()
+    while day <= last:
+        yield day.isoformat()
+        day += datetime.timedelta(days=1)
+
+
+class TokenIndex:
+    """Issued API tokens, loaded from a DynamoDB table into a dict keyed by fingerprint."""
+
+    def __init__(self, table_name, clock=time.time):
+        self.table_name = table_name
+        self.clock = clock
+        self._entries = {}
+        self._verified = {}
+        self._unknown = {}
+        self._updated_since = None
+        self._loaded_at = None
+        self._fully_loaded_at = None
+
+    def lookup(self, token):
+        """Returns the index entry of a valid token, None if it isn't issued, expired or revoked."""
+        self._refresh_if_stale(TOKEN_INDEX_REFRESH_SECONDS)
+        token_digest = hashlib.sha256(token.encode()).hexdigest()
+        fingerprint = token_fingerprint(token_digest)
+        entry = self._entries.get(fingerprint)
+        if entry is None:
+            entry = self._lookup_unknown(fingerprint)
+        if entry is None or (entry["expires_at"] and entry["expires_at"] <= self.clock()):
+            return None
+
+        # Reloading an item replaces its entry, which invalidates the earlier verification
+        if self._verified.get(token_digest) is not entry:
+            with metrics.phase("TokenHash"):
+                presented = hash_token(token, entry["salt"], entry["iterations"])
+            if not hmac.compare_digest(presented, entry["hash"]):
+                return None
+            if len(self._verified) >= TOKEN_VERIFICATION_CACHE_SIZE:
+                self._verified.clear()
+            self._verified[token_digest] = entry
+        return entry
+
+    def _lookup_unknown(self, fingerprint):
+        """Refreshes the index for an unknown fingerprint, unless it was recently looked up."""
+        now = time.monotonic()
+        if self._unknown.get(fingerprint, 0) > now:
+            metrics.count("TokenIndexNegativeHits", 1)
+            return None
+        if self._refresh_if_stale(SECRET_REFRESH_COOLDOWN_SECONDS):
+            entry = self._entries.get(fingerprint)
+            if entry is not None:
+                return entry
+        if len(self._unknown) >= TOKEN_VERIFICATION_CACHE_SIZE:
+            self._unknown.clear()
+        self._unknown[fingerprint] = now + TOKEN_INDEX_NEGATIVE_TTL_SECONDS
+        return None
+
+    def _refresh_if_stale(self, max_age_seconds):
+        now = time.monotonic()
+        if self._loaded_at is not None and now - self._loaded_at < max_age_seconds:
+            return False
+        full_reload = (
+            self._fully_loaded_at is None
+            or now - self._fully_loaded_at >= TOKEN_INDEX_FULL_RELOAD_SECONDS
+        )
+        try:
+            self._load(full_reload)
+        except Exception as e:
+            # Keep serving the tokens already loaded
+            logger.error(f"Error loading the token index: {e}")
+            self._loaded_at = now
+            return False
+        self._loaded_at = now
+        if full_reload:
+            self._fully_loaded_at = now
+        return True
+
+    def _read_items(self, full_reload):
+        """Every item on a full reload, otherwise the items updated since the last load."""
+        if full_reload or self._updated_since is None:
+            requests = [("scan", {"TableName": self.table_name})]
+        else:
+            # Items updated shortly before the last load are read again, applying them is idempotent
+            requests = [
+                ("query", {
+                    "TableName": self.table_name,
+                    "IndexName": TOKEN_UPDATES_INDEX,
+                    "KeyConditionExpression": "updated_day = :day AND updated_at >= :since",
+                    "ExpressionAttributeValues": {
+                        ":day": {"S": day},
+                        ":since": {"N": str(self._updated_since)},
+                    },
+                })
+                for day in updated_days(self._updated_since, self.clock())
+            ]
+        for operation, request_args in requests:
+            while True:
+                response = getattr(get_client("dynamodb"), operation)(**request_args)
+                yield from response.get("Items", [])
+                if "LastEvaluatedKey" not in response:
+                    break
+                request_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def _load(self, full_reload):
+        updated_since = int(self.clock()) - TOKEN_INDEX_UPDATE_LAG_SECONDS
+        entries = {} if full_reload else dict(self._entries)
+        loaded = 0
+        with metrics.phase("TokenIndexLoad"):
+            for item in self._read_items(full_reload):
+                fingerprint = item["fingerprint"]["S"]
+                loaded += 1
+                if item.get("revoked", {}).get("BOOL"):
+                    entries.pop(fingerprint, None)
+                    continue
+                entries[fingerprint] = {
+                    "salt": item["salt"]["S"],
+                    "hash": item["hash"]["S"],
+                    "iterations": int(item["iterations"]["N"]),
+                    "principal": item["principal"]["S"],
+                    "scope": item.get("scope", {}).get("S", ""),
+                    "expires_at": int(item["expires_at"]["N"]) if "expires_at" in item else None,
+                }
+
+        self._entries = entries
+        self._updated_since = updated_since
+        metrics.count("TokenIndexItemsLoaded", loaded)
+        logger.info(f"Token index {'reloaded' if full_reload else 'refreshed'}: "
+                    f"{loaded} items read, {len(entries)} tokens")
+
+
+token_index = TokenIndex(TOKEN_TABLE) if TOKEN_TABLE else None
+
+
+@metrics.instrument
 def lambda_handler(event, context):
     if not all([API_GATEWAY_TOKEN, REGION]):
         raise ValueError("API_GATEWAY_TOKEN required environment variable is missing.")
 
-    logger.info("Getting database crendentials...")
-    correct_password = return_password_based_on_secret(API_GATEWAY_TOKEN)
-    logger.info(f"event = {event}")
+    # The event carries the raw token, only the target method is logged
+    logger.info(f"Authorizing request for {event.get('methodArn')}")
 
     # Extract and normalize token
+    auth_token = None
     if 'authorizationToken' in event:
         token_value = event['authorizationToken']
 
@@ -34,21 +214,152 @@ def lambda_handler(event, context):
 
     if not auth_token:
         logger.warning("Missing Authorization token")
-        return generate_policy('user', 'Deny', event.get('methodArn', '*'))
+        return generate_policy('user', 'Deny', stage_arn(event.get('methodArn', '*')))
+
+    # Signed tokens are verified offline and never fall back to the other token types
+    if JWT_AUDIENCE and JWT_KEYS_SECRET and auth_token.count('.') == 2:
+        metrics.set_property("TokenType", "jwt")
+        claims = verify_jwt(auth_token)
+        if claims is None:
+            return generate_policy('user', 'Deny', stage_arn(event['methodArn']))
+        expires_at = int(claims['exp'] + JWT_LEEWAY_SECONDS)
+        return principal_policy(claims['sub'], jwt_scope(claims), event['methodArn'], expires_at)
+
+    # Validate authorization: issued tokens first, then the shared token of the secret
+    entry = token_index.lookup(auth_token) if token_index else None
+    if entry:
+        metrics.set_property("TokenType", "issued")
+        return principal_policy(
+            entry['principal'], entry['scope'], event['methodArn'], entry['expires_at']
+        )
 
-    # Validate authorization
-    if auth_token == correct_password:
+    metrics.set_property("TokenType", "shared")
+    if verify_token(auth_token):
         logger.info("Authorization successful")
-        return generate_policy('user', 'Allow', event['methodArn'])
+        context = {'caller': hashlib.sha256(auth_token.encode()).hexdigest()[:32]}
+        return generate_policy('user', 'Allow', stage_arn(event['methodArn']), context)
 
     logger.warning("Authorization failed: Invalid token")
-    return generate_policy('user', 'Deny', event['methodArn'])
+    return generate_policy('user', 'Deny', stage_arn(event['methodArn']))
 
 
-def return_password_based_on_secret(NAME_SECRET):
+def principal_policy(principal, scope, method_arn, expires_at=None):
+    """Policy for a token that identifies a principal, limited to its scope."""
+    resources = scope_arns(method_arn, scope)
+    if not resources:
+        logger.warning(f"Authorization failed: scope of {principal} grants no methods")
+        return generate_policy(principal, 'Deny', stage_arn(method_arn))
+    logger.info(f"Authorization successful for {principal}")
+    # Passed to the REST Lambda as requestContext.authorizer, so it doesn't validate the token again
+    context = {'caller': principal, 'principal': principal, 'scope': scope}
+    # The Allow is cached for the result TTL whatever the token's lifetime, the REST Lambda
+    # rejects cached results past expires_at
+    if expires_at:
+        context['expires_at'] = expires_at
+    return generate_policy(principal, 'Allow', resources, context)
+
+
+def b64url_decode(segment):
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def jwt_signing_key(kid):
+    """HMAC key with the given ``kid`` from the JWT_KEYS_SECRET secret."""
+    keys = secrets_cache.get(JWT_KEYS_SECRET)
+    if kid not in keys:
+        keys = secrets_cache.refresh(JWT_KEYS_SECRET)
+    key = keys.get(kid)
+    return key.encode() if key else None
+
+
+def verify_jwt(token):
+    """Claims of an HS256 JWT with a valid signature, expiry and audience; None otherwise."""
+    try:
+        header_segment, payload_segment, signature_segment = token.split(".")
+        header = json.loads(b64url_decode(header_segment))
+        # The algorithm is pinned, the header can't downgrade it (e.g. to "none")
+        if header.get("alg") != "HS256":
+            logger.warning(f"JWT rejected: unsupported algorithm {header.get('alg')}")
+            return None
+        key = jwt_signing_key(header.get("kid"))
+        if key is None:
+            logger.warning(f"JWT rejected: unknown key id {header.get('kid')}")
+            return None
+        signing_input = f"{header_segment}.{payload_segment}".encode()
+        signature = hmac.new(key, signing_input, hashlib.sha256).digest()
+        if not hmac.compare_digest(signature, b64url_decode(signature_segment)):
+            logger.warning("JWT rejected: invalid signature")
+            return None
+        claims = json.loads(b64url_decode(payload_segment))
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.warning(f"JWT rejected: malformed token ({e})")
+        return None
+
+    if not isinstance(claims, dict):
+        logger.warning("JWT rejected: payload is not a JSON object")
+        return None
+
+    now = time.time()
+    audiences = claims.get("aud") if isinstance(claims.get("aud"), list) else [claims.get("aud")]
+    if not isinstance(claims.get("exp"), (int, float)) or claims["exp"] + JWT_LEEWAY_SECONDS <= now:
+        reason = "expired"
+    elif isinstance(claims.get("nbf"), (int, float)) and claims["nbf"] - JWT_LEEWAY_SECONDS > now:
+        reason = "not valid yet"
+    elif JWT_AUDIENCE not in audiences:
+        reason = "wrong audience"
+    elif JWT_ISSUER and claims.get("iss") != JWT_ISSUER:
+        reason = "wrong issuer"
+    elif not isinstance(claims.get("sub"), str) or not claims["sub"]:
+        reason = "no subject"
+    else:
+        return claims
+    logger.warning(f"JWT rejected: {reason}")
+    return None
+
+
+def jwt_scope(claims):
+    """Space separated scopes of the ``scope`` claim, or of the ``scp`` list some issuers use."""
+    if isinstance(claims.get("scp"), list):
+        return " ".join(str(name) for name in claims["scp"])
+    return str(claims.get("scope") or "")
+
+
+# SHA-256 digests of the expected token, keyed by the secret's VersionId
+token_digests = {}
+
+
+def expected_token_digest(force_refresh=False):
+    password = return_password_based_on_secret(API_GATEWAY_TOKEN, force_refresh)
+    secret_version = secrets_cache.version_id(API_GATEWAY_TOKEN)
+    digest = token_digests.get(secret_version)
+    if digest is None:
+        # A new version replaces the old digest
+        token_digests.clear()
+        digest = token_digests[secret_version] = hashlib.sha256(password.encode()).digest()
+    return digest
+
+
+def verify_token(auth_token):
+    """Compares the token with the secret in constant time."""
+    presented = hashlib.sha256(auth_token.encode()).digest()
+    if hmac.compare_digest(presented, expected_token_digest()):
+        return True
+
+    version_before = secrets_cache.version_id(API_GATEWAY_TOKEN)
+    expected = expected_token_digest(force_refresh=True)
+    if secrets_cache.version_id(API_GATEWAY_TOKEN) == version_before:
+        return False
+    logger.info("Token secret was rotated, comparing against the new version")
+    return hmac.compare_digest(presented, expected)
+
+
+def return_password_based_on_secret(NAME_SECRET, force_refresh=False):
     try:
-        response = client.get_secret_value(SecretId=NAME_SECRET)
-        secret = json.loads(response["SecretString"])
+        if force_refresh:
+            # The token may have been rotated since it was cached
+            secret = secrets_cache.refresh(NAME_SECRET)
+        else:
+            secret = secrets_cache.get(NAME_SECRET)
         logger.info("Database secret retrieved successfully.")
         return secret["password"]
     except Exception as e:
@@ -56,14 +367,35 @@ def return_password_based_on_secret(NAME_SECRET):
         raise
 
 
-def generate_policy(principal_id, effect, resource):
+def stage_arn(method_arn):
+    """Widens a method ARN to every method and resource of its API stage."""
+    # A cached policy is evaluated for every route the token calls, not just this methodArn
+    arn_prefix, _, path = method_arn.partition("/")
+    stage = path.split("/", 1)[0]
+    if not stage:
+        return method_arn
+    return f"{arn_prefix}/{stage}/*"
+
+
+def scope_arns(method_arn, scope):
+    """Stage-wide resources for the methods of a token's space separated scopes."""
+    names = scope.split()
+    if not names or "*" in names:
+        return [stage_arn(method_arn)]
+    stage = stage_arn(method_arn)[:-len("*")]
+    methods = {SCOPE_METHODS[name] for name in names if name in SCOPE_METHODS}
+    return [f"{stage}{method}/*" for method in sorted(methods)]
+
+
+def generate_policy(principal_id, effect, resource, context=None):
     if not effect or not resource:
         logger.error("Invalid policy generation attempt: Missing effect/resource")
         raise ValueError("Invalid policy: effect and resource are required")
 
     logger.info(f"Generating {effect} policy for resource: {resource}")
+    metrics.set_property("Effect", effect)
 
-    return {
+    policy = {
         'principalId': principal_id,
         'policyDocument': {
             'Version': '2012-10-17',
@@ -74,3 +406,6 @@ def generate_policy(principal_id, effect, resource):
             }]
         }
     }
+    if context:
+        policy['context'] = context
+    return policy
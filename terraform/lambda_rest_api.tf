@@ -1,24 +1,40 @@
+locals {
+  rest_api_environment = {
+    SECRET_NAME             = aws_secretsmanager_secret.api_password_secret.name
+    RDS_SECRET_NAME         = aws_secretsmanager_secret.rds_password_secret.name
+    REGION                  = var.region_aws
+    DB_NAME                 = var.rds_database_name
+    DB_HOST                 = aws_db_instance.rds.address
+    DB_READER_HOST          = var.create_read_replica ? aws_db_instance.rds_replica[0].address : ""
+    EXPORT_BUCKET           = aws_s3_bucket.s3_api_exports.bucket
+    RATE_LIMIT_TABLE        = aws_dynamodb_table.api_rate_limits.name
+    ID_FILTER_UPDATES_TABLE = aws_dynamodb_table.id_filter_updates.name
+    SHARED_CACHE_TABLE      = aws_dynamodb_table.api_read_cache.name
+  }
+}
+
 resource "aws_lambda_function" "lambda_rest_api" {
   function_name = "lambda-rest-api-response-${local.name_alias}"
 
   filename         = "${path.module}/lambda_rest_api/.output/lambda_handler.zip"
-  layers           = [aws_lambda_layer_version.python_pg8000_layer.arn, aws_lambda_layer_version.python_logging_layer.arn]
+  layers = [
+    aws_lambda_layer_version.python_pg8000_layer.arn,
+    aws_lambda_layer_version.python_logging_layer.arn,
+    aws_lambda_layer_version.python_common_layer.arn,
+  ]
   source_code_hash = data.archive_file.zip_the_lambda_api_code.output_base64sha256
 
   role        = aws_iam_role.lambda_rest_api.arn
   handler     = "lambda_handler.lambda_handler"
   runtime     = "python3.8"
-  timeout     = 90
+  # API Gateway gives up on the integration after 29 seconds
+  timeout     = 29
   memory_size = 512
 
   environment {
-    variables = {
-      SECRET_NAME     = aws_secretsmanager_secret.api_password_secret.name
-      RDS_SECRET_NAME = aws_secretsmanager_secret.rds_password_secret.name
-      REGION          = var.region_aws
-      DB_NAME         = var.rds_database_name
-      DB_HOST         = aws_db_instance.rds.address
-    }
+    variables = merge(local.rest_api_environment, {
+      EXPORT_FUNCTION_NAME = aws_lambda_function.lambda_rest_api_export.function_name
+    })
   }
   depends_on = [
     aws_iam_role_policy_attachment.attach_policy,
@@ -32,6 +48,39 @@ resource "aws_cloudwatch_log_group" "lambda_rest_api_logs" {
 }
 
 
+# Runs table exports, invoked asynchronously by the REST API Lambda
+resource "aws_lambda_function" "lambda_rest_api_export" {
+  function_name = "lambda-rest-api-export-${local.name_alias}"
+
+  filename = "${path.module}/lambda_rest_api/.output/lambda_handler.zip"
+  layers = [
+    aws_lambda_layer_version.python_pg8000_layer.arn,
+    aws_lambda_layer_version.python_logging_layer.arn,
+    aws_lambda_layer_version.python_common_layer.arn,
+  ]
+  source_code_hash = data.archive_file.zip_the_lambda_api_code.output_base64sha256
+
+  role        = aws_iam_role.lambda_rest_api.arn
+  handler     = "lambda_handler.export_handler"
+  runtime     = "python3.8"
+  timeout     = 900
+  memory_size = 512
+
+  environment {
+    variables = local.rest_api_environment
+  }
+  depends_on = [
+    aws_iam_role_policy_attachment.attach_policy,
+    aws_cloudwatch_log_group.lambda_rest_api_export_logs
+  ]
+}
+
+resource "aws_cloudwatch_log_group" "lambda_rest_api_export_logs" {
+  name              = "/aws/lambda/lambda-rest-api-export-${local.name_alias}"
+  retention_in_days = 7
+}
+
+
 data "archive_file" "zip_the_lambda_api_code" {
   type        = "zip"
   source_dir  = "${path.module}/lambda_rest_api/src"
@@ -39,6 +88,42 @@ data "archive_file" "zip_the_lambda_api_code" {
 }
 
 
+# Token buckets of the REST API rate limiter, shared by all Lambda containers
+resource "aws_dynamodb_table" "api_rate_limits" {
+  name         = "api-rate-limits-${local.name_alias}"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "pk"
+
+  attribute {
+    name = "pk"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+}
+
+
+# Records cached for all REST API containers
+resource "aws_dynamodb_table" "api_read_cache" {
+  name         = "api-read-cache-${local.name_alias}"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "pk"
+
+  attribute {
+    name = "pk"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+}
+
+
 # IAM Role for Lambda
 resource "aws_iam_role" "lambda_rest_api" {
   name = "lambda_rest_api-${local.name_alias}"
@@ -72,7 +157,8 @@ resource "aws_iam_policy" "lambda_rest_api_policy" {
           "logs:PutLogEvents"
         ],
         Resource = [
-          "arn:aws:logs:${var.region_aws}:${data.aws_caller_identity.current.account_id}:log-group:/aws/lambda/lambda-rest-api-response-${local.name_alias}:*"
+          "arn:aws:logs:${var.region_aws}:${data.aws_caller_identity.current.account_id}:log-group:/aws/lambda/lambda-rest-api-response-${local.name_alias}:*",
+          "arn:aws:logs:${var.region_aws}:${data.aws_caller_identity.current.account_id}:log-group:/aws/lambda/lambda-rest-api-export-${local.name_alias}:*"
         ]
       },
       {
@@ -108,6 +194,39 @@ resource "aws_iam_policy" "lambda_rest_api_policy" {
         ],
         Resource = "*"
       },
+      {
+        Effect = "Allow",
+        Action = [
+          "s3:PutObject",
+          "s3:GetObject",
+          "s3:AbortMultipartUpload"
+        ],
+        Resource = "${aws_s3_bucket.s3_api_exports.arn}/*"
+      },
+      {
+        Effect = "Allow",
+        Action = [
+          "dynamodb:GetItem",
+          "dynamodb:PutItem"
+        ],
+        Resource = aws_dynamodb_table.api_rate_limits.arn
+      },
+      {
+        Effect = "Allow",
+        Action = [
+          "dynamodb:Query"
+        ],
+        Resource = aws_dynamodb_table.id_filter_updates.arn
+      },
+      {
+        Effect = "Allow",
+        Action = [
+          "dynamodb:BatchGetItem",
+          "dynamodb:PutItem",
+          "dynamodb:BatchWriteItem"
+        ],
+        Resource = aws_dynamodb_table.api_read_cache.arn
+      },
     ]
   })
 }
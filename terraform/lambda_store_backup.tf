@@ -2,7 +2,7 @@ resource "aws_lambda_function" "lambda_store_backup" {
   function_name = "lambda_store_backup-${local.name_alias}"
 
   filename         = "${path.module}/lambda_store_backup/.output/lambda_handler.zip"
-  layers           = [aws_lambda_layer_version.python_logging_layer.arn]
+  layers           = [aws_lambda_layer_version.python_logging_layer.arn, aws_lambda_layer_version.python_common_layer.arn]
   source_code_hash = data.archive_file.zip_the_lambda_store_backup_code.output_base64sha256
 
   role    = aws_iam_role.lambda_store_backup_role.arn
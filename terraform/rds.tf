@@ -26,6 +26,21 @@ resource "aws_db_instance" "rds" {
   depends_on = [module.vpc]
 }
 
+# Serves the REST API reads so ingestion writes on the primary don't slow them down
+resource "aws_db_instance" "rds_replica" {
+  count = var.create_read_replica ? 1 : 0
+
+  identifier                 = "rds-database-replica-${local.name_alias}"
+  replicate_source_db        = aws_db_instance.rds.identifier
+  instance_class             = "db.t3.micro"
+  storage_encrypted          = true
+  auto_minor_version_upgrade = false
+  publicly_accessible        = true
+  skip_final_snapshot        = true
+  deletion_protection        = !var.is_development
+  vpc_security_group_ids     = [aws_security_group.rds_security_group.id]
+}
+
 resource "random_password" "rds_password" {
   length           = 16
   special          = true
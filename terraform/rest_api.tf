@@ -14,9 +14,33 @@ resource "aws_secretsmanager_secret_version" "api_password_secret_version" {
   secret_string = jsonencode({ "password" = random_password.api_password.result })
 }
 
+# HMAC keys of signed tokens (JWT) by key id. Only the first key is generated; keys added
+# for rotation are kept on applies
+resource "random_password" "jwt_signing_key" {
+  length  = 64
+  special = false
+}
+
+resource "aws_secretsmanager_secret" "jwt_keys_secret" {
+  name        = "api-jwt-signing-keys-${local.name_alias}"
+  description = "Rest Api signing keys of signed access tokens ${local.name_alias}"
+}
+
+resource "aws_secretsmanager_secret_version" "jwt_keys_secret_version" {
+  secret_id     = aws_secretsmanager_secret.jwt_keys_secret.id
+  secret_string = jsonencode({ "k1" = random_password.jwt_signing_key.result })
+
+  lifecycle {
+    ignore_changes = [secret_string]
+  }
+}
+
 resource "aws_api_gateway_rest_api" "rest_api" {
   name = "Rest-Api-${local.name_alias}"
 
+  # Lets the Lambda return gzip/deflate compressed (base64 encoded) bodies
+  binary_media_types = ["*/*"]
+
   endpoint_configuration {
     types = ["REGIONAL"]
   }
@@ -63,9 +87,15 @@ resource "aws_api_gateway_method" "methods" {
     },
     contains(split("-", each.key), "customers") ? {
       "method.request.querystring.customer_id" = false
+      "method.request.querystring.include"     = false
     } : {},
     contains(split("-", each.key), "orders") ? {
       "method.request.querystring.order_id" = false
+    } : {},
+    each.value.http_method == "GET" ? { # pagination and export of the list endpoints
+      "method.request.querystring.limit"  = false
+      "method.request.querystring.after"  = false
+      "method.request.querystring.export" = false
     } : {}
   )
 }
@@ -146,7 +176,7 @@ resource "aws_api_gateway_authorizer" "custom_authorizer" {
   authorizer_uri                   = "arn:aws:apigateway:${var.region_aws}:lambda:path/2015-03-31/functions/${aws_lambda_function.lambda_token_authorizer.arn}/invocations"
   authorizer_credentials           = aws_iam_role.lambda_rest_api.arn
   identity_source                  = "method.request.header.Authorization"
-  authorizer_result_ttl_in_seconds = 0
+  authorizer_result_ttl_in_seconds = var.authorizer_cache_ttl_seconds
 }
 
 
@@ -7,3 +7,25 @@ resource "aws_s3_bucket" "s3_backup_data" {
   bucket        = "bucket-backup-data-${local.name_alias}"
   force_destroy = var.is_development
 }
+
+
+# Large table exports of the REST API, read by clients through pre-signed URLs
+resource "aws_s3_bucket" "s3_api_exports" {
+  bucket        = "bucket-api-exports-${local.name_alias}"
+  force_destroy = true
+}
+
+resource "aws_s3_bucket_lifecycle_configuration" "s3_api_exports_expiration" {
+  bucket = aws_s3_bucket.s3_api_exports.id
+
+  rule {
+    id     = "expire-exports"
+    status = "Enabled"
+
+    filter {}
+
+    expiration {
+      days = 1
+    }
+  }
+}
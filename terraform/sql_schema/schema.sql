@@ -24,4 +24,8 @@ CREATE TABLE  IF NOT EXISTS myschema1.orders (
     total_amount DECIMAL(10, 2),
     customer_id INTEGER REFERENCES myschema1.customers(customer_id),
     FOREIGN KEY (customer_id) REFERENCES myschema1.customers(customer_id)
-);
\ No newline at end of file
+);
+
+-- Orders of a customer by date, used by GET /customers?include=orders
+CREATE INDEX IF NOT EXISTS orders_customer_id_order_date_idx
+    ON myschema1.orders (customer_id, order_date);
\ No newline at end of file
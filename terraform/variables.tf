@@ -24,6 +24,24 @@ variable "region_aws" {
   default     = "eu-west-1"
 }
 
+variable "create_read_replica" {
+  type        = bool
+  description = "Create a read replica of the RDS instance for the REST API reads; by default False"
+  default     = false
+}
+
+variable "authorizer_cache_ttl_seconds" {
+  type        = number
+  description = "How long API Gateway caches the token authorizer's policy, 0 - 3600 seconds; 0 disables caching. Revoked tokens keep working for up to this long"
+  default     = 30
+}
+
+variable "jwt_audience" {
+  type        = string
+  description = "Audience of the signed tokens (JWT) accepted by the token authorizer; empty disables signed tokens"
+  default     = ""
+}
+
 variable "rds_database_name" {
   type        = string
   description = "Name of the database"
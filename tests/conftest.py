@@ -0,0 +1,69 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, os.path.join(REPO_ROOT, "lambda_layers", "common", "python"))
+
+# Environment the Lambda functions are deployed with; the handlers read it at import time
+for name, value in {
+    "AWS_DEFAULT_REGION": "eu-west-1",
+    "REGION": "eu-west-1",
+    "SECRET_NAME": "api-token",
+    "API_GATEWAY_TOKEN": "api-token",
+    "RDS_SECRET_NAME": "rds-secret",
+    "DB_HOST": "localhost",
+    "RDS_HOST": "localhost",
+    "RDS_DB": "postgres",
+    "S3_EVENT_DATA": "event-data",
+    "S3_BACKUP_DATA": "backup-data",
+    "SSM_NAME": "rds-endpoint",
+}.items():
+    os.environ.setdefault(name, value)
+
+TREES = ["cdk_stack_infrastructure", "pulumi", "terraform"]
+
+HANDLERS = {
+    "rest_api": {
+        "cdk_stack_infrastructure": "lambda_rest_api/lambda_handler.py",
+        "pulumi": "lambda_rest_api/lambda_handler.py",
+        "terraform": "lambda_rest_api/src/lambda_handler.py",
+    },
+    "insert_data_into_rds": {
+        "cdk_stack_infrastructure": "lambda_insert_data_into_rds/lambda_handler.py",
+        "pulumi": "lambda_insert_data_into_rds/lambda_handler.py",
+        "terraform": "lambda/src/lambda_handler.py",
+    },
+    "grant_token_access": {
+        "cdk_stack_infrastructure": "lambda_grant_token_access/lambda_handler.py",
+        "pulumi": "lambda_grant_token_access/lambda_handler.py",
+        "terraform": "lambda_grant_token_access/src/lambda_handler.py",
+    },
+}
+
+
+def load_handler(function, tree):
+    """Imports a fresh copy of the handler module of a Lambda function of one stack."""
+    path = os.path.join(REPO_ROOT, tree, HANDLERS[function][tree])
+    spec = importlib.util.spec_from_file_location(f"{tree}_{function}_handler", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(params=TREES)
+def rest_api(request):
+    return load_handler("rest_api", request.param)
+
+
+@pytest.fixture(params=TREES)
+def authorizer(request):
+    return load_handler("grant_token_access", request.param)
+
+
+@pytest.fixture(params=TREES)
+def insert_data(request):
+    return load_handler("insert_data_into_rds", request.param)
@@ -0,0 +1,210 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+import pytest
+
+from lambda_common import SecretCache
+
+METHOD_ARN = "arn:aws:execute-api:eu-west-1:123456789012:abcdef1234/prod/GET/customers"
+SIGNING_KEYS = {"k1": "test-signing-key"}
+
+
+def b64url(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def sign_jwt(payload, kid="k1", key=SIGNING_KEYS["k1"]):
+    header = b64url(json.dumps({"alg": "HS256", "kid": kid}).encode())
+    body = b64url(json.dumps(payload).encode())
+    signature = hmac.new(key.encode(), f"{header}.{body}".encode(), hashlib.sha256).digest()
+    return f"{header}.{body}.{b64url(signature)}"
+
+
+class FakeSecretsManager:
+    def get_secret_value(self, SecretId, VersionStage):
+        return {"SecretString": json.dumps(SIGNING_KEYS), "VersionId": "v1"}
+
+
+@pytest.fixture
+def jwt_authorizer(authorizer, monkeypatch):
+    monkeypatch.setattr(authorizer, "JWT_AUDIENCE", "iaac-api")
+    monkeypatch.setattr(authorizer, "JWT_KEYS_SECRET", "api-jwt-signing-keys")
+    monkeypatch.setattr(authorizer, "secrets_cache", SecretCache(FakeSecretsManager))
+    return authorizer
+
+
+def claims(**overrides):
+    expires_at = int(time.time()) + 600
+    return {"sub": "reporting", "aud": "iaac-api", "exp": expires_at, "scope": "read", **overrides}
+
+
+def authorize(authorizer, token):
+    event = {"authorizationToken": f"Bearer {token}", "methodArn": METHOD_ARN}
+    return authorizer.lambda_handler(event, None)
+
+
+def test_valid_jwt_is_allowed_with_its_expiry_in_the_context(jwt_authorizer):
+    payload = claims()
+
+    policy = authorize(jwt_authorizer, sign_jwt(payload))
+
+    assert policy["principalId"] == "reporting"
+    assert policy["policyDocument"]["Statement"][0]["Effect"] == "Allow"
+    assert policy["context"]["expires_at"] == payload["exp"] + jwt_authorizer.JWT_LEEWAY_SECONDS
+
+
+@pytest.mark.parametrize("payload", [["sub", "reporting"], "reporting", 42, None])
+def test_jwt_with_a_payload_that_is_not_an_object_is_denied(jwt_authorizer, payload):
+    assert jwt_authorizer.verify_jwt(sign_jwt(payload)) is None
+
+    policy = authorize(jwt_authorizer, sign_jwt(payload))
+
+    assert policy["policyDocument"]["Statement"][0]["Effect"] == "Deny"
+
+
+@pytest.mark.parametrize("payload", [
+    claims(exp=int(time.time()) - 3600),
+    claims(aud="other-api"),
+    claims(sub=""),
+])
+def test_jwt_with_invalid_claims_is_denied(jwt_authorizer, payload):
+    assert jwt_authorizer.verify_jwt(sign_jwt(payload)) is None
+
+
+def test_jwt_with_a_bad_signature_is_denied(jwt_authorizer):
+    assert jwt_authorizer.verify_jwt(sign_jwt(claims(), key="wrong-key")) is None
+
+
+STAGE = "arn:aws:execute-api:eu-west-1:123456789012:abcdef1234/prod"
+
+
+@pytest.mark.parametrize("scope, resources", [
+    ("read", [f"{STAGE}/GET/*"]),
+    ("write", [f"{STAGE}/PUT/*"]),
+    ("read write", [f"{STAGE}/GET/*", f"{STAGE}/PUT/*"]),
+    ("", [f"{STAGE}/*"]),
+    ("*", [f"{STAGE}/*"]),
+])
+def test_policy_resources_match_the_scope(authorizer, scope, resources):
+    policy = authorizer.principal_policy("reporting", scope, METHOD_ARN)
+
+    (statement,) = policy["policyDocument"]["Statement"]
+    assert statement["Effect"] == "Allow"
+    assert statement["Resource"] == resources
+    assert policy["context"]["scope"] == scope
+
+
+def test_scope_without_known_methods_is_denied(authorizer):
+    policy = authorizer.principal_policy("reporting", "admin", METHOD_ARN)
+
+    (statement,) = policy["policyDocument"]["Statement"]
+    assert statement["Effect"] == "Deny"
+    assert statement["Resource"] == f"{STAGE}/*"
+
+
+def test_jwt_scope_limits_the_policy(jwt_authorizer):
+    policy = authorize(jwt_authorizer, sign_jwt(claims(scope="write")))
+
+    assert policy["policyDocument"]["Statement"][0]["Resource"] == [f"{STAGE}/PUT/*"]
+
+
+def token_item(authorizer, token, updated_at, revoked=False):
+    salt = "00" * 16
+    item = {
+        "fingerprint": {
+            "S": authorizer.token_fingerprint(hashlib.sha256(token.encode()).hexdigest())
+        },
+        "salt": {"S": salt},
+        "hash": {"S": authorizer.hash_token(token, salt, 1)},
+        "iterations": {"N": "1"},
+        "principal": {"S": "reporting"},
+        "scope": {"S": "read"},
+        "updated_at": {"N": str(updated_at)},
+        "updated_day": {"S": time.strftime("%Y-%m-%d", time.gmtime(updated_at))},
+    }
+    if revoked:
+        item["revoked"] = {"BOOL": True}
+    return item
+
+
+class FakeTokenTable:
+    """Answers Scan with every item and Query of the updated_day-index like DynamoDB would."""
+
+    def __init__(self):
+        self.items = []
+        self.calls = []
+
+    def scan(self, **kwargs):
+        self.calls.append(("scan", kwargs))
+        return {"Items": list(self.items)}
+
+    def query(self, **kwargs):
+        self.calls.append(("query", kwargs))
+        values = kwargs["ExpressionAttributeValues"]
+        return {"Items": [
+            item for item in self.items
+            if item["updated_day"]["S"] == values[":day"]["S"]
+            and int(item["updated_at"]["N"]) >= int(values[":since"]["N"])
+        ]}
+
+
+@pytest.fixture
+def token_table(authorizer, monkeypatch):
+    table = FakeTokenTable()
+    monkeypatch.setattr(authorizer, "get_client", lambda service_name: table)
+    return table
+
+
+@pytest.fixture
+def clock(authorizer, monkeypatch):
+    """Wall clock and monotonic clock of the authorizer, moved forward by the tests."""
+    now = [1767268800.0]  # 2026-01-01T12:00:00Z
+    monkeypatch.setattr(authorizer.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_token_index_refreshes_with_a_query_of_the_updates_index(authorizer, token_table, clock):
+    index = authorizer.TokenIndex("api-tokens", clock=lambda: clock[0])
+    token_table.items.append(token_item(authorizer, "first-token", int(clock[0]) - 3600))
+    assert index.lookup("first-token")["principal"] == "reporting"
+
+    clock[0] += authorizer.TOKEN_INDEX_REFRESH_SECONDS
+    token_table.items.append(token_item(authorizer, "second-token", int(clock[0])))
+    token_table.items[0] = token_item(authorizer, "first-token", int(clock[0]), revoked=True)
+
+    assert index.lookup("second-token")["principal"] == "reporting"
+    assert index.lookup("first-token") is None
+    operation, request = token_table.calls[-1]
+    assert operation == "query"
+    assert request["IndexName"] == authorizer.TOKEN_UPDATES_INDEX
+    assert [operation for operation, _ in token_table.calls] == ["scan", "query"]
+
+
+def test_token_index_queries_every_day_since_the_last_load(authorizer, token_table, clock):
+    clock[0] += 12 * 3600 - 30  # 30 seconds before midnight
+    index = authorizer.TokenIndex("api-tokens", clock=lambda: clock[0])
+    index.lookup("some-token")
+
+    clock[0] += authorizer.TOKEN_INDEX_REFRESH_SECONDS
+    index.lookup("some-token")
+
+    days = [
+        request["ExpressionAttributeValues"][":day"]["S"] for _, request in token_table.calls[1:]
+    ]
+    assert days == ["2026-01-01", "2026-01-02"]
+
+
+def test_unknown_fingerprints_are_negatively_cached(authorizer, token_table, clock):
+    index = authorizer.TokenIndex("api-tokens", clock=lambda: clock[0])
+    assert index.lookup("unknown-token") is None
+
+    clock[0] += authorizer.SECRET_REFRESH_COOLDOWN_SECONDS + 1
+    assert index.lookup("unknown-token") is None
+    assert len(token_table.calls) == 1
+
+    clock[0] += authorizer.TOKEN_INDEX_NEGATIVE_TTL_SECONDS
+    token_table.items.append(token_item(authorizer, "unknown-token", int(clock[0])))
+    assert index.lookup("unknown-token")["principal"] == "reporting"
@@ -0,0 +1,85 @@
+import pytest
+
+CUSTOMERS = [
+    {"customer_id": 1, "first_name": "Ada", "last_name": "Lovelace", "email": "ada@example.com",
+     "phone": "123", "address": "London"},
+    {"customer_id": 2, "first_name": "Alan", "last_name": "Turing", "email": "alan@example.com",
+     "phone": "456", "address": "Wilmslow"},
+]
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def executemany(self, query, rows):
+        if self.connection.fail_insert:
+            raise RuntimeError("duplicate key")
+        self.connection.calls.append("insert")
+
+
+class FakeConnection:
+    """pg8000 connection recording the statements of a load, optionally failing the insert."""
+
+    def __init__(self, calls, fail_insert=False):
+        self.calls = calls
+        self.fail_insert = fail_insert
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.calls.append("close")
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.calls.append("commit")
+
+
+class FakeDynamoDB:
+    def __init__(self, calls):
+        self.calls = calls
+
+    def put_item(self, TableName, Item):
+        self.calls.append(("publish", sorted(int(record_id) for record_id in Item["ids"]["NS"])))
+
+
+@pytest.fixture
+def load(insert_data, monkeypatch):
+    """Runs store_data_in_rds with a fake database and updates table; returns the calls made."""
+    calls = []
+    monkeypatch.setattr(insert_data, "ID_FILTER_UPDATES_TABLE", "id-filter-updates")
+    monkeypatch.setattr(insert_data, "get_client", lambda service_name: FakeDynamoDB(calls))
+
+    def run(fail_insert=False):
+        monkeypatch.setattr(
+            insert_data.pg8000, "connect", lambda **kwargs: FakeConnection(calls, fail_insert)
+        )
+        columns = list(CUSTOMERS[0])
+        try:
+            insert_data.store_data_in_rds(
+                "db.example", 5432, "postgres", "password", "postgres",
+                CUSTOMERS, "customers", columns, "customer_id",
+            )
+        except RuntimeError:
+            # The Terraform copy returns False instead of raising
+            pass
+        return calls
+
+    return run
+
+
+def test_loaded_ids_are_published_before_the_commit(load):
+    assert load() == ["insert", ("publish", [1, 2]), "commit", "close"]
+
+
+def test_ids_are_not_published_when_the_insert_fails(load):
+    assert load(fail_insert=True) == ["close"]
@@ -0,0 +1,141 @@
+import json
+
+from lambda_common import InvocationMetrics, SecretCache
+
+
+def make_metrics():
+    lines = []
+    metrics = InvocationMetrics("test-function", namespace="TestNamespace", sink=lines.append)
+    return metrics, lines
+
+
+def test_flush_emits_embedded_metric_format_record():
+    metrics, lines = make_metrics()
+    metrics.set_dimension("Route", "GET /customers")
+    metrics.set_property("RequestId", "req-1")
+    metrics.count("Rows", 3)
+    metrics.count("Rows", 2)
+    metrics.count("ResponseBytes", 512, unit="Bytes")
+
+    metrics.flush()
+
+    assert len(lines) == 1
+    record = json.loads(lines[0])
+    assert isinstance(record["_aws"]["Timestamp"], int)
+    (directive,) = record["_aws"]["CloudWatchMetrics"]
+    assert directive["Namespace"] == "TestNamespace"
+    assert directive["Dimensions"] == [["FunctionName", "Route"]]
+    assert {metric["Name"]: metric["Unit"] for metric in directive["Metrics"]} == {
+        "DurationMs": "Milliseconds",
+        "ColdStart": "Count",
+        "Rows": "Count",
+        "ResponseBytes": "Bytes",
+    }
+    assert record["FunctionName"] == "test-function"
+    assert record["Route"] == "GET /customers"
+    assert record["RequestId"] == "req-1"
+    assert record["Rows"] == 5
+    assert record["ResponseBytes"] == 512
+    assert record["ColdStart"] == 1
+
+
+def test_phase_timings_are_summed(monkeypatch):
+    clock = iter([0.0, 1.0, 1.25, 2.0, 2.5, 3.0, 3.0])
+    monkeypatch.setattr("lambda_common.metrics.time.perf_counter", lambda: next(clock))
+    metrics, lines = make_metrics()
+
+    with metrics.phase("DbQuery"):
+        pass
+    with metrics.phase("DbQuery"):
+        pass
+    record = metrics.flush()
+
+    assert record["DbQueryMs"] == 750.0
+    metric_definitions = record["_aws"]["CloudWatchMetrics"][0]["Metrics"]
+    assert {"Name": "DbQueryMs", "Unit": "Milliseconds"} in metric_definitions
+    assert json.loads(lines[0])["DbQueryMs"] == 750.0
+
+
+def test_instrument_emits_one_line_per_invocation_and_clears_cold_start():
+    metrics, lines = make_metrics()
+
+    @metrics.instrument
+    def handler(event, context):
+        metrics.count("Calls", 1)
+        return event
+
+    assert handler("first", None) == "first"
+    assert handler("second", None) == "second"
+
+    first, second = (json.loads(line) for line in lines)
+    assert (first["ColdStart"], second["ColdStart"]) == (1, 0)
+    assert first["Calls"] == second["Calls"] == 1
+
+
+def test_instrument_flushes_when_handler_raises():
+    metrics, lines = make_metrics()
+
+    @metrics.instrument
+    def handler(event, context):
+        with metrics.phase("Work"):
+            raise ValueError("boom")
+
+    try:
+        handler({}, None)
+    except ValueError:
+        pass
+
+    (line,) = lines
+    assert "WorkMs" in json.loads(line)
+
+
+class FakeSecretsManager:
+    def __init__(self):
+        self.calls = 0
+        self.version = "v1"
+
+    def get_secret_value(self, SecretId, VersionStage):
+        self.calls += 1
+        secret = json.dumps({"id": SecretId, "version": self.version})
+        return {"SecretString": secret, "VersionId": self.version}
+
+
+def test_secret_cache_reuses_value_within_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("lambda_common.secret_cache.time.monotonic", lambda: now[0])
+    client = FakeSecretsManager()
+    cache = SecretCache(lambda: client, ttl_seconds=300, refresh_cooldown_seconds=30)
+
+    assert cache.get("db") == {"id": "db", "version": "v1"}
+    now[0] += 299
+    cache.get("db")
+    assert client.calls == 1
+
+    client.version = "v2"
+    now[0] += 1
+    assert cache.get("db")["version"] == "v2"
+    assert cache.version_id("db") == "v2"
+    assert client.calls == 2
+
+
+def test_secret_cache_refresh_respects_cooldown(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("lambda_common.secret_cache.time.monotonic", lambda: now[0])
+    client = FakeSecretsManager()
+    cache = SecretCache(lambda: client, ttl_seconds=300, refresh_cooldown_seconds=30)
+
+    cache.get("db")
+    cache.refresh("db")
+    assert client.calls == 1
+    now[0] += 30
+    cache.refresh("db")
+    assert client.calls == 2
+
+
+def test_secret_cache_times_fetches_in_metrics():
+    metrics, lines = make_metrics()
+    cache = SecretCache(FakeSecretsManager, metrics=metrics)
+
+    cache.get("db")
+
+    assert "SecretFetchMs" in metrics.flush()
@@ -0,0 +1,1038 @@
+import base64
+import gzip
+import json
+import threading
+import time
+import types
+import zlib
+
+import pg8000
+import pytest
+
+
+def api_request(method, resource, params=None, headers=None, body=None, authorizer=None):
+    """API Gateway proxy event of a request already allowed by the TOKEN authorizer."""
+    return {
+        "httpMethod": method,
+        "resource": resource,
+        "path": resource,
+        "queryStringParameters": params,
+        "headers": headers or {},
+        "body": body,
+        "requestContext": {
+            "authorizer": authorizer or {"principalId": "test-client", "scope": "read write"}
+        },
+    }
+
+
+class FakeStatement:
+    def __init__(self, connection):
+        self.connection = connection
+        self.closed = False
+
+    def run(self, **params):
+        if self.connection.errors:
+            raise self.connection.errors.pop(0)
+        # Lookups render the row as JSON in the query
+        return [(json.dumps({"customer_id": params.get("customer_id"), "first_name": "Ada"}),)]
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    def __init__(self):
+        self.errors = []
+        self.statements = []
+        self.rollbacks = 0
+
+    def prepare(self, sql):
+        statement = FakeStatement(self)
+        self.statements.append(statement)
+        return statement
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def database(rest_api, monkeypatch):
+    """A ConnectionManager of the handler wired to a fake connection and used for every query."""
+    manager = rest_api.ConnectionManager("db.example", 5432, "postgres")
+    conn = FakeConnection()
+    monkeypatch.setattr(manager, "_connect", lambda: conn)
+    monkeypatch.setattr(rest_api, "db_router", rest_api.ReadRouter(manager, None))
+    return types.SimpleNamespace(manager=manager, conn=conn)
+
+
+def database_error(code, message):
+    return pg8000.DatabaseError({"S": "ERROR", "C": code, "M": message})
+
+
+def test_query_db_reuses_prepared_statement(rest_api, database):
+    first = rest_api.query_db("get_customer", "SELECT", customer_id=1)
+    second = rest_api.query_db("get_customer", "SELECT", customer_id=2)
+
+    assert first == [('{"customer_id": 1, "first_name": "Ada"}',)]
+    assert second == [('{"customer_id": 2, "first_name": "Ada"}',)]
+    assert len(database.conn.statements) == 1
+
+
+def test_reads_run_without_a_transaction(rest_api, database):
+    rest_api.query_db("get_customer", "SELECT", customer_id=1)
+
+    assert database.conn.rollbacks == 0
+
+
+def test_idle_connection_is_probed_with_a_single_statement(rest_api, database, monkeypatch):
+    probes = []
+    database.conn.run = probes.append
+    rest_api.query_db("get_customer", "SELECT", customer_id=1)
+    monkeypatch.setattr(rest_api, "DB_HEALTH_CHECK_INTERVAL", -1)
+    rest_api.query_db("get_customer", "SELECT", customer_id=2)
+
+    assert probes == ["SELECT 1"]
+    assert database.conn.rollbacks == 0
+
+
+def test_transaction_rolls_back_what_is_not_committed(rest_api, database):
+    database.conn.autocommit = True
+    with database.manager.transaction() as conn:
+        assert conn.autocommit is False
+
+    assert database.conn.rollbacks == 1
+    assert database.conn.autocommit is True
+
+
+def test_query_db_discards_statement_when_plan_is_invalidated(rest_api, database):
+    rest_api.query_db("get_customer", "SELECT", customer_id=1)
+    database.conn.errors.append(database_error("0A000", "cached plan must not change result type"))
+
+    with pytest.raises(pg8000.DatabaseError):
+        rest_api.query_db("get_customer", "SELECT", customer_id=1)
+
+    first = database.conn.statements[0]
+    assert first.closed
+    assert rest_api.query_db("get_customer", "SELECT", customer_id=1)
+    assert len(database.conn.statements) == 2
+
+
+def test_query_db_keeps_statement_on_other_errors(rest_api, database):
+    rest_api.query_db("get_customer", "SELECT", customer_id=1)
+    database.conn.errors.append(database_error("22P02", "invalid input syntax for type integer"))
+
+    with pytest.raises(pg8000.DatabaseError):
+        rest_api.query_db("get_customer", "SELECT", customer_id=1)
+
+    assert not database.conn.statements[0].closed
+    rest_api.query_db("get_customer", "SELECT", customer_id=1)
+    assert len(database.conn.statements) == 1
+
+
+def open_circuit(rest_api, monkeypatch, breaker):
+    """Opens the breaker and moves the clock past the reset period; the next request is a probe."""
+    now = [1000.0]
+    monkeypatch.setattr(rest_api.time, "monotonic", lambda: now[0])
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    assert breaker.state == breaker.OPEN
+    now[0] += breaker.reset_seconds
+
+
+def test_circuit_breaker_closes_after_successful_probe(rest_api, database, monkeypatch):
+    breaker = database.manager.breaker
+    open_circuit(rest_api, monkeypatch, breaker)
+
+    rest_api.query_db("get_customer", "SELECT", customer_id=1)
+
+    assert breaker.state == breaker.CLOSED
+
+
+def test_circuit_breaker_reopens_after_overloaded_probe(rest_api, database, monkeypatch):
+    breaker = database.manager.breaker
+    open_circuit(rest_api, monkeypatch, breaker)
+    timeout = database_error("57014", "canceling statement due to statement timeout")
+    database.conn.errors.append(timeout)
+
+    with pytest.raises(rest_api.DatabaseUnavailableError):
+        rest_api.query_db("get_customer", "SELECT", customer_id=1)
+
+    assert breaker.state == breaker.OPEN
+
+
+@pytest.mark.parametrize("error, state", [
+    (database_error("22P02", "invalid input syntax for type integer"), "closed"),
+    (ValueError("bug in the caller"), "open"),
+    (KeyboardInterrupt(), "open"),
+])
+def test_circuit_breaker_resolves_probe_on_every_error(
+    rest_api, database, monkeypatch, error, state
+):
+    breaker = database.manager.breaker
+    open_circuit(rest_api, monkeypatch, breaker)
+
+    with pytest.raises(type(error)):
+        with database.manager.connection():
+            assert breaker.state == breaker.HALF_OPEN
+            raise error
+
+    assert breaker.state == state
+
+
+def test_circuit_breaker_resolves_probe_when_connecting_fails(rest_api, database, monkeypatch):
+    breaker = database.manager.breaker
+    open_circuit(rest_api, monkeypatch, breaker)
+
+    def connect():
+        raise KeyError("password")
+
+    monkeypatch.setattr(database.manager, "_connect", connect)
+    with pytest.raises(KeyError):
+        with database.manager.connection():
+            pass
+
+    assert breaker.state == breaker.OPEN
+
+
+def test_database_error_is_answered_with_500_and_not_cached_as_missing(rest_api, database):
+    database.conn.errors.append(database_error("XX000", "could not read block"))
+    event = api_request("GET", "/customers", {"customer_id": "7"})
+
+    response = rest_api.lambda_handler(event, None)
+
+    assert response["statusCode"] == 500
+    response = rest_api.lambda_handler(event, None)
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"]) == {"customer_id": 7, "first_name": "Ada"}
+
+
+class FakeSecretsManager:
+    def get_secret_value(self, SecretId, VersionStage):
+        return {"SecretString": json.dumps({"password": "shared-token"}), "VersionId": "v1"}
+
+
+@pytest.mark.parametrize("expires_in, status", [(60, 200), (-1, 401)])
+def test_cached_authorizer_result_is_rejected_after_the_token_expired(
+    rest_api, database, monkeypatch, expires_in, status
+):
+    monkeypatch.setattr(rest_api, "secrets_cache", rest_api.SecretCache(FakeSecretsManager))
+    expires_at = str(int(time.time()) + expires_in)
+    authorizer = {"principalId": "reporting", "scope": "read", "expires_at": expires_at}
+    headers = {"Authorization": "Bearer a.b.c"}
+    event = api_request("GET", "/customers", {"customer_id": "7"}, headers, authorizer=authorizer)
+
+    assert rest_api.lambda_handler(event, None)["statusCode"] == status
+
+
+class FakeScanCursor:
+    """Cursor answering the row estimate and FETCH statements of an ID filter build."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.result = []
+        self.fetched = False
+
+    def execute(self, sql, params=None):
+        self.connection.started.set()
+        self.connection.proceed.wait(5)
+        if "reltuples" in sql:
+            self.result = [(len(self.connection.ids),)]
+        elif sql.startswith("FETCH"):
+            ids = [] if self.fetched else self.connection.ids
+            self.result = [(record_id,) for record_id in ids]
+            self.fetched = True
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+class FakeScanConnection:
+    def __init__(self, ids):
+        self.ids = ids
+        self.started = threading.Event()
+        self.proceed = threading.Event()
+        self.closed = False
+
+    def cursor(self):
+        return FakeScanCursor(self)
+
+    def run(self, sql):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class FakeUpdatesTable:
+    """Query of the id-filter-updates table: items of a table with an update key after a bound."""
+
+    def __init__(self):
+        self.items = []
+        self.queries = []
+
+    def query(self, **kwargs):
+        self.queries.append(kwargs)
+        values = kwargs["ExpressionAttributeValues"]
+        return {"Items": [
+            item for item in self.items
+            if item["table_name"]["S"] == values[":table"]["S"]
+            and item["update_key"]["S"] > values[":after"]["S"]
+        ]}
+
+    def publish(self, table, record_ids):
+        self.items.append({
+            "table_name": {"S": table},
+            "update_key": {"S": f"{int(time.time() * 1000):013d}-{len(self.items)}"},
+            "ids": {"NS": [str(record_id) for record_id in record_ids]},
+        })
+
+
+@pytest.fixture
+def id_filter(rest_api, monkeypatch):
+    """ID filter of the customers table over a fake connection and updates table."""
+    manager = rest_api.ConnectionManager("db.example", 5432, "postgres")
+    conn = FakeScanConnection([1, 2, 3])
+    monkeypatch.setattr(manager, "_connect", lambda: conn)
+    monkeypatch.setattr(rest_api, "id_filter_connections", manager)
+    updates = FakeUpdatesTable()
+    monkeypatch.setattr(rest_api, "get_client", lambda service_name: updates)
+    return types.SimpleNamespace(
+        filter=rest_api.IdFilter("customers", "customer_id", "id-filter-updates"),
+        conn=conn,
+        updates=updates,
+    )
+
+
+def test_id_filter_is_built_in_the_background(id_filter):
+    assert id_filter.filter.check(1) is None
+    assert id_filter.conn.started.wait(5)
+    # Lookups don't wait for the build
+    assert id_filter.filter.check(4) is None
+
+    id_filter.conn.proceed.set()
+    id_filter.filter._builder.join(5)
+
+    assert id_filter.filter.check(1) is True
+    assert id_filter.filter.check(4) is False
+    # The build's connection isn't kept open
+    assert id_filter.conn.closed
+
+
+def test_id_filter_confirms_a_miss_with_a_consistent_read(id_filter):
+    id_filter.conn.proceed.set()
+    id_filter.filter.check(1)
+    id_filter.filter._builder.join(5)
+    assert id_filter.filter.check(4) is False
+
+    # Published by the insert Lambda before its commit, within the refresh interval
+    id_filter.updates.publish("customers", [4])
+
+    assert id_filter.filter.check(4) is True
+
+
+def test_id_filter_build_keeps_out_of_the_request_metrics(rest_api, monkeypatch):
+    conn = FakeScanConnection([1, 2, 3])
+    conn.proceed.set()
+    monkeypatch.setattr(rest_api.pg8000, "connect", lambda **kwargs: conn)
+    monkeypatch.setattr(rest_api.id_filter_connections.secrets, "client_factory", FakeSecretsManager)
+    monkeypatch.setattr(rest_api, "get_client", lambda service_name: FakeUpdatesTable())
+    rest_api.metrics.reset()
+    id_filter = rest_api.IdFilter("customers", "customer_id", "id-filter-updates")
+
+    id_filter.check(1)
+    id_filter._builder.join(5)
+
+    assert id_filter.check(1) is True
+    assert "Connect" not in rest_api.metrics.phases
+    assert "SecretFetch" not in rest_api.metrics.phases
+    assert {"Connect", "SecretFetch"} <= set(rest_api.id_filter_metrics.phases)
+
+
+def test_id_filter_confirms_a_batch_of_misses_with_one_query(rest_api, id_filter, monkeypatch):
+    id_filter.conn.proceed.set()
+    id_filter.filter.check(1)
+    id_filter.filter._builder.join(5)
+    monkeypatch.setattr(rest_api, "id_filters", {"customers": id_filter.filter})
+    loaded = []
+    queries_before = len(id_filter.updates.queries)
+
+    records = rest_api.cached_batch_lookup("customers", list(range(100, 150)), loaded.append)
+
+    assert records == {}
+    assert loaded == []
+    assert len(id_filter.updates.queries) - queries_before == 1
+    assert id_filter.updates.queries[-1]["ConsistentRead"] is True
+    assert id_filter.updates.queries[-1]["ConsistentRead"] is True
+
+
+def test_id_filter_is_unavailable_when_updates_cant_be_read(id_filter, monkeypatch):
+    id_filter.conn.proceed.set()
+    id_filter.filter.check(1)
+    id_filter.filter._builder.join(5)
+
+    def unavailable(**kwargs):
+        raise OSError("DynamoDB unreachable")
+
+    monkeypatch.setattr(id_filter.updates, "query", unavailable)
+    assert id_filter.filter.check(4) is None
+
+
+@pytest.fixture
+def large_customer(rest_api, database, monkeypatch):
+    """Responses of customer lookups are big enough to be compressed."""
+    monkeypatch.setattr(rest_api, "COMPRESSION_MIN_BYTES", 10)
+    return api_request("GET", "/customers", {"customer_id": "7"})
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, suffix", [("gzip", "-gzip"), ("deflate", "-deflate"), (None, "")]
+)
+def test_etag_depends_on_the_content_coding(rest_api, large_customer, accept_encoding, suffix):
+    large_customer["headers"] = {"Accept-Encoding": accept_encoding} if accept_encoding else {}
+
+    response = rest_api.lambda_handler(large_customer, None)
+
+    assert response["statusCode"] == 200
+    identity_etag = rest_api.compute_etag('{"customer_id": 7, "first_name": "Ada"}')
+    assert response["headers"]["ETag"] == identity_etag[:-1] + suffix + '"'
+    assert response["headers"]["Vary"] == "Accept-Encoding"
+    assert response["headers"].get("Content-Encoding") == accept_encoding
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, expected",
+    [
+        ("gzip, deflate", "gzip"),
+        ("deflate", "deflate"),
+        ("gzip;q=0.5, deflate", "deflate"),
+        ("GZIP;Q=0, deflate", "deflate"),
+        ("gzip;q=0, *", "deflate"),
+        ("gzip;q=0, deflate;q=0, *", None),
+        ("*;q=0", None),
+        ("br, identity", None),
+        ("", None),
+        (None, None),
+    ],
+)
+def test_negotiate_encoding(rest_api, accept_encoding, expected):
+    assert rest_api.negotiate_encoding(accept_encoding) == expected
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, decompress", [("gzip", gzip.decompress), ("deflate", zlib.decompress)]
+)
+def test_compressed_response_decodes_to_the_identity_body(
+    rest_api, large_customer, accept_encoding, decompress
+):
+    identity = rest_api.lambda_handler(large_customer, None)
+    large_customer["headers"] = {"Accept-Encoding": accept_encoding}
+
+    response = rest_api.lambda_handler(large_customer, None)
+
+    assert response["isBase64Encoded"] is True
+    assert decompress(base64.b64decode(response["body"])).decode() == identity["body"]
+
+
+def test_if_none_match_only_matches_the_same_content_coding(rest_api, large_customer):
+    large_customer["headers"] = {"Accept-Encoding": "gzip"}
+    gzip_etag = rest_api.lambda_handler(large_customer, None)["headers"]["ETag"]
+
+    large_customer["headers"] = {"Accept-Encoding": "gzip", "If-None-Match": gzip_etag}
+    not_modified = rest_api.lambda_handler(large_customer, None)
+    large_customer["headers"] = {"If-None-Match": gzip_etag}
+    identity = rest_api.lambda_handler(large_customer, None)
+
+    assert not_modified["statusCode"] == 304
+    assert not_modified["headers"]["Vary"] == "Accept-Encoding"
+    assert identity["statusCode"] == 200
+
+
+def test_if_match_uses_the_strong_comparison(rest_api):
+    etag = rest_api.compute_etag('{"customer_id": 7}')
+
+    assert rest_api.etag_matches(etag, etag, strong=True)
+    assert rest_api.etag_matches(rest_api.coded_etag(etag, "gzip"), etag, strong=True)
+    assert rest_api.etag_matches("*", etag, strong=True)
+    assert not rest_api.etag_matches(f"W/{etag}", etag, strong=True)
+    assert rest_api.etag_matches(f"W/{etag}", etag)
+
+
+class FakeExportClients:
+    """The S3 and Lambda clients used to start and finish exports."""
+
+    def __init__(self):
+        self.objects = {}
+        self.invocations = []
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = json.loads(Body)
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn):
+        return f"https://{Params['Bucket']}.s3.example/{Params['Key']}?expires={ExpiresIn}"
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        self.invocations.append((FunctionName, InvocationType, json.loads(Payload)))
+
+
+@pytest.fixture
+def exports(rest_api, database, monkeypatch):
+    clients = FakeExportClients()
+    monkeypatch.setattr(rest_api, "get_client", lambda service_name: clients)
+    monkeypatch.setattr(rest_api, "EXPORT_BUCKET", "exports")
+    monkeypatch.setattr(rest_api, "EXPORT_FUNCTION_NAME", "lambda_rest_api_export")
+    return clients
+
+
+def test_export_is_started_asynchronously(rest_api, exports):
+    response = rest_api.lambda_handler(api_request("GET", "/orders", {"export": "ndjson"}), None)
+
+    assert response["statusCode"] == 202
+    body = json.loads(response["body"])
+    assert response["headers"]["Location"] == body["status_url"]
+    [(function_name, invocation_type, payload)] = exports.invocations
+    assert (function_name, invocation_type) == ("lambda_rest_api_export", "Event")
+    assert payload["table"] == "orders"
+    assert body["status_url"].startswith(f"https://exports.s3.example/{payload['status_key']}")
+    assert body["url"].startswith(f"https://exports.s3.example/{payload['key']}")
+    assert exports.objects[payload["status_key"]]["status"] == "running"
+
+
+def test_export_handler_records_the_outcome_in_the_status_document(rest_api, exports, monkeypatch):
+    rest_api.lambda_handler(api_request("GET", "/customers", {"export": "ndjson"}), None)
+    [(_, _, payload)] = exports.invocations
+    monkeypatch.setattr(
+        rest_api, "export_records", lambda table, columns, key: {"rows": 2, "bytes": 64}
+    )
+
+    rest_api.export_handler(payload, None)
+
+    status = exports.objects[payload["status_key"]]
+    assert (status["status"], status["rows"], status["bytes"]) == ("complete", 2, 64)
+    assert status["url"].startswith(f"https://exports.s3.example/{payload['key']}")
+
+
+def test_failed_export_is_reported_and_not_retried(rest_api, exports, monkeypatch):
+    def failing_export(table, columns, key):
+        raise database_error("57014", "canceling statement due to statement timeout")
+
+    monkeypatch.setattr(rest_api, "export_records", failing_export)
+    payload = {
+        "table": "orders",
+        "key": "exports/orders/1.ndjson",
+        "status_key": "exports/orders/1.json",
+    }
+
+    rest_api.export_handler(payload, None)
+
+    assert exports.objects["exports/orders/1.json"]["status"] == "failed"
+
+
+class ConditionalCheckFailedException(Exception):
+    pass
+
+
+class FakeRateLimitTable:
+    exceptions = types.SimpleNamespace(
+        ConditionalCheckFailedException=ConditionalCheckFailedException
+    )
+
+    def __init__(self):
+        self.items = {}
+        self.calls = 0
+        self.available = True
+
+    def get_item(self, TableName, Key, ConsistentRead):
+        self.calls += 1
+        if not self.available:
+            raise OSError("DynamoDB unreachable")
+        item = self.items.get(Key["pk"]["S"])
+        return {"Item": item} if item else {}
+
+    def put_item(self, TableName, Item, **condition):
+        self.calls += 1
+        self.items[Item["pk"]["S"]] = Item
+
+
+@pytest.fixture
+def rate_limits(rest_api, monkeypatch):
+    table = FakeRateLimitTable()
+    now = [1000.0]
+    monkeypatch.setattr(rest_api, "get_client", lambda service_name: table)
+    store = rest_api.DynamoDBRateLimitStore("api-rate-limits", clock=lambda: now[0], lease_size=5)
+    return types.SimpleNamespace(table=table, store=store, now=now)
+
+
+def test_rate_limit_tokens_are_leased_in_batches(rate_limits):
+    results = [rate_limits.store.take("caller#GET /orders", 10, 1) for _ in range(12)]
+
+    assert [allowed for allowed, _, _ in results] == [True] * 10 + [False] * 2
+    assert [remaining for _, remaining, _ in results[:6]] == [9, 8, 7, 6, 5, 4]
+    # One read and write per lease of 5 tokens, then per denied request
+    assert rate_limits.table.calls == 2 * 2 + 2 * 2
+
+
+def test_unused_leased_tokens_expire(rate_limits):
+    rate_limits.store.take("caller#GET /orders", 10, 1)
+    rate_limits.now[0] += 2
+
+    allowed, remaining, _ = rate_limits.store.take("caller#GET /orders", 10, 1)
+
+    # 4 tokens of the first lease are lost, 2 were refilled
+    assert (allowed, remaining) == (True, 6)
+
+
+def test_rate_limits_fall_back_to_the_container_when_dynamodb_is_down(rest_api, rate_limits):
+    rate_limits.table.available = False
+
+    results = [rate_limits.store.take("caller#GET /orders", 3, 1) for _ in range(4)]
+
+    assert [allowed for allowed, _, _ in results] == [True, True, True, False]
+    # DynamoDB isn't asked again until RATE_LIMIT_STORE_RETRY_SECONDS have passed
+    assert rate_limits.table.calls == 1
+    assert rest_api.metrics.counters["RateLimitStoreErrors"] == (1, "Count")
+
+    rate_limits.table.available = True
+    rate_limits.now[0] += rest_api.RATE_LIMIT_STORE_RETRY_SECONDS
+    assert rate_limits.store.take("caller#GET /orders", 3, 1)[0]
+    assert rate_limits.table.calls == 3
+
+
+@pytest.fixture
+def emf_lines(rest_api, monkeypatch):
+    lines = []
+    monkeypatch.setattr(rest_api.metrics, "sink", lambda line: lines.append(json.loads(line)))
+    return lines
+
+
+def test_unknown_route_is_not_found(rest_api, emf_lines):
+    response = rest_api.lambda_handler(api_request("GET", "/invoices"), None)
+
+    assert response["statusCode"] == 404
+    assert "Allow" not in response["headers"]
+    assert emf_lines[0]["Route"] == "unmatched"
+
+
+def test_unsupported_method_lists_the_allowed_ones(rest_api):
+    customers = rest_api.lambda_handler(api_request("DELETE", "/customers"), None)
+    orders = rest_api.lambda_handler(api_request("PUT", "/orders"), None)
+
+    assert customers["statusCode"] == 405
+    assert customers["headers"]["Allow"] == "GET, PUT"
+    assert orders["statusCode"] == 405
+    assert orders["headers"]["Allow"] == "GET"
+
+
+def test_requests_are_counted_per_route_and_status_class(rest_api, database, emf_lines):
+    rest_api.lambda_handler(api_request("GET", "/customers", {"customer_id": "7"}), None)
+    rest_api.lambda_handler(api_request("DELETE", "/customers"), None)
+
+    ok, not_allowed = emf_lines
+    directive = ok["_aws"]["CloudWatchMetrics"][0]
+    assert {"Route", "StatusClass"} <= set(directive["Dimensions"][0])
+    assert {"Name": "Requests", "Unit": "Count"} in directive["Metrics"]
+    assert (ok["Route"], ok["StatusClass"], ok["Requests"]) == ("GET /customers", "2xx", 1)
+    assert (not_allowed["StatusClass"], not_allowed["StatusCode"]) == ("4xx", 405)
+
+
+class FakeSharedCacheTable:
+    """Items of the shared cache table, with the tombstone condition of put_item."""
+
+    exceptions = types.SimpleNamespace(
+        ConditionalCheckFailedException=ConditionalCheckFailedException
+    )
+
+    def __init__(self):
+        self.items = {}
+        self.available = True
+
+    def batch_get_item(self, RequestItems):
+        if not self.available:
+            raise OSError("DynamoDB unreachable")
+        (table_name, request), = RequestItems.items()
+        keys = [key["pk"]["S"] for key in request["Keys"]]
+        found = [self.items[key] for key in keys if key in self.items]
+        return {"Responses": {table_name: found}}
+
+    def put_item(self, TableName, Item, ConditionExpression, ExpressionAttributeValues):
+        tombstone_until = self.items.get(Item["pk"]["S"], {}).get("tombstone_until")
+        if tombstone_until and float(tombstone_until["N"]) >= float(
+            ExpressionAttributeValues[":now"]["N"]
+        ):
+            raise ConditionalCheckFailedException()
+        self.items[Item["pk"]["S"]] = Item
+
+    def batch_write_item(self, RequestItems):
+        (_, requests), = RequestItems.items()
+        for request in requests:
+            item = request["PutRequest"]["Item"]
+            self.items[item["pk"]["S"]] = item
+        return {}
+
+
+@pytest.fixture
+def shared_cache(rest_api, monkeypatch):
+    table = FakeSharedCacheTable()
+    now = [1000.0]
+    monkeypatch.setattr(rest_api, "get_client", lambda service_name: table)
+    cache = rest_api.DynamoDBSharedCache(
+        "shared-cache", ttl_seconds=60, tombstone_seconds=10, clock=lambda: now[0]
+    )
+    return types.SimpleNamespace(table=table, cache=cache, now=now)
+
+
+def test_shared_cache_hit_and_miss(shared_cache):
+    shared_cache.cache.set("v2#customers#7", '{"customer_id": 7}')
+
+    found = shared_cache.cache.get_many(["v2#customers#7", "v2#customers#8"])
+
+    assert found == {"v2#customers#7": '{"customer_id": 7}'}
+
+
+def test_shared_cache_entries_expire(shared_cache):
+    shared_cache.cache.set("v2#customers#7", '{"customer_id": 7}')
+    shared_cache.now[0] += 60
+
+    assert shared_cache.cache.get_many(["v2#customers#7"]) == {}
+
+
+def test_tombstone_keeps_stale_records_out_of_the_shared_cache(shared_cache):
+    shared_cache.cache.set("v2#customers#7", '{"customer_id": 7, "first_name": "Ada"}')
+    shared_cache.cache.invalidate_many(["v2#customers#7"])
+
+    # A read that started before the update must not cache the old row again
+    shared_cache.cache.set("v2#customers#7", '{"customer_id": 7, "first_name": "Ada"}')
+    assert shared_cache.cache.get_many(["v2#customers#7"]) == {}
+
+    shared_cache.now[0] += 11
+    shared_cache.cache.set("v2#customers#7", '{"customer_id": 7, "first_name": "Grace"}')
+    assert shared_cache.cache.get_many(["v2#customers#7"]) == {
+        "v2#customers#7": '{"customer_id": 7, "first_name": "Grace"}'
+    }
+
+
+def test_lookups_fall_back_to_the_database_and_container_cache(rest_api, shared_cache, monkeypatch):
+    shared_cache.table.available = False
+    monkeypatch.setattr(rest_api, "shared_cache", shared_cache.cache)
+    loaded = []
+
+    def loader(record_ids):
+        loaded.extend(record_ids)
+        return {record_id: f'{{"customer_id": {record_id}}}' for record_id in record_ids}
+
+    first = rest_api.cached_batch_lookup("customers", [7, 8], loader)
+    second = rest_api.cached_batch_lookup("customers", [7, 8], loader)
+
+    assert first == second == {7: '{"customer_id": 7}', 8: '{"customer_id": 8}'}
+    # The second lookup is served by the container's result cache
+    assert loaded == [7, 8]
+
+
+@pytest.fixture
+def recorded_queries(rest_api, monkeypatch):
+    """Records the queries of the handler and answers them with the row in ``rows``."""
+    queries = []
+    rows = []
+
+    def query_db(key, query, **params):
+        queries.append(types.SimpleNamespace(key=key, sql=query, params=params))
+        return rows
+
+    monkeypatch.setattr(rest_api, "query_db", query_db)
+    return types.SimpleNamespace(queries=queries, rows=rows)
+
+
+def orders_request(after=None):
+    params = {"customer_id": "7", "include": "orders", "limit": "2"}
+    if after:
+        params["after"] = after
+    return api_request("GET", "/customers", params)
+
+
+def test_customer_orders_are_fetched_newest_first_by_a_lateral_join(rest_api, recorded_queries):
+    recorded_queries.rows.append(('{"customer_id": 7, "orders": []}', 0, None, None))
+
+    rest_api.lambda_handler(orders_request(), None)
+
+    query, = recorded_queries.queries
+    assert query.key == ("customer_orders", False)
+    assert "LEFT JOIN LATERAL" in query.sql
+    # DESC puts orders without a date first, the cursor condition relies on that
+    assert "ORDER BY o.order_date DESC, o.order_id DESC" in query.sql
+    assert "NULLS LAST" not in query.sql
+    assert ":after_date" not in query.sql
+    assert query.params == {"customer_id": 7, "limit": 3, "page_size": 2}
+
+
+@pytest.mark.parametrize("last_order_date", ["2024-05-01", None])
+def test_customer_orders_cursor_round_trip(rest_api, recorded_queries, last_order_date):
+    recorded_queries.rows.append(('{"customer_id": 7, "orders": []}', 3, last_order_date, 12))
+    first_page = json.loads(rest_api.lambda_handler(orders_request(), None)["body"])
+
+    recorded_queries.rows[0] = ('{"customer_id": 7, "orders": []}', 1, None, None)
+    last_page = json.loads(
+        rest_api.lambda_handler(orders_request(first_page["next_cursor"]), None)["body"]
+    )
+
+    assert rest_api.decode_orders_cursor(7, first_page["next_cursor"]) == (last_order_date, 12)
+    query = recorded_queries.queries[1]
+    assert query.key == ("customer_orders", True)
+    assert "CAST(:after_date AS date) IS NULL" in query.sql
+    assert query.params == {
+        "customer_id": 7, "limit": 3, "page_size": 2, "after_date": last_order_date, "after_id": 12
+    }
+    assert last_page["next_cursor"] is None
+
+
+def test_customer_orders_cursor_of_another_customer_is_rejected(rest_api, recorded_queries):
+    cursor = rest_api.encode_orders_cursor(8, "2024-05-01", 12)
+
+    response = rest_api.lambda_handler(orders_request(cursor), None)
+
+    assert response["statusCode"] == 400
+    assert recorded_queries.queries == []
+
+
+class FakeBulkCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, query, values):
+        self.connection.executed.append((query, values))
+        # Rows of (customer_id, first_name, ..., fields): the ids present in the table come back
+        self.rows = [(row[0],) for row in zip(*[iter(values)] * 7) if row[0] in self.connection.ids]
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeBulkConnection(FakeConnection):
+    def __init__(self, ids):
+        super().__init__()
+        self.ids = ids
+        self.executed = []
+
+    def cursor(self):
+        return FakeBulkCursor(self)
+
+
+@pytest.fixture
+def bulk_database(rest_api, monkeypatch):
+    manager = rest_api.ConnectionManager("db.example", 5432, "postgres")
+    conn = FakeBulkConnection(ids={1, 2})
+    monkeypatch.setattr(manager, "_connect", lambda: conn)
+    monkeypatch.setattr(rest_api, "db_connections", manager)
+    return conn
+
+
+def bulk_request(records):
+    return api_request("PUT", "/customers", body=json.dumps(records))
+
+
+def test_bulk_update_is_one_update_from_values(rest_api, bulk_database):
+    records = [
+        {"customer_id": 1, "email": "ada@example.com"},
+        {"customer_id": 2, "first_name": "Grace", "phone": "555"},
+        {"customer_id": 3, "address": "Nowhere"},
+    ]
+
+    response = rest_api.lambda_handler(bulk_request(records), None)
+
+    assert json.loads(response["body"]) == {"updated": [1, 2], "not_found": [3]}
+    (query, values), = bulk_database.executed
+    assert "FROM (VALUES (" in query
+    assert query.count("::integer") == 3
+    assert "AS v(customer_id, first_name, last_name, email, phone, address, fields)" in query
+    assert values[:7] == [1, None, None, "ada@example.com", None, None, ["email"]]
+    assert values[7:14] == [2, "Grace", None, None, "555", None, ["first_name", "phone"]]
+
+
+def test_bulk_update_keeps_the_columns_a_record_leaves_out(rest_api, bulk_database):
+    rest_api.lambda_handler(bulk_request([{"customer_id": 1, "phone": "555"}]), None)
+
+    (query, values), = bulk_database.executed
+    # Omitted columns are sent as NULL, the fields array decides which ones are written
+    assert values == [1, None, None, None, "555", None, ["phone"]]
+    assert "email = CASE WHEN 'email' = ANY(v.fields) THEN v.email ELSE c.email END" in query
+
+
+@pytest.mark.parametrize(
+    "records",
+    [
+        [],
+        [{"customer_id": 1, "email": "a@example.com"}, {"customer_id": 1, "phone": "555"}],
+        [{"customer_id": "1", "email": "a@example.com"}],
+        [{"customer_id": 1}],
+        [{"customer_id": 1, "password": "secret"}],
+    ],
+)
+def test_invalid_bulk_update_is_rejected(rest_api, bulk_database, records):
+    response = rest_api.lambda_handler(bulk_request(records), None)
+
+    assert response["statusCode"] == 400
+    assert bulk_database.executed == []
+
+
+def test_oversized_bulk_update_is_rejected(rest_api, bulk_database, monkeypatch):
+    monkeypatch.setattr(rest_api, "BULK_UPDATE_MAX_RECORDS", 2)
+    records = [{"customer_id": customer_id, "phone": "555"} for customer_id in range(1, 4)]
+
+    response = rest_api.lambda_handler(bulk_request(records), None)
+
+    assert response["statusCode"] == 400
+    assert "maximum is 2" in json.loads(response["body"])["error"]
+    assert bulk_database.executed == []
+
+
+def list_request(after=None):
+    params = {"limit": "2"}
+    if after:
+        params["after"] = after
+    return api_request("GET", "/orders", params)
+
+
+def test_listing_fetches_one_extra_row_to_find_the_next_page(rest_api, recorded_queries):
+    recorded_queries.rows.append(('[{"order_id": 1}, {"order_id": 2}]', 3, 2))
+    first_page = json.loads(rest_api.lambda_handler(list_request(), None)["body"])
+
+    recorded_queries.rows[0] = ('[{"order_id": 3}]', 1, 3)
+    last_page = json.loads(
+        rest_api.lambda_handler(list_request(first_page["next_cursor"]), None)["body"]
+    )
+
+    first_query, last_query = recorded_queries.queries
+    assert first_query.params == {"limit": 3, "page_size": 2}
+    assert ":after_id" not in first_query.sql
+    assert rest_api.decode_cursor("orders", first_page["next_cursor"]) == 2
+    assert last_query.key == ("list", "orders", True)
+    assert last_query.params == {"limit": 3, "page_size": 2, "after_id": 2}
+    assert last_page == {"items": [{"order_id": 3}], "next_cursor": None}
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "not-a-cursor",
+        base64.urlsafe_b64encode(b'{"t": "orders", "id": "x"}').decode(),
+        base64.urlsafe_b64encode(b'{"t": "customers", "id": 2}').decode(),
+    ],
+)
+def test_tampered_list_cursor_is_rejected(rest_api, recorded_queries, cursor):
+    response = rest_api.lambda_handler(list_request(cursor), None)
+
+    assert response["statusCode"] == 400
+    assert recorded_queries.queries == []
+
+
+def test_batch_lookup_reports_each_id_in_request_order(rest_api, recorded_queries):
+    recorded_queries.rows.extend([(9, '{"customer_id": 9}'), (7, '{"customer_id": 7}')])
+    request = api_request("GET", "/customers", {"customer_id": "7,8,9,7"})
+
+    response = rest_api.lambda_handler(request, None)
+    cached = rest_api.lambda_handler(api_request("GET", "/customers", {"customer_id": "9,7"}), None)
+
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"])["items"] == [
+        {"customer_id": 7, "status": 200, "data": {"customer_id": 7}},
+        {"customer_id": 8, "status": 404, "error": "Customer not found"},
+        {"customer_id": 9, "status": 200, "data": {"customer_id": 9}},
+    ]
+    # Duplicates are dropped and all IDs are fetched with one query; found rows are then cached
+    query, = recorded_queries.queries
+    assert query.params == {"customer_ids": [7, 8, 9]}
+    assert [item["customer_id"] for item in json.loads(cached["body"])["items"]] == [9, 7]
+
+
+@pytest.mark.parametrize("raw_ids", ["7,x", ",", "1,2,3"])
+def test_invalid_batch_lookup_is_rejected(rest_api, recorded_queries, monkeypatch, raw_ids):
+    monkeypatch.setattr(rest_api, "BATCH_MAX_IDS", 2)
+
+    response = rest_api.lambda_handler(api_request("GET", "/orders", {"order_id": raw_ids}), None)
+
+    assert response["statusCode"] == 400
+    assert recorded_queries.queries == []
+
+
+def test_result_cache_evicts_the_least_recently_used_entry(rest_api):
+    cache = rest_api.LRUCache(max_entries=2, ttl_seconds=30)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+    assert cache.stats() == {"size": 2, "hits": 3, "misses": 1, "evictions": 1}
+
+
+def test_result_cache_entries_expire(rest_api, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(rest_api.time, "monotonic", lambda: now[0])
+    cache = rest_api.LRUCache(max_entries=2, ttl_seconds=30)
+    cache.set("a", 1)
+    now[0] += 30
+
+    assert cache.get("a") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_result_cache_can_be_disabled(rest_api):
+    cache = rest_api.LRUCache(max_entries=0, ttl_seconds=30)
+    cache.set("a", 1)
+
+    assert cache.get("a") is None
+    assert cache.stats()["size"] == 0
+
+
+@pytest.fixture
+def read_router(rest_api, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(rest_api.time, "monotonic", lambda: now[0])
+    router = rest_api.ReadRouter("primary", "reader", pin_seconds=5)
+    return types.SimpleNamespace(router=router, now=now)
+
+
+def test_reads_go_to_the_reader_and_writes_to_the_primary(read_router):
+    assert read_router.router.route("GET", "token-a") == "reader"
+    assert read_router.router.route("PUT", "token-a") == "primary"
+    assert read_router.router.connections() == "primary"
+
+
+def test_writer_reads_its_writes_from_the_primary_for_a_while(read_router):
+    read_router.router.record_write("token-a")
+
+    assert read_router.router.route("GET", "token-a") == "primary"
+    assert read_router.router.route("GET", "token-b") == "reader"
+    read_router.now[0] += 5
+    assert read_router.router.route("GET", "token-a") == "reader"
+
+
+def test_everything_reads_from_the_primary_without_a_reader(rest_api):
+    router = rest_api.ReadRouter("primary", None)
+    router.record_write("token-a")
+
+    assert router.route("GET", "token-a") == "primary"
+    assert router._last_writes == {}
+
+
+def test_read_your_writes_pin_can_be_disabled(rest_api):
+    router = rest_api.ReadRouter("primary", "reader", pin_seconds=0)
+    router.record_write("token-a")
+
+    assert router.route("GET", "token-a") == "reader"